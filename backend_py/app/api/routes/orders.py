@@ -9,7 +9,7 @@ from decimal import Decimal
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, Field
 from sqlalchemy import or_, select
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, defer
 
 from app.api.dependencies import get_current_user_telegram_id
 from app.core.bot_username import get_bot_username
@@ -213,6 +213,8 @@ def list_orders(
         orders = (
             db.execute(
                 select(Order)
+                # Post body and revision comment are not part of the list response
+                .options(defer(Order.post_text_html), defer(Order.seller_revision_comment))
                 .where(or_(Order.buyer_telegram_id == telegram_id, Order.seller_telegram_id == telegram_id))
                 .order_by(Order.created_at.desc())
             )
@@ -16,6 +16,7 @@ from sqlalchemy.orm import Session
 from app.api.dependencies import get_current_user_telegram_id
 from app.db.models import TonTransaction, TonWallet, TonWithdrawal, UserBalance
 from app.db.session import get_db
+from app.services.ton_deposit_scanner import address_hash_part, invalidate_wallet_owners
 
 router = APIRouter(prefix="/api/wallet", tags=["wallet"])
 
@@ -113,7 +114,9 @@ async def connect_wallet(
         existing.disconnected_at = None
         existing.wallet_name = request.walletName or existing.wallet_name
         existing.friendly_address = request.friendlyAddress or existing.friendly_address
+        existing.hash_part = address_hash_part(existing.address)
         db.commit()
+        invalidate_wallet_owners()
 
         return ConnectWalletResponse(
             ok=True,
@@ -134,12 +137,14 @@ async def connect_wallet(
         telegram_id=telegram_id,
         address=request.address,
         friendly_address=request.friendlyAddress,
+        hash_part=address_hash_part(request.address),
         wallet_name=request.walletName,
         is_primary=True,
         is_active=True,
     )
     db.add(wallet)
     db.commit()
+    invalidate_wallet_owners()
     db.refresh(wallet)
 
     return ConnectWalletResponse(
@@ -168,6 +173,7 @@ async def disconnect_wallet(
         .values(is_active=False, is_primary=False, disconnected_at=datetime.utcnow())
     )
     db.commit()
+    invalidate_wallet_owners()
 
     return DisconnectWalletResponse(ok=True)
 
@@ -41,6 +41,8 @@ class Settings(BaseSettings):
     stats_collection_enabled: bool = False
     # Collection interval in hours
     stats_collection_interval_hours: int = 4
+    # Channels collected in parallel per run
+    stats_concurrency: int = 8
     
     # OpenAI/OpenRouter API settings for AI insights
     # Use sk-or-... for OpenRouter, sk-... for OpenAI
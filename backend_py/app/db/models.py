@@ -3,8 +3,8 @@ from __future__ import annotations
 from datetime import datetime
 from decimal import Decimal
 
-from sqlalchemy import BigInteger, Boolean, DateTime, Integer, Numeric, String, Text, func
-from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import BigInteger, Boolean, DateTime, Integer, Numeric, String, Text, UniqueConstraint, func
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.db.base import Base
 
@@ -193,6 +193,9 @@ class TonWallet(Base):
     # Friendly address (user-friendly format)
     friendly_address: Mapped[str | None] = mapped_column(String(128), nullable=True)
 
+    # Account hash part (hex, format-independent) for deposit sender lookup
+    hash_part: Mapped[str | None] = mapped_column(String(64), nullable=True, index=True)
+
     # Is this the primary wallet for the user?
     is_primary: Mapped[bool] = mapped_column(Boolean, default=True)
 
@@ -294,7 +297,7 @@ class TonWithdrawal(Base):
     amount: Mapped[Decimal] = mapped_column(Numeric(18, 9))  # TON amount
     memo: Mapped[str | None] = mapped_column(String(256), nullable=True)  # destination address
     tx_type: Mapped[str] = mapped_column(String(16), default="withdrawal")
-    status: Mapped[str] = mapped_column(String(16), default="pending")  # pending, completed, failed
+    status: Mapped[str] = mapped_column(String(16), default="pending")  # pending, processing, sent, completed, failed
     tx_hash: Mapped[str | None] = mapped_column(String(128), nullable=True)
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now(), nullable=False
@@ -344,7 +347,7 @@ class UsdtTransaction(Base):
 
     # deposit | withdrawal
     tx_type: Mapped[str] = mapped_column(String(16), default="deposit")
-    status: Mapped[str] = mapped_column(String(16), default="completed")  # pending, completed, failed
+    status: Mapped[str] = mapped_column(String(16), default="completed")  # pending, processing, sent (withdrawals), completed, failed
 
     # Blockchain tx hash for Tonscan link (withdrawals)
     tx_hash: Mapped[str | None] = mapped_column(String(128), nullable=True)
@@ -359,6 +362,8 @@ class UserBalance(Base):
     User balances in different currencies.
     """
     __tablename__ = "user_balances"
+    # One row per (user, currency): single index probe for lookups, target for ON CONFLICT upserts
+    __table_args__ = (UniqueConstraint("telegram_id", "currency", name="uq_user_balances_telegram_id_currency"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
 
@@ -407,6 +412,10 @@ class Channel(Base):
     username: Mapped[str | None] = mapped_column(String(64), nullable=True, index=True)
     description: Mapped[str | None] = mapped_column(Text, nullable=True)
     photo_url: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # Telegram file_unique_id of the stored photo (skip re-download when unchanged)
+    photo_file_unique_id: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    # blake2b-128 hex digest of the stored photo bytes (skip identical rewrites)
+    photo_sha: Mapped[str | None] = mapped_column(String(32), nullable=True)
 
     # Stats
     subscriber_count: Mapped[int] = mapped_column(Integer, default=0)
@@ -694,3 +703,13 @@ class Order(Base):
         onupdate=func.now(),
         nullable=False,
     )
+
+    # Read-only links for eager loading (no FK constraints on these columns)
+    channel: Mapped[Channel | None] = relationship(
+        primaryjoin="foreign(Order.channel_id) == Channel.id",
+        viewonly=True,
+    )
+    format: Mapped[ChannelAdFormat | None] = relationship(
+        primaryjoin="foreign(Order.format_id) == ChannelAdFormat.id",
+        viewonly=True,
+    )
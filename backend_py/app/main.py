@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import logging
 from pathlib import Path
 
 from fastapi import FastAPI
@@ -23,6 +24,48 @@ from app.db.base import Base
 from app.db.session import engine
 from sqlalchemy import text
 
+# Raw "0:<hex>" or 48-char base64url friendly address -> 32-byte account hash (hex).
+# Only well-formed addresses are decoded; anything else keeps a NULL hash_part.
+TON_WALLET_HASH_PART_BACKFILL = r"""
+    UPDATE ton_wallets SET hash_part = CASE
+        WHEN address LIKE '%:%' THEN lower(split_part(address, ':', 2))
+        ELSE encode(substring(decode(translate(address, '-_', '+/'), 'base64') from 3 for 32), 'hex')
+    END
+    WHERE hash_part IS NULL
+      AND (address ~ '^[A-Za-z0-9_-]{48}$' OR address ~ '^-?[0-9]+:[0-9a-fA-F]{64}$')
+"""
+
+# Duplicate (telegram_id, currency) balance rows: totals folded into the oldest row, the rest
+# deleted, so the unique index can be created
+USER_BALANCES_MERGE_DUPLICATES = """
+    WITH dup AS (
+        SELECT telegram_id, currency, min(id) AS keep_id,
+               coalesce(sum(available), 0) AS available,
+               coalesce(sum(frozen), 0) AS frozen,
+               coalesce(sum(total_deposited), 0) AS total_deposited,
+               coalesce(sum(total_withdrawn), 0) AS total_withdrawn
+        FROM user_balances
+        WHERE telegram_id IS NOT NULL AND currency IS NOT NULL
+        GROUP BY telegram_id, currency
+        HAVING count(*) > 1
+    )
+    UPDATE user_balances b SET
+        available = dup.available,
+        frozen = dup.frozen,
+        total_deposited = dup.total_deposited,
+        total_withdrawn = dup.total_withdrawn,
+        updated_at = now()
+    FROM dup
+    WHERE b.id = dup.keep_id
+"""
+USER_BALANCES_DELETE_DUPLICATES = """
+    DELETE FROM user_balances b
+    USING user_balances k
+    WHERE k.telegram_id = b.telegram_id AND k.currency = b.currency AND k.id < b.id
+"""
+
+logger = logging.getLogger(__name__)
+
 # Media directory for uploaded files
 MEDIA_DIR = Path(__file__).parent.parent / "media"
 
@@ -99,6 +142,14 @@ def create_app() -> FastAPI:
                 # Referral payouts new column
                 conn.execute(text("ALTER TABLE referral_payouts ADD COLUMN IF NOT EXISTS is_bonus BOOLEAN DEFAULT FALSE"))
                 
+                # Channel photo change detection
+                conn.execute(text("ALTER TABLE channels ADD COLUMN IF NOT EXISTS photo_file_unique_id VARCHAR(64)"))
+                conn.execute(text("ALTER TABLE channels ADD COLUMN IF NOT EXISTS photo_sha VARCHAR(32)"))
+
+                # TON wallet hash part (batched deposit sender lookup)
+                conn.execute(text("ALTER TABLE ton_wallets ADD COLUMN IF NOT EXISTS hash_part VARCHAR(64)"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_ton_wallets_hash_part ON ton_wallets (hash_part)"))
+
                 # Channel posts new columns
                 conn.execute(text("ALTER TABLE channel_posts ADD COLUMN IF NOT EXISTS full_text TEXT"))
                 conn.execute(text("ALTER TABLE channel_posts ADD COLUMN IF NOT EXISTS media_url VARCHAR(512)"))
@@ -164,6 +215,28 @@ def create_app() -> FastAPI:
         except Exception:
             # ignore in dev; schema migrations should be handled by Alembic in real prod
             pass
+        # Separate transaction: a bad address must not roll back the schema changes above
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(TON_WALLET_HASH_PART_BACKFILL))
+        except Exception:
+            logger.exception("TON wallet hash_part backfill failed; deposits from unfilled wallets will not be matched")
+
+        # Separate transaction: merge duplicate balance rows, then add the unique index.
+        # Deposit upserts use it as their ON CONFLICT target, so a failure here is logged loudly.
+        try:
+            with engine.begin() as conn:
+                if conn.execute(text("SELECT to_regclass('uq_user_balances_telegram_id_currency')")).scalar() is None:
+                    # Block balance writes until the index exists so no new duplicate slips in
+                    conn.execute(text("LOCK TABLE user_balances IN SHARE ROW EXCLUSIVE MODE"))
+                    conn.execute(text(USER_BALANCES_MERGE_DUPLICATES))
+                    conn.execute(text(USER_BALANCES_DELETE_DUPLICATES))
+                    conn.execute(text(
+                        "CREATE UNIQUE INDEX IF NOT EXISTS uq_user_balances_telegram_id_currency "
+                        "ON user_balances (telegram_id, currency)"
+                    ))
+        except Exception:
+            logger.exception("Could not create uq_user_balances_telegram_id_currency; balance upserts will fail")
 
         # Start background scheduler for stats collection
         from app.services.scheduler import start_scheduler
@@ -175,6 +248,12 @@ def create_app() -> FastAPI:
         from app.services.scheduler import stop_scheduler
         await stop_scheduler()
 
+        from app.services.tgstat_parser import close_tgstat_client
+        await close_tgstat_client()
+
+        from app.services.http_clients import close_async_http_clients
+        await close_async_http_clients()
+
     return app
 
 
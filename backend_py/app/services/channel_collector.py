@@ -733,6 +733,7 @@ class ChannelCollector:
             return
         
         now = datetime.now(timezone.utc)
+        new_rows: List[Dict[str, Any]] = []
         
         # Generate history for last 90 days
         for i in range(90):
@@ -790,18 +791,21 @@ class ChannelCollector:
                 if not existing.subscriber_count:
                     existing.subscriber_count = estimated_subs
             else:
-                history = ChannelStatsHistory(
-                    channel_id=channel_id,
-                    date=target_datetime,
-                    subscriber_count=estimated_subs,
-                    total_views=daily_views,
-                    total_posts=posts_on_day,
-                    avg_post_views=avg_views,
-                    reactions=daily_reactions,
-                    comments=daily_comments,
-                    shares=daily_shares
-                )
-                db.add(history)
+                new_rows.append({
+                    "channel_id": channel_id,
+                    "date": target_datetime,
+                    "subscriber_count": estimated_subs,
+                    "total_views": daily_views,
+                    "total_posts": posts_on_day,
+                    "avg_post_views": avg_views,
+                    "reactions": daily_reactions,
+                    "comments": daily_comments,
+                    "shares": daily_shares,
+                })
+        
+        # New days go in as one multi-row INSERT, bypassing the unit of work
+        if new_rows:
+            db.bulk_insert_mappings(ChannelStatsHistory, new_rows)
 
 
 # Global instance
@@ -7,19 +7,82 @@ The sticker set is owned by the user who added the bot.
 from __future__ import annotations
 
 import logging
+import time
 from io import BytesIO
 
 import httpx
+import orjson
 from PIL import Image
 
 from app.core.bot_username import get_bot_username
 from app.core.config import settings
+from app.services.http_clients import telegram_async_client
 
 logger = logging.getLogger(__name__)
 
 # Max size for static sticker: 512x512, PNG or WEBP
 STICKER_MAX_SIZE = 512
 
+# Sticker calls (uploads included) go through the shared Bot API client with a longer timeout
+STICKER_REQUEST_TIMEOUT_SEC = 30.0
+
+
+# set_name -> (custom_emoji_id, cached_at). Skips Bot API calls for sets created earlier.
+EMOJI_CACHE_TTL_SEC = 86400
+EMOJI_CACHE_MAX_SIZE = 1024
+_emoji_id_cache: dict[str, tuple[str, float]] = {}
+
+
+def _cache_get(set_name: str) -> str | None:
+    entry = _emoji_id_cache.get(set_name)
+    if entry is None:
+        return None
+    emoji_id, cached_at = entry
+    if time.monotonic() - cached_at > EMOJI_CACHE_TTL_SEC:
+        _emoji_id_cache.pop(set_name, None)
+        return None
+    return emoji_id
+
+
+def _cache_put(set_name: str, emoji_id: str) -> None:
+    if len(_emoji_id_cache) >= EMOJI_CACHE_MAX_SIZE:
+        # Dicts keep insertion order: drop the oldest entry
+        _emoji_id_cache.pop(next(iter(_emoji_id_cache)), None)
+    _emoji_id_cache[set_name] = (emoji_id, time.monotonic())
+
+
+async def _get_set_emoji_id(
+    client: httpx.AsyncClient, base: str, set_name: str, *, must_exist: bool
+) -> str | None:
+    """
+    Return custom_emoji_id of the first sticker in set_name, or None.
+
+    With must_exist=False a missing set is expected and not logged as a warning.
+    """
+    try:
+        get_resp = await client.get(
+            f"{base}/getStickerSet",
+            params={"name": set_name},
+            timeout=STICKER_REQUEST_TIMEOUT_SEC,
+        )
+        if get_resp.status_code != 200:
+            if must_exist:
+                logger.warning("getStickerSet failed: %s %s", get_resp.status_code, get_resp.text)
+            return None
+        get_data = orjson.loads(get_resp.content)
+        if not get_data.get("ok"):
+            if must_exist:
+                logger.warning("getStickerSet error: %s", get_data.get("description"))
+            return None
+        stickers = get_data.get("result", {}).get("stickers", [])
+        if not stickers:
+            return None
+        emoji_id = stickers[0].get("custom_emoji_id")
+        return str(emoji_id) if emoji_id else None
+    except Exception as e:
+        logger.warning("getStickerSet exception: %s", e)
+        return None
+
 
 async def create_channel_emoji_from_photo(
     bot_token: str,
@@ -32,103 +95,109 @@ async def create_channel_emoji_from_photo(
 
     Returns custom_emoji_id (str) for use in <tg-emoji emoji-id="...">, or None on failure.
     """
+    bot_username = get_bot_username()
+    set_name = f"ch{abs(chat_id)}_by_{bot_username}"
+
+    emoji_id = _cache_get(set_name)
+    if emoji_id:
+        return emoji_id
+
+    client = telegram_async_client()
+    base = f"/bot{bot_token}"
+    # Set may already exist (channel re-added): one cheap GET instead of upload + create
+    emoji_id = await _get_set_emoji_id(client, base, set_name, must_exist=False)
+    if emoji_id:
+        _cache_put(set_name, emoji_id)
+        return emoji_id
+
     try:
-        # Convert to PNG (Telegram requires PNG/WEBP for static stickers)
+        # Image.open only reads the header; pixels are decoded lazily
         img = Image.open(BytesIO(photo_bytes))
-        if img.mode in ("RGBA", "LA", "P"):
-            img = img.convert("RGBA")
+        if (
+            img.format == "PNG"
+            and max(img.size) <= STICKER_MAX_SIZE
+            and img.mode in ("RGB", "RGBA")
+        ):
+            # Already a valid static sticker: upload as is
+            png_bytes = photo_bytes
         else:
-            img = img.convert("RGB")
-        # Resize if too large
-        w, h = img.size
-        if max(w, h) > STICKER_MAX_SIZE:
-            img.thumbnail((STICKER_MAX_SIZE, STICKER_MAX_SIZE), Image.Resampling.LANCZOS)
-        buf = BytesIO()
-        img.save(buf, format="PNG", optimize=True)
-        png_bytes = buf.getvalue()
+            # Convert to PNG (Telegram requires PNG/WEBP for static stickers)
+            if img.mode in ("RGBA", "LA", "P"):
+                img = img.convert("RGBA")
+            else:
+                img = img.convert("RGB")
+            # Resize if too large
+            w, h = img.size
+            if max(w, h) > STICKER_MAX_SIZE:
+                img.thumbnail((STICKER_MAX_SIZE, STICKER_MAX_SIZE), Image.Resampling.LANCZOS)
+            buf = BytesIO()
+            # Fast DEFLATE level: file size is far below the sticker limit anyway
+            img.save(buf, format="PNG", compress_level=1)
+            png_bytes = buf.getvalue()
     except Exception as e:
         logger.warning("Failed to convert channel photo to PNG: %s", e)
         return None
 
-    bot_username = get_bot_username()
-    set_name = f"ch{abs(chat_id)}_by_{bot_username}"
-
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        base = f"https://api.telegram.org/bot{bot_token}"
-        # 1. Upload sticker file
-        try:
-            upload_resp = await client.post(
-                f"{base}/uploadStickerFile",
-                data={
-                    "user_id": owner_user_id,
-                    "sticker_format": "static",
-                },
-                files={"sticker": ("sticker.png", png_bytes, "image/png")},
-            )
-            if upload_resp.status_code != 200:
-                logger.warning("uploadStickerFile failed: %s %s", upload_resp.status_code, upload_resp.text)
-                return None
-            upload_data = upload_resp.json()
-            if not upload_data.get("ok"):
-                logger.warning("uploadStickerFile error: %s", upload_data.get("description"))
-                return None
-            file_id = upload_data["result"]["file_id"]
-        except Exception as e:
-            logger.warning("uploadStickerFile exception: %s", e)
+    # 1. Upload sticker file
+    try:
+        upload_resp = await client.post(
+            f"{base}/uploadStickerFile",
+            data={
+                "user_id": owner_user_id,
+                "sticker_format": "static",
+            },
+            files={"sticker": ("sticker.png", png_bytes, "image/png")},
+            timeout=STICKER_REQUEST_TIMEOUT_SEC,
+        )
+        if upload_resp.status_code != 200:
+            logger.warning("uploadStickerFile failed: %s %s", upload_resp.status_code, upload_resp.text)
             return None
-
-        # 2. Create sticker set with custom_emoji type
-        try:
-            create_resp = await client.post(
-                f"{base}/createNewStickerSet",
-                json={
-                    "user_id": owner_user_id,
-                    "name": set_name,
-                    "title": "Channel emoji",
-                    "sticker_type": "custom_emoji",
-                    "stickers": [
-                        {
-                            "sticker": file_id,
-                            "format": "static",
-                            "emoji_list": ["📢"],
-                        }
-                    ],
-                },
-            )
-            if create_resp.status_code != 200:
-                logger.warning("createNewStickerSet failed: %s %s", create_resp.status_code, create_resp.text)
-                return None
-            create_data = create_resp.json()
-            if not create_data.get("ok"):
-                # Set might already exist (e.g. re-add) - try to get it
-                desc = create_data.get("description", "")
-                if "STICKERSET_INVALID" in str(create_data) or "short name is occupied" in desc.lower():
-                    pass  # fall through to getStickerSet
-                else:
-                    logger.warning("createNewStickerSet error: %s", desc)
-                    return None
-        except Exception as e:
-            logger.warning("createNewStickerSet exception: %s", e)
+        upload_data = orjson.loads(upload_resp.content)
+        if not upload_data.get("ok"):
+            logger.warning("uploadStickerFile error: %s", upload_data.get("description"))
             return None
+        file_id = upload_data["result"]["file_id"]
+    except Exception as e:
+        logger.warning("uploadStickerFile exception: %s", e)
+        return None
 
-        # 3. Get sticker set to retrieve custom_emoji_id
-        try:
-            get_resp = await client.get(
-                f"{base}/getStickerSet",
-                params={"name": set_name},
-            )
-            if get_resp.status_code != 200:
-                logger.warning("getStickerSet failed: %s %s", get_resp.status_code, get_resp.text)
-                return None
-            get_data = get_resp.json()
-            if not get_data.get("ok"):
-                logger.warning("getStickerSet error: %s", get_data.get("description"))
-                return None
-            stickers = get_data.get("result", {}).get("stickers", [])
-            if not stickers:
-                return None
-            emoji_id = stickers[0].get("custom_emoji_id")
-            return str(emoji_id) if emoji_id else None
-        except Exception as e:
-            logger.warning("getStickerSet exception: %s", e)
+    # 2. Create sticker set with custom_emoji type
+    try:
+        create_resp = await client.post(
+            f"{base}/createNewStickerSet",
+            json={
+                "user_id": owner_user_id,
+                "name": set_name,
+                "title": "Channel emoji",
+                "sticker_type": "custom_emoji",
+                "stickers": [
+                    {
+                        "sticker": file_id,
+                        "format": "static",
+                        "emoji_list": ["📢"],
+                    }
+                ],
+            },
+            timeout=STICKER_REQUEST_TIMEOUT_SEC,
+        )
+        if create_resp.status_code != 200:
+            logger.warning("createNewStickerSet failed: %s %s", create_resp.status_code, create_resp.text)
             return None
+        create_data = orjson.loads(create_resp.content)
+        if not create_data.get("ok"):
+            # Set might already exist (e.g. re-add) - try to get it
+            desc = create_data.get("description", "")
+            if "STICKERSET_INVALID" in str(create_data) or "short name is occupied" in desc.lower():
+                pass  # fall through to getStickerSet
+            else:
+                logger.warning("createNewStickerSet error: %s", desc)
+                return None
+    except Exception as e:
+        logger.warning("createNewStickerSet exception: %s", e)
+        return None
+
+    # 3. Get sticker set to retrieve custom_emoji_id
+    emoji_id = await _get_set_emoji_id(client, base, set_name, must_exist=True)
+    if emoji_id:
+        _cache_put(set_name, emoji_id)
+    return emoji_id
@@ -7,13 +7,13 @@ Falls back to TGStat for initial/subscriber history data.
 from __future__ import annotations
 
 import asyncio
-import json
 import logging
 import re
 from datetime import datetime, timedelta, timezone
 from decimal import Decimal
 from typing import Any, Dict, List, Optional
 
+import orjson
 from telethon import TelegramClient
 from telethon.errors import (
     ChannelPrivateError,
@@ -30,6 +30,9 @@ from app.services.tgstat_parser import fetch_tgstat_data
 
 logger = logging.getLogger(__name__)
 
+# Telethon media class -> name, so __name__ is not rebuilt for every message
+_MEDIA_TYPE_CACHE: Dict[type, str] = {}
+
 
 class TelegramChannelParser:
     """
@@ -125,7 +128,13 @@ class TelegramChannelParser:
             messages_data = []
             cutoff_date = datetime.now(timezone.utc) - timedelta(days=days_back)
             
-            async for message in self.client.iter_messages(username, limit=limit):
+            # Telethon fetches history in batches of 100; wait_time throttles
+            # between those requests instead of after every single message.
+            async for message in self.client.iter_messages(
+                username,
+                limit=limit,
+                wait_time=settings.flood_wait_delay,
+            ):
                 # Skip old messages
                 msg_date = message.date
                 if msg_date.tzinfo is None:
@@ -140,9 +149,6 @@ class TelegramChannelParser:
                 message_data = self._extract_message_data(message)
                 if message_data:
                     messages_data.append(message_data)
-                
-                # Delay to avoid flood limits
-                await asyncio.sleep(settings.flood_wait_delay)
             
             logger.info(f"Parsed {len(messages_data)} messages from @{username}")
             return messages_data
@@ -180,7 +186,10 @@ class TelegramChannelParser:
             # Media type
             media_type = None
             if message.media:
-                media_type = type(message.media).__name__
+                media_cls = type(message.media)
+                media_type = _MEDIA_TYPE_CACHE.get(media_cls)
+                if media_type is None:
+                    media_type = _MEDIA_TYPE_CACHE.setdefault(media_cls, media_cls.__name__)
             
             # Links
             links = self._extract_links(message.text or message.raw_text or "")
@@ -193,9 +202,9 @@ class TelegramChannelParser:
                 "forwards": getattr(message, "forwards", 0) or 0,
                 "replies": replies_count,
                 "reactions_count": reactions_count,
-                "reactions_data": json.dumps(reactions_data) if reactions_data else None,
+                "reactions_data": orjson.dumps(reactions_data).decode() if reactions_data else None,
                 "media_type": media_type,
-                "links": json.dumps(links) if links else None,
+                "links": orjson.dumps(links).decode() if links else None,
             }
             
         except Exception as e:
@@ -235,16 +244,33 @@ class TelegramChannelParser:
             username = channel.username.lstrip("@")
             logger.info(f"Collecting stats for @{username}")
             
-            # 1. Get channel info from Telethon
-            channel_info = await self.get_channel_info(username)
-            if channel_info:
+            # Start the client once so the concurrent calls below don't race on it
+            if not self._started and not await self.start():
+                return False
+            
+            # 1-2. Channel info, message history and TGStat are independent
+            # network calls: run them concurrently.
+            info_task = asyncio.create_task(self.get_channel_info(username))
+            tgstat_task = asyncio.create_task(fetch_tgstat_data(username))
+            try:
+                messages = await self.parse_channel_messages(username, limit, days_back)
+            except BaseException:
+                # Don't orphan the side tasks: cancel and retrieve them before propagating
+                info_task.cancel()
+                tgstat_task.cancel()
+                await asyncio.gather(info_task, tgstat_task, return_exceptions=True)
+                raise
+            if not messages:
+                tgstat_task.cancel()  # TGStat data is unused without messages
+            channel_info, tgstat_data = await asyncio.gather(
+                info_task, tgstat_task, return_exceptions=True
+            )
+            
+            if isinstance(channel_info, dict):
                 # Update channel subscriber count
                 channel.subscriber_count = channel_info["subscribers_count"]
                 db.commit()
             
-            # 2. Parse messages from Telethon
-            messages = await self.parse_channel_messages(username, limit, days_back)
-            
             if not messages:
                 logger.warning(f"No messages parsed for @{username}")
                 return False
@@ -333,7 +359,8 @@ class TelegramChannelParser:
             
             # 6. Try to get subscriber history from TGStat
             try:
-                tgstat_data = await fetch_tgstat_data(username)
+                if isinstance(tgstat_data, BaseException):
+                    raise tgstat_data
                 if tgstat_data and tgstat_data.subscriber_history:
                     logger.info(f"Got {len(tgstat_data.subscriber_history)} days history from TGStat")
                     
@@ -353,25 +380,34 @@ class TelegramChannelParser:
                     else:
                         stats.dynamics = "stable"
                     
-                    # Save history
-                    for h in tgstat_data.subscriber_history:
-                        history_date = datetime.strptime(h.date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
-                        
-                        existing = db.query(ChannelStatsHistory).filter(
+                    # Save history: parse all dates up front, then look up
+                    # already stored days with a single range query.
+                    history = [
+                        (datetime(*map(int, h.date.split("-")), tzinfo=timezone.utc), h.subscribers)
+                        for h in tgstat_data.subscriber_history
+                    ]
+                    first_day = min(d for d, _ in history)
+                    last_day = max(d for d, _ in history)
+                    existing_days = {
+                        d.astimezone(timezone.utc).date()
+                        for (d,) in db.query(ChannelStatsHistory.date).filter(
                             ChannelStatsHistory.channel_id == channel.id,
-                            ChannelStatsHistory.date >= history_date,
-                            ChannelStatsHistory.date < history_date + timedelta(days=1),
-                        ).first()
-                        
-                        if not existing:
-                            entry = ChannelStatsHistory(
-                                channel_id=channel.id,
-                                date=history_date,
-                                subscriber_count=h.subscribers,
-                                total_views=0,
-                                total_posts=0,
-                            )
-                            db.add(entry)
+                            ChannelStatsHistory.date >= first_day,
+                            ChannelStatsHistory.date < last_day + timedelta(days=1),
+                        )
+                    }
+                    
+                    for history_date, subscribers in history:
+                        if history_date.date() in existing_days:
+                            continue
+                        existing_days.add(history_date.date())
+                        db.add(ChannelStatsHistory(
+                            channel_id=channel.id,
+                            date=history_date,
+                            subscriber_count=subscribers,
+                            total_views=0,
+                            total_posts=0,
+                        ))
                             
             except Exception as e:
                 logger.warning(f"Failed to get TGStat data: {e}")
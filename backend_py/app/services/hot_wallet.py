@@ -0,0 +1,36 @@
+"""
+Hot wallet send coordination shared by the TON and USDT withdrawal senders.
+
+Both senders sign with the same wallet. A wallet accepts one external message per
+seqno, and pytoniq reads the seqno from chain state on every transfer, so a transfer
+fired before the previous one is applied reuses its seqno and is dropped by the
+contract. Senders therefore hold HOT_WALLET_LOCK for their whole send phase and wait
+for the seqno to advance after each transfer before sending the next one.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Wallet message TTL is ~60s; past that an unapplied transfer will not land
+SEQNO_WAIT_TIMEOUT_SEC = 75.0
+SEQNO_POLL_INTERVAL_SEC = 2.0
+
+# Held by either withdrawal job from opening the hot wallet until its last transfer
+HOT_WALLET_LOCK = asyncio.Lock()
+
+
+async def wait_seqno_advance(wallet, seqno: int, timeout: float = SEQNO_WAIT_TIMEOUT_SEC) -> bool:
+    """Poll the wallet seqno until it is past `seqno` (transfer applied). False on timeout."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        await asyncio.sleep(SEQNO_POLL_INTERVAL_SEC)
+        try:
+            if await wallet.get_seqno() > seqno:
+                return True
+        except Exception as e:
+            logger.debug("Seqno poll: %s", e)
+    return False
@@ -0,0 +1,66 @@
+"""
+Shared httpx clients for deposit scanners and withdrawal senders.
+
+Scanners and senders hit TonAPI, TON Center and the Bot API every minute or two.
+One pooled AsyncClient per host (auth headers set once on the client) keeps
+TCP/TLS connections alive between polls instead of a handshake per request.
+Clients live on the app event loop and are closed on app shutdown.
+"""
+from __future__ import annotations
+
+import httpx
+
+from app.core.config import settings
+
+# keepalive_expiry covers the 1-2 min poll interval plus slack
+_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=180.0)
+
+_async_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def _get_async_client(name: str, **kwargs) -> httpx.AsyncClient:
+    client = _async_clients.get(name)
+    if client is None:
+        kwargs.setdefault("limits", _LIMITS)
+        client = _async_clients[name] = httpx.AsyncClient(**kwargs)
+    return client
+
+
+def tonapi_async_client() -> httpx.AsyncClient:
+    """
+    Async TonAPI client (base https://tonapi.io), with the API key if configured.
+    Shared by deposit scans, withdrawal hash lookups and tx verification.
+    """
+    client = _async_clients.get("tonapi")
+    if client is None:
+        api_key = (settings.tonapi_key or "").strip()
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else None
+        client = _get_async_client(
+            "tonapi",
+            base_url="https://tonapi.io",
+            timeout=30.0,
+            headers=headers,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=10, keepalive_expiry=180.0),
+        )
+    return client
+
+
+def toncenter_async_client() -> httpx.AsyncClient:
+    """Async TON Center client (base https://toncenter.com)."""
+    return _get_async_client("toncenter", base_url="https://toncenter.com", timeout=15.0)
+
+
+def telegram_async_client() -> httpx.AsyncClient:
+    """Async Bot API client (base https://api.telegram.org) for concurrent notifications."""
+    return _get_async_client(
+        "telegram",
+        base_url="https://api.telegram.org",
+        timeout=10.0,
+        limits=httpx.Limits(max_keepalive_connections=10, keepalive_expiry=180.0),
+    )
+
+
+async def close_async_http_clients() -> None:
+    for client in _async_clients.values():
+        await client.aclose()
+    _async_clients.clear()
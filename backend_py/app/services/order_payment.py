@@ -6,7 +6,7 @@ from __future__ import annotations
 import logging
 from decimal import Decimal
 
-from sqlalchemy import select
+from sqlalchemy import and_, select, update
 from sqlalchemy.orm import Session
 
 from app.db.models import Order, UserBalance
@@ -25,20 +25,24 @@ def freeze_for_order(
     """Deduct from available, add to frozen. Returns True on success."""
     db = _get_db()
     try:
-        bal = db.execute(
-            select(UserBalance)
+        # Conditional UPDATE: the balance check and the move to frozen happen
+        # atomically in one statement, without holding a lock across Python code.
+        result = db.execute(
+            update(UserBalance)
             .where(
                 UserBalance.telegram_id == telegram_id,
                 UserBalance.currency == currency,
+                UserBalance.available >= amount,
             )
-            .with_for_update()
-        ).scalar_one_or_none()
-        if not bal:
-            return False
-        if bal.available < amount:
+            .values(
+                available=UserBalance.available - amount,
+                frozen=UserBalance.frozen + amount,
+            )
+        )
+        if result.rowcount != 1:
+            # No row / insufficient funds (0), or ambiguous duplicate rows.
+            db.rollback()
             return False
-        bal.available -= amount
-        bal.frozen += amount
         db.commit()
         logger.info("Frozen %s %s for telegram_id=%s", amount, currency, telegram_id)
         return True
@@ -65,28 +69,30 @@ def release_to_seller(order_id: int) -> bool:
         curr = order.payment_currency
         amt = order.payment_amount
 
-        buyer_bal = db.execute(
-            select(UserBalance)
-            .where(
-                UserBalance.telegram_id == order.buyer_telegram_id,
-                UserBalance.currency == curr,
-            )
-            .with_for_update()
-        ).scalar_one_or_none()
+        # Lock both balances in one round trip; ordering by telegram_id keeps
+        # lock acquisition order stable across concurrent settlements.
+        balances = {
+            b.telegram_id: b
+            for b in db.execute(
+                select(UserBalance)
+                .where(
+                    UserBalance.telegram_id.in_(
+                        [order.buyer_telegram_id, order.seller_telegram_id]
+                    ),
+                    UserBalance.currency == curr,
+                )
+                .order_by(UserBalance.telegram_id)
+                .with_for_update()
+            ).scalars()
+        }
+        buyer_bal = balances.get(order.buyer_telegram_id)
         if not buyer_bal or buyer_bal.frozen < amt:
             logger.warning("Order %s: buyer frozen insufficient", order_id)
             return False
 
         buyer_bal.frozen -= amt
 
-        seller_bal = db.execute(
-            select(UserBalance)
-            .where(
-                UserBalance.telegram_id == order.seller_telegram_id,
-                UserBalance.currency == curr,
-            )
-            .with_for_update()
-        ).scalar_one_or_none()
+        seller_bal = balances.get(order.seller_telegram_id)
         if seller_bal:
             seller_bal.available += amt
         else:
@@ -113,23 +119,33 @@ def refund_to_buyer(order_id: int) -> bool:
     """On order cancelled: unfreeze from buyer, add back to available."""
     db = _get_db()
     try:
-        order = db.execute(
-            select(Order).where(Order.id == order_id)
-        ).scalar_one_or_none()
+        # Order and buyer balance in one query; only the balance row is locked.
+        row = db.execute(
+            select(Order, UserBalance)
+            .join(
+                UserBalance,
+                and_(
+                    UserBalance.telegram_id == Order.buyer_telegram_id,
+                    UserBalance.currency == Order.payment_currency,
+                ),
+            )
+            .where(Order.id == order_id)
+            .with_for_update(of=UserBalance)
+        ).first()
+        if row:
+            order, buyer_bal = row
+        else:
+            # No buyer balance row (or no order): load the order alone to decide.
+            order = db.execute(
+                select(Order).where(Order.id == order_id)
+            ).scalar_one_or_none()
+            buyer_bal = None
         if not order or not order.payment_currency or order.payment_amount is None:
             return True
 
         curr = order.payment_currency
         amt = order.payment_amount
 
-        buyer_bal = db.execute(
-            select(UserBalance)
-            .where(
-                UserBalance.telegram_id == order.buyer_telegram_id,
-                UserBalance.currency == curr,
-            )
-            .with_for_update()
-        ).scalar_one_or_none()
         if not buyer_bal or buyer_bal.frozen < amt:
             logger.warning("Order %s: buyer frozen insufficient for refund", order_id)
             return False
@@ -5,54 +5,86 @@ Uses Bot API forward_message - no Telethon needed.
 """
 from __future__ import annotations
 
+import asyncio
 import logging
 import re
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from html import escape
+from typing import NamedTuple
 
 from aiogram import Bot
-from sqlalchemy import select
+from sqlalchemy import Interval, func, select, update
+from sqlalchemy.orm import selectinload
 
 from app.core.config import settings
-from app.db.models import Channel, ChannelAdFormat, Order
+from app.db.models import ChannelAdFormat, Order
 from app.db.session import SessionLocal
+from app.services.tg_limiter import call_bot
 
 logger = logging.getLogger(__name__)
 
+_TAG_RE = re.compile(r"<[^>]+>")
+
+# Max forward checks in flight at once
+VERIFY_CONCURRENCY = 8
+
+
+class PendingOrder(NamedTuple):
+    """Plain snapshot of an order awaiting verification (no DB session attached)."""
+
+    id: int
+    channel_telegram_id: int
+    channel_title: str | None
+    message_id: int
+    duration_hours: int
+    post_text_html: str | None
+    post_media_file_id: str | None
+    buyer_telegram_id: int | None
+    seller_telegram_id: int | None
+
 
 def _normalize_text(s: str) -> str:
     """Strip HTML tags and normalize whitespace for comparison."""
     if not s:
         return ""
-    # Remove HTML tags
-    s = re.sub(r"<[^>]+>", "", s)
-    # Normalize whitespace
-    return " ".join(s.split()).strip()
+    # Remove HTML tags (forwarded message text is plain, so usually skipped)
+    if "<" in s:
+        s = _TAG_RE.sub("", s)
+    # Normalize whitespace; split() already drops leading/trailing runs
+    return " ".join(s.split())
 
 
-def _build_expected_text(order: Order, has_media: bool = False) -> str:
-    """Build expected post text as stored (body + #Реклама)."""
-    body = (order.post_text_html or "").strip()
-    full = _normalize_text(body + "\n\n#Реклама")
+@lru_cache(maxsize=2048)
+def _expected_text_for(post_text_html: str, has_media: bool) -> str:
+    """Normalized expected text; cached since pending orders are re-checked every run."""
+    full = _normalize_text(post_text_html.strip() + "\n\n#Реклама")
     if has_media and len(full) > 1024:
         return (full[:1000] + "...").strip()
     return full
 
 
-def _content_matches(expected: str, current: str, order: Order) -> bool:
+def _build_expected_text(order: Order | PendingOrder, has_media: bool = False) -> str:
+    """Build expected post text as stored (body + #Реклама)."""
+    return _expected_text_for(order.post_text_html or "", has_media)
+
+
+def _content_matches(expected: str, current: str, order: Order | PendingOrder) -> bool:
     """Check if current channel content matches what we stored."""
-    if not expected:
-        return True
+    # Common case first: post unchanged
     if expected == current:
         return True
+    if not expected:
+        return True
     if not current:
         return False
-    if order.post_media_file_id and len(expected) > 1024:
-        truncated = (expected[:1000] + "...").strip()
-        if current == truncated:
-            return True
-        if len(current) <= 1024 and expected.startswith(current.rstrip(".")):
-            return True
-    return False
+    # Caption truncation only applies to media posts with long text; any
+    # accepted truncated caption is at most 1024 chars
+    if not order.post_media_file_id or len(expected) <= 1024 or len(current) > 1024:
+        return False
+    if current == (expected[:1000] + "...").strip():
+        return True
+    return expected.startswith(current.rstrip("."))
 
 
 async def _fetch_post_content(bot: Bot, channel_telegram_id: int, message_id: int) -> tuple[bool, str]:
@@ -64,17 +96,21 @@ async def _fetch_post_content(bot: Bot, channel_telegram_id: int, message_id: in
     if not verification_chat_id:
         return False, ""
     try:
-        fwd = await bot.forward_message(
-            chat_id=verification_chat_id,
-            from_chat_id=channel_telegram_id,
-            message_id=message_id,
+        fwd = await call_bot(
+            lambda: bot.forward_message(
+                chat_id=verification_chat_id,
+                from_chat_id=channel_telegram_id,
+                message_id=message_id,
+            )
         )
         text = ""
         if fwd:
             text = (fwd.text or fwd.caption or "")
             if fwd.message_id:
                 try:
-                    await bot.delete_message(chat_id=verification_chat_id, message_id=fwd.message_id)
+                    await call_bot(
+                        lambda: bot.delete_message(chat_id=verification_chat_id, message_id=fwd.message_id)
+                    )
                 except Exception:
                     pass
         return True, _normalize_text(text)
@@ -83,9 +119,9 @@ async def _fetch_post_content(bot: Bot, channel_telegram_id: int, message_id: in
         return False, ""
 
 
-async def _notify_post_edited(bot: Bot, order: Order, channel: Channel) -> None:
+async def _notify_post_edited(bot: Bot, order: PendingOrder) -> None:
     """Notify buyer and seller that the post was edited by channel owner."""
-    title = (channel.title or "").replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    title = escape(order.channel_title or "", quote=False)
     msg = (
         f'<tg-emoji emoji-id="5447644880824181073">⚠️</tg-emoji> <b>Пост был изменён</b>\n\n'
         f"<b>Владелец канала «</b><b><i>{title}</i>» изменил или удалил рекламный пост до истечения срока размещения. </b>\n"
@@ -93,66 +129,109 @@ async def _notify_post_edited(bot: Bot, order: Order, channel: Channel) -> None:
     )
     try:
         if order.buyer_telegram_id:
-            await bot.send_message(order.buyer_telegram_id, msg, parse_mode="HTML")
+            await call_bot(
+                lambda: bot.send_message(order.buyer_telegram_id, msg, parse_mode="HTML"),
+                chat_id=order.buyer_telegram_id,
+            )
     except Exception as e:
         logger.warning("Notify buyer post edited: %s", e)
     try:
         seller_id = order.seller_telegram_id
         if seller_id and seller_id != order.buyer_telegram_id:
-            await bot.send_message(seller_id, msg, parse_mode="HTML")
+            await call_bot(
+                lambda: bot.send_message(seller_id, msg, parse_mode="HTML"),
+                chat_id=seller_id,
+            )
     except Exception as e:
         logger.warning("Notify seller post edited: %s", e)
 
 
-async def verify_pending_orders(bot: Bot) -> int:
-    """
-    Find orders past duration_hours, verify post is still in channel (not deleted).
-    Returns count of newly verified orders.
-    """
+def _fetch_pending_orders_sync(now: datetime) -> list[PendingOrder]:
+    """Load orders whose placement period is over, as plain snapshots."""
     db = SessionLocal()
-    verified_count = 0
-    now = datetime.now(timezone.utc)
-
     try:
+        # Only orders whose placement period is over (1 min grace); formats
+        # missing from the DB default to 24h, as before.
+        duration = func.make_interval(
+            0, 0, 0, 0, func.coalesce(ChannelAdFormat.duration_hours, 24), type_=Interval
+        )
         orders = (
             db.execute(
-                select(Order).where(
+                select(Order)
+                .outerjoin(ChannelAdFormat, ChannelAdFormat.id == Order.format_id)
+                .options(selectinload(Order.format), selectinload(Order.channel))
+                .where(
                     Order.status == "done",
                     Order.done_at.is_not(None),
                     Order.published_channel_message_id.is_not(None),
                     Order.verified_at.is_(None),
+                    Order.done_at + duration <= now + timedelta(seconds=60),
                 )
             )
         ).scalars().all()
 
+        pending = []
         for order in orders:
-            fmt = (
-                db.execute(select(ChannelAdFormat).where(ChannelAdFormat.id == order.format_id))
-            ).scalar_one_or_none()
-            duration_hours = fmt.duration_hours if fmt else 24
-
-            if not order.done_at:
-                continue
-            done_at = order.done_at
-            if done_at.tzinfo is None:
-                done_at = done_at.replace(tzinfo=timezone.utc)
-            elapsed = (now - done_at).total_seconds()
-            required = duration_hours * 3600
-            if elapsed < required - 60:
-                continue
-
-            channel = (
-                db.execute(select(Channel).where(Channel.id == order.channel_id))
-            ).scalar_one_or_none()
+            channel = order.channel
             if not channel:
                 logger.warning("Order %s: channel not found", order.id)
                 continue
-
-            exists, current_text = await _fetch_post_content(
-                bot, channel.telegram_id, order.published_channel_message_id
+            pending.append(
+                PendingOrder(
+                    id=order.id,
+                    channel_telegram_id=channel.telegram_id,
+                    channel_title=channel.title,
+                    message_id=order.published_channel_message_id,
+                    duration_hours=order.format.duration_hours if order.format else 24,
+                    post_text_html=order.post_text_html,
+                    post_media_file_id=order.post_media_file_id,
+                    buyer_telegram_id=order.buyer_telegram_id,
+                    seller_telegram_id=order.seller_telegram_id,
+                )
             )
+        return pending
+    finally:
+        db.close()
+
+
+def _mark_verified_sync(order_ids: list[int], now: datetime) -> None:
+    """Set verified_at for a batch of orders in one UPDATE."""
+    db = SessionLocal()
+    try:
+        db.execute(update(Order).where(Order.id.in_(order_ids)).values(verified_at=now))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def verify_pending_orders(bot: Bot) -> int:
+    """
+    Find orders past duration_hours, verify post is still in channel (not deleted).
+    Returns count of newly verified orders.
+    DB work runs in a worker thread so it does not block the event loop.
+    """
+    now = datetime.now(timezone.utc)
+
+    try:
+        eligible = await asyncio.to_thread(_fetch_pending_orders_sync, now)
+
+        # Forward checks are independent Bot API round trips: run a few at a
+        # time, well under the global bot rate limit.
+        sem = asyncio.Semaphore(VERIFY_CONCURRENCY)
+
+        async def _check(order: PendingOrder) -> tuple[bool, str]:
+            async with sem:
+                return await _fetch_post_content(bot, order.channel_telegram_id, order.message_id)
+
+        results = await asyncio.gather(*(_check(o) for o in eligible))
+
+        verified_ids: list[int] = []
+        for order, (exists, current_text) in zip(eligible, results):
             if not exists:
-                logger.warning("Order %s: post missing in channel %s", order.id, channel.title)
+                logger.warning("Order %s: post missing in channel %s", order.id, order.channel_title)
                 continue
             has_media = bool(order.post_media_file_id)
             expected = _build_expected_text(order, has_media)
@@ -160,21 +239,21 @@ async def verify_pending_orders(bot: Bot) -> int:
                 logger.warning(
                     "Order %s: post was edited in channel %s (expected len=%s, got len=%s)",
                     order.id,
-                    channel.title,
+                    order.channel_title,
                     len(expected),
                     len(current_text),
                 )
-                await _notify_post_edited(bot, order, channel)
+                await _notify_post_edited(bot, order)
                 continue
-            order.verified_at = now
-            db.commit()
-            verified_count += 1
-            logger.info("Order %s verified: post unchanged after %sh", order.id, duration_hours)
+            verified_ids.append(order.id)
+            logger.info("Order %s verified: post unchanged after %sh", order.id, order.duration_hours)
+
+        # One write for the whole batch
+        if verified_ids:
+            await asyncio.to_thread(_mark_verified_sync, verified_ids, now)
 
     except Exception as e:
         logger.exception("Order verification failed: %s", e)
-        db.rollback()
-    finally:
-        db.close()
+        return 0
 
-    return verified_count
+    return len(verified_ids)
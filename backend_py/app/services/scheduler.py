@@ -10,7 +10,10 @@ Uses APScheduler for running background tasks like:
 from __future__ import annotations
 
 import asyncio
+import hashlib
 import logging
+import os
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 import httpx
@@ -18,14 +21,39 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
 from app.core.config import settings
+from app.services.tg_limiter import bot_api_request
 
 logger = logging.getLogger(__name__)
 
 # Directory for storing channel photos (served at /media/channels/)
 CHANNELS_PHOTO_DIR = Path(__file__).resolve().parent.parent.parent / "media" / "channels"
 
+# Channels updated in parallel by update_channel_photos (Bot API limiter still applies)
+CHANNEL_UPDATE_CONCURRENCY = 10
+
 scheduler = AsyncIOScheduler()
 
+# Bot reused across verify_order_posts runs (keeps its aiohttp session); closed in stop_scheduler
+_verify_bot = None
+
+
+def _get_verify_bot():
+    global _verify_bot
+    if _verify_bot is None:
+        from aiogram import Bot
+        _verify_bot = Bot(token=settings.tg_bot_token)
+    return _verify_bot
+
+
+@asynccontextmanager
+async def _client_or_new(client: httpx.AsyncClient | None):
+    """Yield the given client, or a short-lived one that is closed afterwards."""
+    if client is not None:
+        yield client
+        return
+    async with httpx.AsyncClient(timeout=10.0) as new_client:
+        yield new_client
+
 
 async def collect_channel_stats():
     """Job: Collect statistics for all channels using Telethon."""
@@ -73,20 +101,35 @@ def setup_scheduler():
             f"Stats collection scheduled every {settings.stats_collection_interval_hours} hours"
         )
 
-    # Add channel info update job (runs every 12 hours)
+    # Add channel info update job (runs weekly). Title/photo changes arrive as channel
+    # service messages handled by the bot; this poll is the safety net.
     scheduler.add_job(
         update_channel_photos,
-        trigger=IntervalTrigger(hours=12),
+        trigger=IntervalTrigger(weeks=1),
         id="update_channel_photos",
         name="Update channel info (photo, title, username)",
         replace_existing=True,
     )
 
+    usdt_wallet = (getattr(settings, "usdt_deposit_wallet", None) or "").strip()
+    ton_wallet = (getattr(settings, "ton_deposit_wallet", None) or "").strip()
+    if usdt_wallet and ton_wallet:
+        # Both wallets configured: one poller for USDT + TON deposits (runs every 1 min)
+        from app.services.wallet_deposit_scanner import scan_wallet_deposits
+        scheduler.add_job(
+            scan_wallet_deposits,
+            trigger=IntervalTrigger(minutes=1),
+            id="scan_wallet_deposits",
+            name="Scan USDT + TON deposits",
+            replace_existing=True,
+        )
+        logger.info("Wallet deposit scanner (USDT + TON) scheduled every 1 minute")
+
     # USDT deposit scanner (runs every 1 min when wallet configured)
-    if (getattr(settings, "usdt_deposit_wallet", None) or "").strip():
-        from app.services.usdt_deposit_scanner import scan_usdt_deposits_async
+    elif usdt_wallet:
+        from app.services.usdt_deposit_scanner import scan_usdt_deposits
         scheduler.add_job(
-            scan_usdt_deposits_async,
+            scan_usdt_deposits,
             trigger=IntervalTrigger(minutes=1),
             id="scan_usdt_deposits",
             name="Scan USDT deposits (TON)",
@@ -95,10 +138,10 @@ def setup_scheduler():
         logger.info("USDT deposit scanner scheduled every 1 minute")
 
     # TON deposit scanner (runs every 1 min when wallet configured)
-    if (getattr(settings, "ton_deposit_wallet", None) or "").strip():
-        from app.services.ton_deposit_scanner import scan_ton_deposits_async
+    elif ton_wallet:
+        from app.services.ton_deposit_scanner import scan_ton_deposits
         scheduler.add_job(
-            scan_ton_deposits_async,
+            scan_ton_deposits,
             trigger=IntervalTrigger(minutes=1),
             id="scan_ton_deposits",
             name="Scan TON deposits (by connected wallet)",
@@ -145,7 +188,7 @@ def setup_scheduler():
     else:
         logger.info("Order verification disabled (AD_VERIFICATION_CHANNEL_ID not set)")
 
-    logger.info("Channel info update (photo, title, username) scheduled every 12 hours")
+    logger.info("Channel info update (photo, title, username) scheduled weekly")
 
 
 async def start_scheduler():
@@ -163,11 +206,17 @@ async def start_scheduler():
         logger.info("Scheduler started (stats collection disabled)")
 
 
-async def update_single_channel_info(channel: Channel, db, update_posts_media: bool = True) -> dict[str, int]:
+async def update_single_channel_info(
+    channel: Channel,
+    db,
+    update_posts_media: bool = True,
+    client: httpx.AsyncClient | None = None,
+) -> dict[str, int]:
     """
     Update photo URL, title, username, and subscriber count for a single channel.
     Uses Telegram Bot API: getChat, getChatMemberCount.
     Optionally update media_url for top posts.
+    Pass `client` to reuse one connection pool across many channels.
 
     Returns dict with counts: {'photos': 0, 'titles': 0, 'usernames': 0, 'subscribers': 0, 'posts_media': 0}
     """
@@ -187,10 +236,12 @@ async def update_single_channel_info(channel: Channel, db, update_posts_media: b
         bot_token = settings.tg_bot_token
         chat_id = channel.telegram_id
 
-        async with httpx.AsyncClient(timeout=10.0) as client:
+        async with _client_or_new(client) as client:
             # 1. Get subscriber count (getChatMemberCount)
             try:
-                member_resp = await client.get(
+                member_resp = await bot_api_request(
+                    client,
+                    "GET",
                     f"https://api.telegram.org/bot{bot_token}/getChatMemberCount",
                     params={"chat_id": chat_id},
                 )
@@ -217,7 +268,9 @@ async def update_single_channel_info(channel: Channel, db, update_posts_media: b
                 logger.warning(f"getChatMemberCount failed for channel {channel.id}: {e}")
 
             # Get chat info
-            response = await client.get(
+            response = await bot_api_request(
+                client,
+                "GET",
                 f"https://api.telegram.org/bot{bot_token}/getChat",
                 params={"chat_id": chat_id}
             )
@@ -247,8 +300,19 @@ async def update_single_channel_info(channel: Channel, db, update_posts_media: b
                     # Update photo if available: download and store on disk, save path in DB
                     if "photo" in chat_info:
                         photo = chat_info["photo"]
-                        if photo.get("big_file_id"):
-                            file_response = await client.get(
+                        unique_id = photo.get("big_file_unique_id")
+                        # Same Telegram photo and our stored copy is still on disk: skip the download
+                        photo_unchanged = bool(
+                            unique_id
+                            and unique_id == channel.photo_file_unique_id
+                            and channel.photo_url
+                            and channel.photo_url.startswith("/media/channels/")
+                            and (CHANNELS_PHOTO_DIR / Path(channel.photo_url).name).exists()
+                        )
+                        if photo.get("big_file_id") and not photo_unchanged:
+                            file_response = await bot_api_request(
+                                client,
+                                "GET",
                                 f"https://api.telegram.org/bot{bot_token}/getFile",
                                 params={"file_id": photo["big_file_id"]}
                             )
@@ -259,15 +323,34 @@ async def update_single_channel_info(channel: Channel, db, update_posts_media: b
                                     if file_path:
                                         # Download file content
                                         file_url = f"https://api.telegram.org/file/bot{bot_token}/{file_path}"
-                                        file_resp = await client.get(file_url)
-                                        if file_resp.status_code == 200 and file_resp.content:
-                                            CHANNELS_PHOTO_DIR.mkdir(parents=True, exist_ok=True)
-                                            ext = Path(file_path).suffix.lstrip(".") or "jpg"
-                                            if ext not in ("jpg", "jpeg", "png", "webp"):
-                                                ext = "jpg"
-                                            local_path = CHANNELS_PHOTO_DIR / f"{channel.id}.{ext}"
-                                            local_path.write_bytes(file_resp.content)
+                                        CHANNELS_PHOTO_DIR.mkdir(parents=True, exist_ok=True)
+                                        ext = Path(file_path).suffix.lstrip(".") or "jpg"
+                                        if ext not in ("jpg", "jpeg", "png", "webp"):
+                                            ext = "jpg"
+                                        local_path = CHANNELS_PHOTO_DIR / f"{channel.id}.{ext}"
+                                        # Stream to a temp file while hashing, so the image is never held in memory
+                                        tmp_path = local_path.with_name(local_path.name + ".part")
+                                        hasher = hashlib.blake2b(digest_size=16)
+                                        size = 0
+                                        async with client.stream("GET", file_url) as file_resp:
+                                            if file_resp.status_code == 200:
+                                                with open(tmp_path, "wb") as f:
+                                                    async for chunk in file_resp.aiter_bytes(64 * 1024):
+                                                        hasher.update(chunk)
+                                                        f.write(chunk)
+                                                        size += len(chunk)
+                                        photo_sha = hasher.hexdigest() if size else None
+                                        if photo_sha and (photo_sha != channel.photo_sha or not local_path.exists()):
+                                            os.replace(tmp_path, local_path)
+                                            channel.photo_sha = photo_sha
+                                            db.commit()
+                                        else:
+                                            tmp_path.unlink(missing_ok=True)
+                                        if photo_sha:
                                             new_url = f"/media/channels/{channel.id}.{ext}"
+                                            if unique_id and unique_id != channel.photo_file_unique_id:
+                                                channel.photo_file_unique_id = unique_id
+                                                db.commit()
                                             if new_url != channel.photo_url:
                                                 channel.photo_url = new_url
                                                 updated_photos = 1
@@ -277,9 +360,9 @@ async def update_single_channel_info(channel: Channel, db, update_posts_media: b
                     if updated_photos or updated_titles or updated_usernames:
                         logger.info(f"Channel {channel.id} updated: photos={updated_photos}, titles={updated_titles}, usernames={updated_usernames}")
                 
-                # Update media_url for top posts if requested
-                if update_posts_media:
-                    updated_posts_media = await update_top_posts_media(channel, db)
+                    # Update media_url for top posts if requested
+                    if update_posts_media:
+                        updated_posts_media = await update_top_posts_media(channel, db)
                 else:
                     error_desc = data.get("description", "Unknown error") if data else "No response data"
                     logger.warning(f"Telegram API returned error for channel {channel.id}: {error_desc}")
@@ -324,28 +407,33 @@ async def update_top_posts_media(channel: Channel, db, limit: int = 10) -> int:
     updated_count = 0
     
     try:
-        # Get top posts by views for this channel that have media
-        # Priority: posts with has_media=True but missing media_url
-        top_posts_missing_url = db.query(ChannelPost).filter(
+        from sqlalchemy import case, func, or_
+
+        # Nothing to do when every media post already has a proxy media_url
+        needs_work = db.query(func.count(ChannelPost.id)).filter(
             ChannelPost.channel_id == channel.id,
             ChannelPost.has_media == True,
-            (ChannelPost.media_url.is_(None) | (ChannelPost.media_url == ""))
-        ).order_by(ChannelPost.views.desc()).limit(limit).all()
-        
-        # Also get top posts overall (even if they have media_url, we want to ensure it's correct)
-        if len(top_posts_missing_url) < limit:
-            top_posts_with_media = db.query(ChannelPost).filter(
-                ChannelPost.channel_id == channel.id,
-                ChannelPost.has_media == True,
-                ChannelPost.media_url.isnot(None),
-                ChannelPost.media_url != ""
-            ).order_by(ChannelPost.views.desc()).limit(limit - len(top_posts_missing_url)).all()
-            
-            # Combine lists, avoiding duplicates
-            existing_ids = {p.message_id for p in top_posts_missing_url}
-            top_posts = list(top_posts_missing_url) + [p for p in top_posts_with_media if p.message_id not in existing_ids]
-        else:
-            top_posts = top_posts_missing_url
+            or_(
+                ChannelPost.media_url.is_(None),
+                ChannelPost.media_url == "",
+                ~ChannelPost.media_url.startswith("/api/media/channel/"),
+            ),
+        ).scalar()
+        if not needs_work:
+            return 0
+
+        # Get top posts by views for this channel that have media in one query.
+        # Priority: posts with has_media=True but missing media_url, then the rest
+        # (even if they have media_url, we want to ensure it's correct)
+        missing_url_first = case(
+            (ChannelPost.media_url.is_(None), 0),
+            (ChannelPost.media_url == "", 0),
+            else_=1,
+        )
+        top_posts = db.query(ChannelPost).filter(
+            ChannelPost.channel_id == channel.id,
+            ChannelPost.has_media == True,
+        ).order_by(missing_url_first.asc(), ChannelPost.views.desc()).limit(limit).all()
         
         if not top_posts:
             return 0
@@ -388,14 +476,12 @@ async def update_top_posts_media(channel: Channel, db, limit: int = 10) -> int:
 
 async def verify_order_posts():
     """Job: Verify published ad posts after duration_hours (24/48h); set verified_at if OK."""
-    from aiogram import Bot
     from app.services.order_verifier import verify_pending_orders
 
     if not getattr(settings, "ad_verification_channel_id", None):
         return
     try:
-        bot = Bot(token=settings.tg_bot_token)
-        count = await verify_pending_orders(bot)
+        count = await verify_pending_orders(_get_verify_bot())
         if count > 0:
             logger.info("Order verification: %s orders verified", count)
     except Exception as e:
@@ -425,8 +511,36 @@ async def update_channel_photos():
             total_updated_subscribers = 0
             total_updated_posts_media = 0
 
-            for channel in channels:
-                result = await update_single_channel_info(channel, db, update_posts_media=True)
+            channel_ids = [c.id for c in channels]
+            sem = asyncio.Semaphore(CHANNEL_UPDATE_CONCURRENCY)
+
+            async def _update_one(channel_id: int) -> dict[str, int]:
+                # Each concurrent update gets its own session: a Session must not
+                # be shared between tasks that commit/rollback independently.
+                async with sem:
+                    task_db = SessionLocal()
+                    try:
+                        channel = task_db.get(Channel, channel_id)
+                        if not channel:
+                            return {}
+                        result = await update_single_channel_info(
+                            channel, task_db, update_posts_media=True, client=client
+                        )
+                        task_db.commit()
+                        return result
+                    finally:
+                        task_db.close()
+
+            # One client for the whole run: connection and TLS session are reused
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                results = await asyncio.gather(
+                    *(_update_one(cid) for cid in channel_ids), return_exceptions=True
+                )
+
+            for channel_id, result in zip(channel_ids, results):
+                if isinstance(result, BaseException):
+                    logger.error(f"Failed to update channel {channel_id}: {result}")
+                    continue
                 total_updated_photos += result.get('photos', 0)
                 total_updated_titles += result.get('titles', 0)
                 total_updated_usernames += result.get('usernames', 0)
@@ -455,11 +569,16 @@ async def delayed_initial_collection():
 
 async def stop_scheduler():
     """Stop the scheduler."""
+    global _verify_bot
     from app.services.channel_collector import channel_collector
 
     if scheduler.running:
         scheduler.shutdown(wait=False)
         logger.info("Scheduler stopped")
 
+    if _verify_bot is not None:
+        await _verify_bot.session.close()
+        _verify_bot = None
+
     await channel_collector.disconnect()
 
@@ -12,15 +12,17 @@ from __future__ import annotations
 import asyncio
 import logging
 from datetime import datetime, timedelta, timezone
-from decimal import Decimal
-from typing import TYPE_CHECKING
+from decimal import ROUND_HALF_UP, Decimal
+from operator import attrgetter
+from typing import TYPE_CHECKING, Any
 
 from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, load_only
 
 from app.core.config import settings
 from app.db.models import Channel, ChannelPost, ChannelStats, ChannelStatsHistory
 from app.db.session import SessionLocal
+from app.services.tg_limiter import AsyncTokenBucket
 
 if TYPE_CHECKING:
     from pyrogram import Client
@@ -28,6 +30,17 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+_count = attrgetter("count")
+_CENTS = Decimal("0.01")
+
+# Growth only reads these history columns
+_GROWTH_COLUMNS = load_only(ChannelStatsHistory.date, ChannelStatsHistory.subscriber_count)
+
+# MTProto requests per second across all parallel channel collections
+MTPROTO_RATE_PER_SEC = 20
+# MTProto requests per second to the same chat
+MTPROTO_CHAT_RATE_PER_SEC = 1
+
 
 class StatsCollector:
     """Collects channel statistics using Pyrogram userbot."""
@@ -35,6 +48,12 @@ class StatsCollector:
     def __init__(self):
         self.client: Client | None = None
         self._started = False
+        self._limiter = AsyncTokenBucket(MTPROTO_RATE_PER_SEC)
+        self._chat_limiters: dict[int | str, AsyncTokenBucket] = {}
+        # Timestamp shared by every channel in a collect_all_channels run
+        self._cycle_ts: datetime | None = None
+        # channel.id -> resolved raw InputChannel (skips username resolution on later runs)
+        self._peer_cache: dict[int, Any] = {}
 
     async def start(self):
         """Initialize and start the Pyrogram client."""
@@ -79,28 +98,117 @@ class StatsCollector:
         db = SessionLocal()
         try:
             # Get all active channels
-            channels = db.execute(
-                select(Channel).where(
+            channel_ids = db.execute(
+                select(Channel.id).where(
                     Channel.status.in_(["active", "pending", "paused"])
                 )
             ).scalars().all()
+            # Stats rows and 30 days of history for all channels in two queries
+            stats_by_channel = self._preload_stats(db, channel_ids)
+            history_by_channel = self._preload_history(
+                db, channel_ids, datetime.now().date() - timedelta(days=30)  # same "today" as _calculate_growth
+            )
+        except Exception as e:
+            logger.error(f"Stats collection failed: {e}")
+            return
+        finally:
+            db.close()
 
-            logger.info(f"Collecting stats for {len(channels)} channels")
+        logger.info(f"Collecting stats for {len(channel_ids)} channels")
 
-            for channel in channels:
+        # Channels are collected in parallel (network-bound); MTProto calls share
+        # the global and per-chat buckets (see _throttle). Each task gets its own
+        # session and commits it.
+        sem = asyncio.Semaphore(max(settings.stats_concurrency, 1))
+
+        async def _run(channel_id: int) -> None:
+            async with sem:
+                task_db = SessionLocal()
                 try:
-                    await self.collect_channel_stats(db, channel)
-                    await asyncio.sleep(2)  # Rate limiting
+                    channel = task_db.get(Channel, channel_id)
+                    if channel is None:
+                        return
+                    stats = stats_by_channel.get(channel_id)
+                    if stats is not None:
+                        # Attach the preloaded row without re-selecting it
+                        stats = task_db.merge(stats, load=False)
+                    await self.collect_channel_stats(
+                        task_db, channel, stats=stats, history=history_by_channel.get(channel_id, [])
+                    )
+                    task_db.commit()
                 except Exception as e:
-                    logger.error(f"Failed to collect stats for channel {channel.id}: {e}")
+                    logger.error(f"Failed to collect stats for channel {channel_id}: {e}")
+                    task_db.rollback()
+                finally:
+                    task_db.close()
 
-            db.commit()
-            logger.info("Stats collection completed")
-        except Exception as e:
-            logger.error(f"Stats collection failed: {e}")
-            db.rollback()
+        self._cycle_ts = datetime.now(timezone.utc)
+        try:
+            await asyncio.gather(*(_run(cid) for cid in channel_ids), return_exceptions=True)
         finally:
-            db.close()
+            self._cycle_ts = None
+        logger.info("Stats collection completed")
+
+    @staticmethod
+    def _preload_stats(db: Session, channel_ids: list[int]) -> dict[int, ChannelStats]:
+        """Load ChannelStats for all channels in one query, keyed by channel_id."""
+        if not channel_ids:
+            return {}
+        rows = db.execute(
+            select(ChannelStats).where(ChannelStats.channel_id.in_(channel_ids))
+        ).scalars()
+        return {s.channel_id: s for s in rows}
+
+    @staticmethod
+    def _preload_history(db: Session, channel_ids: list[int], cutoff) -> dict[int, list]:
+        """Load (date, subscriber_count) history rows since cutoff, per channel, oldest first."""
+        history: dict[int, list] = {}
+        if not channel_ids:
+            return history
+        rows = db.execute(
+            select(
+                ChannelStatsHistory.channel_id,
+                ChannelStatsHistory.date,
+                ChannelStatsHistory.subscriber_count,
+            )
+            .where(
+                ChannelStatsHistory.channel_id.in_(channel_ids),
+                ChannelStatsHistory.date >= cutoff,
+            )
+            .order_by(ChannelStatsHistory.date.asc())
+        )
+        for row in rows:
+            history.setdefault(row.channel_id, []).append(row)
+        return history
+
+    async def _throttle(self, chat_key: int | str) -> None:
+        """Wait for a per-chat slot, then a global slot, before an MTProto request."""
+        bucket = self._chat_limiters.get(chat_key)
+        if bucket is None:
+            bucket = self._chat_limiters.setdefault(chat_key, AsyncTokenBucket(MTPROTO_CHAT_RATE_PER_SEC))
+        await bucket.acquire()
+        await self._limiter.acquire()
+
+    async def _get_member_count(self, channel_id: int, chat_identifier: int | str) -> int:
+        """
+        Subscriber count via GetFullChannel on a cached InputChannel.
+        The peer is resolved once per channel; the cache entry is dropped on peer errors.
+        """
+        from pyrogram.errors import ChannelInvalid, ChannelPrivate, PeerIdInvalid
+        from pyrogram.raw.functions.channels import GetFullChannel
+        from pyrogram.raw.types import InputChannel
+
+        peer = self._peer_cache.get(channel_id)
+        if peer is None:
+            input_peer = await self.client.resolve_peer(chat_identifier)
+            peer = InputChannel(channel_id=input_peer.channel_id, access_hash=input_peer.access_hash)
+            self._peer_cache[channel_id] = peer
+        try:
+            full = await self.client.invoke(GetFullChannel(channel=peer))
+        except (ChannelInvalid, ChannelPrivate, PeerIdInvalid):
+            self._peer_cache.pop(channel_id, None)
+            raise
+        return full.full_chat.participants_count or 0
 
     def _convert_channel_id(self, telegram_id: int) -> int | str:
         """
@@ -115,8 +223,18 @@ class StatsCollector:
             return int(id_str[1:])  # Remove - prefix
         return telegram_id
 
-    async def collect_channel_stats(self, db: Session, channel: Channel):
-        """Collect statistics for a single channel."""
+    async def collect_channel_stats(
+        self,
+        db: Session,
+        channel: Channel,
+        stats: ChannelStats | None = None,
+        history: list | None = None,
+    ):
+        """
+        Collect statistics for a single channel.
+        `stats`/`history` may be preloaded by collect_all_channels; when `history`
+        is None it is queried here.
+        """
         if not self.client:
             return
 
@@ -127,18 +245,19 @@ class StatsCollector:
             # Try username first if available
             chat_identifier = f"@{channel.username}" if channel.username else pyrogram_id
             
-            # Get chat info
-            chat = await self.client.get_chat(chat_identifier)
+            # Get subscriber count
+            await self._throttle(chat_identifier)
+            member_count = await self._get_member_count(channel.id, chat_identifier)
 
             # Update subscriber count
-            member_count = chat.members_count or 0
             old_subscriber_count = channel.subscriber_count
             channel.subscriber_count = member_count
 
             # Get or create stats record
-            stats = db.execute(
-                select(ChannelStats).where(ChannelStats.channel_id == channel.id)
-            ).scalar_one_or_none()
+            if stats is None and history is None:
+                stats = db.execute(
+                    select(ChannelStats).where(ChannelStats.channel_id == channel.id)
+                ).scalar_one_or_none()
 
             if not stats:
                 stats = ChannelStats(channel_id=channel.id)
@@ -147,70 +266,66 @@ class StatsCollector:
             # Calculate subscriber growth
             stats.subscriber_count = member_count
 
-            # Get recent messages for engagement calculation
+            # Get recent messages and tally engagement metrics in the same pass
             messages = []
-            week_ago = datetime.now(timezone.utc) - timedelta(days=7)
+            total_views = 0
+            total_reactions = 0
+            total_comments = 0
+            total_shares = 0
+            posts_24h = 0
+            views_24h = 0
+            last_date = None
+
+            now = self._cycle_ts or datetime.now(timezone.utc)
+            week_ago = now - timedelta(days=7)
+            day_ago = now - timedelta(days=1)
+            await self._throttle(chat_identifier)  # limit=50 fits in one history request
+            # History comes newest-first: stop at the first message older than a week
+            # (Pyrogram's offset_date only pages backwards from a date, not forwards)
             async for msg in self.client.get_chat_history(chat_identifier, limit=50):
-                if msg.date:
-                    msg_date = msg.date
-                    if msg_date.tzinfo is None:
-                        msg_date = msg_date.replace(tzinfo=timezone.utc)
-                    if msg_date > week_ago:
-                        messages.append(msg)
+                # Normalize timezone-naive dates once per message
+                msg_date = msg.date
+                if not msg_date:
+                    continue
+                if msg_date.tzinfo is None:
+                    msg_date = msg_date.replace(tzinfo=timezone.utc)
+                if msg_date <= week_ago:
+                    break
+                messages.append(msg)
+                if last_date is None:
+                    last_date = msg_date
+
+                views = msg.views or 0
+                total_views += views
+
+                # Reactions
+                # Pyrogram always sets reactions/replies/forwards (None when absent)
+                reactions = msg.reactions
+                if reactions:
+                    total_reactions += sum(map(_count, reactions.reactions))
+
+                # Comments (replies)
+                replies = msg.replies
+                if replies:
+                    total_comments += replies.replies or 0
+
+                # Forwards
+                total_shares += msg.forwards or 0
+
+                # Posts and views in last 24h
+                if msg_date > day_ago:
+                    posts_24h += 1
+                    views_24h += views
 
             if messages:
-                # Calculate metrics from messages
-                total_views = 0
-                total_reactions = 0
-                total_comments = 0
-                total_shares = 0
-                posts_24h = 0
                 posts_7d = len(messages)
 
-                now = datetime.now(timezone.utc)
-                day_ago = now - timedelta(days=1)
-
-                for msg in messages:
-                    views = msg.views or 0
-                    total_views += views
-
-                    # Reactions
-                    if msg.reactions:
-                        for reaction in msg.reactions.reactions:
-                            total_reactions += reaction.count
-
-                    # Comments (replies)
-                    if hasattr(msg, 'replies') and msg.replies:
-                        total_comments += msg.replies.replies or 0
-
-                    # Forwards
-                    if hasattr(msg, 'forwards'):
-                        total_shares += msg.forwards or 0
-
-                    # Count posts in last 24h (handle timezone-naive dates)
-                    if msg.date:
-                        msg_date = msg.date
-                        if msg_date.tzinfo is None:
-                            msg_date = msg_date.replace(tzinfo=timezone.utc)
-                        if msg_date > day_ago:
-                            posts_24h += 1
-
-                    # Save post data
-                    await self._save_post(db, channel.id, msg)
+                # Save post data (one lookup for the whole batch)
+                await self._save_posts(db, channel.id, messages, now)
 
                 # Update stats
                 stats.avg_post_views = total_views // max(len(messages), 1)
                 stats.avg_reach_24h = stats.avg_post_views  # Simplified
-                
-                # Calculate views in last 24h with timezone handling
-                views_24h = 0
-                for m in messages:
-                    if m.date:
-                        m_date = m.date
-                        if m_date.tzinfo is None:
-                            m_date = m_date.replace(tzinfo=timezone.utc)
-                        if m_date > day_ago:
-                            views_24h += m.views or 0
                 stats.total_views_24h = views_24h
                 stats.total_views_7d = total_views
 
@@ -220,28 +335,24 @@ class StatsCollector:
 
                 stats.posts_24h = posts_24h
                 stats.posts_7d = posts_7d
-                stats.avg_posts_per_day = Decimal(str(round(posts_7d / 7, 2)))
+                stats.avg_posts_per_day = (Decimal(posts_7d) / 7).quantize(_CENTS, rounding=ROUND_HALF_UP)
 
                 # Calculate engagement rate
                 if member_count > 0:
-                    stats.engagement_rate = Decimal(
-                        str(round((stats.avg_post_views / member_count) * 100, 2))
-                    )
+                    stats.engagement_rate = (
+                        Decimal(stats.avg_post_views) * 100 / member_count
+                    ).quantize(_CENTS, rounding=ROUND_HALF_UP)
 
                 # Determine dynamics
-                if messages:
-                    last_date = messages[0].date
-                    if last_date and last_date.tzinfo is None:
-                        last_date = last_date.replace(tzinfo=timezone.utc)
-                    stats.last_post_at = last_date
+                stats.last_post_at = last_date
 
                 # Calculate dynamics based on subscriber growth
                 stats.subscriber_growth_24h = member_count - old_subscriber_count
                 # For 7d and 30d, we need historical data
-                await self._calculate_growth(db, stats, channel.id)
+                await self._calculate_growth(db, stats, channel.id, history)
 
             # Save daily snapshot
-            await self._save_daily_snapshot(db, channel.id, stats)
+            await self._save_daily_snapshot(db, channel.id, stats, now)
 
             logger.info(f"Updated stats for channel {channel.title}: {member_count} subs, {stats.avg_post_views} avg views")
 
@@ -249,82 +360,80 @@ class StatsCollector:
             logger.error(f"Error collecting stats for channel {channel.telegram_id}: {e}")
             raise
 
-    async def _save_post(self, db: Session, channel_id: int, msg: "Message"):
-        """Save or update post data."""
-        from app.db.models import ChannelPost
+    async def _save_posts(self, db: Session, channel_id: int, messages: list["Message"], now: datetime):
+        """Save or update post data for a batch of messages."""
 
-        # Check if post exists
-        existing = db.execute(
-            select(ChannelPost).where(
-                ChannelPost.channel_id == channel_id,
-                ChannelPost.message_id == msg.id,
-            )
-        ).scalar_one_or_none()
-
-        if existing:
-            # Update stats
-            existing.views = msg.views or 0
-            if msg.reactions:
-                existing.reactions = sum(r.count for r in msg.reactions.reactions)
-            if hasattr(msg, 'replies') and msg.replies:
-                existing.comments = msg.replies.replies or 0
-            if hasattr(msg, 'forwards'):
+        # Load existing posts for these messages in one query
+        existing_by_id = {
+            p.message_id: p
+            for p in db.execute(
+                select(ChannelPost).where(
+                    ChannelPost.channel_id == channel_id,
+                    ChannelPost.message_id.in_([m.id for m in messages]),
+                )
+            ).scalars()
+        }
+
+        for msg in messages:
+            existing = existing_by_id.get(msg.id)
+            reactions = msg.reactions
+            replies = msg.replies
+            if existing:
+                # Update stats
+                existing.views = msg.views or 0
+                if reactions:
+                    existing.reactions = sum(map(_count, reactions.reactions))
+                if replies:
+                    existing.comments = replies.replies or 0
                 existing.shares = msg.forwards or 0
-            existing.stats_updated_at = datetime.now(timezone.utc)
-        else:
-            # Create new
-            text_preview = ""
-            if msg.text:
-                text_preview = msg.text[:200]
-            elif msg.caption:
-                text_preview = msg.caption[:200]
-
-            post = ChannelPost(
-                channel_id=channel_id,
-                message_id=msg.id,
-                text_preview=text_preview,
-                has_media=bool(msg.photo or msg.video or msg.document),
-                views=msg.views or 0,
-                reactions=sum(r.count for r in msg.reactions.reactions) if msg.reactions else 0,
-                comments=msg.replies.replies if hasattr(msg, 'replies') and msg.replies else 0,
-                shares=msg.forwards if hasattr(msg, 'forwards') else 0,
-                posted_at=msg.date.replace(tzinfo=timezone.utc) if msg.date and msg.date.tzinfo is None else (msg.date or datetime.now(timezone.utc)),
-                stats_updated_at=datetime.now(timezone.utc),
-            )
-            db.add(post)
+                existing.stats_updated_at = now
+            else:
+                # Create new
+                text_preview = ""
+                if msg.text:
+                    text_preview = msg.text[:200]
+                elif msg.caption:
+                    text_preview = msg.caption[:200]
+
+                post = ChannelPost(
+                    channel_id=channel_id,
+                    message_id=msg.id,
+                    text_preview=text_preview,
+                    has_media=bool(msg.photo or msg.video or msg.document),
+                    views=msg.views or 0,
+                    reactions=sum(map(_count, reactions.reactions)) if reactions else 0,
+                    comments=replies.replies if replies else 0,
+                    shares=msg.forwards or 0,
+                    posted_at=msg.date.replace(tzinfo=timezone.utc) if msg.date and msg.date.tzinfo is None else (msg.date or now),
+                    stats_updated_at=now,
+                )
+                db.add(post)
+                existing_by_id[msg.id] = post
 
-    async def _calculate_growth(self, db: Session, stats: ChannelStats, channel_id: int):
-        """Calculate subscriber growth from historical data."""
+    async def _calculate_growth(
+        self, db: Session, stats: ChannelStats, channel_id: int, history: list | None = None
+    ):
+        """
+        Calculate subscriber growth from historical data.
+        `history` is the preloaded (date, subscriber_count) rows, oldest first.
+        """
         from datetime import date as date_type
         today = date_type.today()
 
-        # 7 days ago
         seven_days_ago = today - timedelta(days=7)
-        history_7d = db.execute(
-            select(ChannelStatsHistory)
-            .where(
-                ChannelStatsHistory.channel_id == channel_id,
-                ChannelStatsHistory.date >= seven_days_ago,
+        thirty_days_ago = today - timedelta(days=30)
+        if history is not None:
+            # Earliest row on/after each cutoff (h.date is a tz-aware datetime, cutoffs are dates)
+            history_7d = next((h for h in history if h.date.date() >= seven_days_ago), None)
+            history_30d = next((h for h in history if h.date.date() >= thirty_days_ago), None)
+        else:
+            history_7d, history_30d = self._query_growth_history(
+                db, channel_id, seven_days_ago, thirty_days_ago
             )
-            .order_by(ChannelStatsHistory.date.asc())
-            .limit(1)
-        ).scalar_one_or_none()
 
         if history_7d:
             stats.subscriber_growth_7d = stats.subscriber_count - history_7d.subscriber_count
 
-        # 30 days ago
-        thirty_days_ago = today - timedelta(days=30)
-        history_30d = db.execute(
-            select(ChannelStatsHistory)
-            .where(
-                ChannelStatsHistory.channel_id == channel_id,
-                ChannelStatsHistory.date >= thirty_days_ago,
-            )
-            .order_by(ChannelStatsHistory.date.asc())
-            .limit(1)
-        ).scalar_one_or_none()
-
         if history_30d:
             stats.subscriber_growth_30d = stats.subscriber_count - history_30d.subscriber_count
 
@@ -343,9 +452,51 @@ class StatsCollector:
             stats.dynamics = "stable"
             stats.dynamics_score = 0
 
-    async def _save_daily_snapshot(self, db: Session, channel_id: int, stats: ChannelStats):
+    @staticmethod
+    def _query_growth_history(db: Session, channel_id: int, seven_days_ago, thirty_days_ago):
+        """Earliest history rows on/after the 7d and 30d cutoffs (no preload)."""
+        # 7 days ago
+        history_7d = db.execute(
+            select(ChannelStatsHistory)
+            .options(_GROWTH_COLUMNS)
+            .where(
+                ChannelStatsHistory.channel_id == channel_id,
+                ChannelStatsHistory.date >= seven_days_ago,
+            )
+            .order_by(ChannelStatsHistory.date.asc())
+            .limit(1)
+        ).scalar_one_or_none()
+
+        # 30 days ago
+        history_30d = db.execute(
+            select(ChannelStatsHistory)
+            .options(_GROWTH_COLUMNS)
+            .where(
+                ChannelStatsHistory.channel_id == channel_id,
+                ChannelStatsHistory.date >= thirty_days_ago,
+            )
+            .order_by(ChannelStatsHistory.date.asc())
+            .limit(1)
+        ).scalar_one_or_none()
+
+        return history_7d, history_30d
+
+    async def _save_daily_snapshot(self, db: Session, channel_id: int, stats: ChannelStats, now: datetime):
         """Save daily statistics snapshot for charts."""
-        today = datetime.now(timezone.utc).date()  # Use date, not datetime
+        today = now.date()  # Use date, not datetime
+
+        # Snapshot values, read from stats once for either branch
+        posts_24h = stats.posts_24h
+        values = {
+            "subscriber_count": stats.subscriber_count,
+            "total_views": stats.total_views_24h,
+            "total_posts": posts_24h,
+            "avg_post_views": stats.avg_post_views,
+            "engagement_rate": stats.engagement_rate,
+            "reactions": stats.avg_reactions * posts_24h,
+            "comments": stats.avg_comments * posts_24h,
+            "shares": stats.avg_shares * posts_24h,
+        }
 
         # Check if snapshot exists for today
         existing = db.execute(
@@ -357,29 +508,11 @@ class StatsCollector:
 
         if existing:
             # Update existing snapshot
-            existing.subscriber_count = stats.subscriber_count
-            existing.total_views = stats.total_views_24h
-            existing.total_posts = stats.posts_24h
-            existing.avg_post_views = stats.avg_post_views
-            existing.engagement_rate = stats.engagement_rate
-            existing.reactions = stats.avg_reactions * stats.posts_24h
-            existing.comments = stats.avg_comments * stats.posts_24h
-            existing.shares = stats.avg_shares * stats.posts_24h
+            for key, value in values.items():
+                setattr(existing, key, value)
         else:
             # Create new snapshot
-            snapshot = ChannelStatsHistory(
-                channel_id=channel_id,
-                date=today,
-                subscriber_count=stats.subscriber_count,
-                total_views=stats.total_views_24h,
-                total_posts=stats.posts_24h,
-                avg_post_views=stats.avg_post_views,
-                engagement_rate=stats.engagement_rate,
-                reactions=stats.avg_reactions * stats.posts_24h,
-                comments=stats.avg_comments * stats.posts_24h,
-                shares=stats.avg_shares * stats.posts_24h,
-            )
-            db.add(snapshot)
+            db.add(ChannelStatsHistory(channel_id=channel_id, date=today, **values))
 
 
 # Global instance
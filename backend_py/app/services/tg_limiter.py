@@ -0,0 +1,121 @@
+"""
+Shared rate limiter for Telegram Bot API calls made by background jobs.
+
+Scheduler jobs (channel info updates, order verification, notifications) run
+concurrently and all talk to api.telegram.org with the same bot token. Without a
+common limiter they can exceed Telegram's global limit and get 429 responses with
+long retry_after backoffs.
+
+Limits:
+- ~25 requests/s for the bot overall
+- 1 message/s per chat for sendMessage
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, TypeVar
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+GLOBAL_RATE_PER_SEC = 25
+CHAT_RATE_PER_SEC = 1
+# Retries after a 429 before giving up
+MAX_RETRIES = 3
+
+
+class AsyncTokenBucket:
+    """Token bucket: up to `rate` acquisitions per second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def __aenter__(self) -> "AsyncTokenBucket":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc: object) -> None:
+        return None
+
+
+telegram_limiter = AsyncTokenBucket(GLOBAL_RATE_PER_SEC)
+_chat_limiters: dict[int, AsyncTokenBucket] = {}
+
+
+async def throttle(chat_id: int | None = None) -> None:
+    """Wait for a global slot and, if chat_id is given, a per-chat slot."""
+    if chat_id is not None:
+        bucket = _chat_limiters.get(chat_id)
+        if bucket is None:
+            bucket = _chat_limiters.setdefault(chat_id, AsyncTokenBucket(CHAT_RATE_PER_SEC))
+        await bucket.acquire()
+    await telegram_limiter.acquire()
+
+
+def _retry_after(resp: httpx.Response) -> float:
+    try:
+        return float(resp.json().get("parameters", {}).get("retry_after") or 1)
+    except Exception:
+        return 1.0
+
+
+async def bot_api_request(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    *,
+    chat_id: int | None = None,
+    **kwargs: Any,
+) -> httpx.Response:
+    """
+    Rate-limited Bot API request via httpx. On HTTP 429 sleeps for retry_after and
+    retries (up to MAX_RETRIES); returns the last response.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        await throttle(chat_id)
+        resp = await client.request(method, url, **kwargs)
+        if resp.status_code != 429 or attempt == MAX_RETRIES:
+            return resp
+        delay = _retry_after(resp)
+        logger.warning("Bot API 429 on %s, retry in %ss", url.rsplit("/", 1)[-1], delay)
+        await asyncio.sleep(delay)
+    return resp
+
+
+async def call_bot(factory: Callable[[], Awaitable[T]], *, chat_id: int | None = None) -> T:
+    """
+    Rate-limited aiogram call: `await call_bot(lambda: bot.send_message(...))`.
+    Retries on TelegramRetryAfter, other errors propagate.
+    """
+    from aiogram.exceptions import TelegramRetryAfter
+
+    for attempt in range(MAX_RETRIES + 1):
+        await throttle(chat_id)
+        try:
+            return await factory()
+        except TelegramRetryAfter as e:
+            if attempt == MAX_RETRIES:
+                raise
+            logger.warning("Bot API retry_after=%ss", e.retry_after)
+            await asyncio.sleep(e.retry_after)
+    raise RuntimeError("unreachable")
@@ -5,19 +5,52 @@ Fetches public channel statistics from tgstat.ru for initial data.
 """
 from __future__ import annotations
 
+import asyncio
 import logging
+import math
+import os
+import random
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from typing import Optional
 
 import httpx
-from bs4 import BeautifulSoup
+import numpy as np
+from selectolax.parser import HTMLParser
 
 logger = logging.getLogger(__name__)
 
 # TGStat base URLs
 TGSTAT_RU_URL = "https://tgstat.ru/channel/@{username}"
 TGSTAT_STAT_URL = "https://tgstat.ru/channel/@{username}/stat"
+_tgstat_url = TGSTAT_RU_URL.format
+
+# Recent posts used for average views
+RECENT_VIEW_CAP = 20
+
+# Browser-like headers sent with every TGStat request (set once on the shared client)
+TGSTAT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
+}
+
+# Precompiled patterns (parsers run for every TGStat page)
+_WS_RE = re.compile(r'[\s\xa0]')
+_PARTICIPANTS_RE = re.compile(r"""['"]participants['"]""")
+_DATA_OPEN_RE = re.compile(r"data:\s*\[")
+_LABELS_OPEN_RE = re.compile(r"labels:\s*\[")
+_DIGIT_LIST_RE = re.compile(r"\d+(?:,\d+)*")
+_LABEL_DATE_RE = re.compile(r"['\"](\d{4}-\d{2}-\d{2})['\"]")
+_SUBS_RE = re.compile(r'<h2[^>]*>([\d\s\xa0]+)</h2>\s*<div[^>]*>\s*подписчик', re.I)
+_NUM_TOKEN_RE = re.compile(r'^[\d.,]+[kmKM]?$')
+_GROWTH_DAY_RE = re.compile(r'([+-]?\s*[\d\s]+)\s*за\s*(сутки|день|24)', re.I)
+_GROWTH_WEEK_RE = re.compile(r'([+-]?\s*[\d\s]+)\s*за\s*недел', re.I)
+_GROWTH_MONTH_RE = re.compile(r'([+-]?\s*[\d\s]+)\s*за\s*месяц', re.I)
+_ER_RE = re.compile(r'ERR?\s*[:=]?\s*([\d.,]+)\s*%', re.I)
+_CI_RE = re.compile(r'индекс\s*цитирования\s*[:=]?\s*([\d.,]+)', re.I)
 
 
 @dataclass
@@ -44,6 +77,77 @@ class TGStatData:
     growth_week: int = 0
     growth_month: int = 0
     subscriber_history: list[TGStatHistoryPoint] | None = None  # Real 30-day history
+    subscriber_history_arr: np.ndarray | None = None  # Same counts as int64 array
+
+
+# Parsed pages are cached per username. Entries are refreshed early with a
+# probability that grows near expiry (XFetch), so concurrent syncs don't all
+# hit TGStat at once when an entry expires.
+TGSTAT_CACHE_TTL_SEC = 3600
+TGSTAT_CACHE_MAX_SIZE = 1024
+TGSTAT_CACHE_BETA = 1.0
+# username -> (data, expires_at, fetch_seconds)
+_tgstat_cache: dict[str, tuple[TGStatData, float, float]] = {}
+
+
+def _cache_get(username: str) -> TGStatData | None:
+    entry = _tgstat_cache.get(username)
+    if entry is None:
+        return None
+    data, expires_at, delta = entry
+    # 1 - random() is in (0, 1], so log() is <= 0 and the early offset >= 0
+    early = -delta * TGSTAT_CACHE_BETA * math.log(1.0 - random.random())
+    if time.monotonic() + early >= expires_at:
+        return None
+    return data
+
+
+def _cache_put(username: str, data: TGStatData, delta: float) -> None:
+    if username not in _tgstat_cache and len(_tgstat_cache) >= TGSTAT_CACHE_MAX_SIZE:
+        # Dicts keep insertion order: drop the oldest entry
+        _tgstat_cache.pop(next(iter(_tgstat_cache)), None)
+    _tgstat_cache[username] = (data, time.monotonic() + TGSTAT_CACHE_TTL_SEC, delta)
+
+
+# Shared client: keeps connections to tgstat.ru alive across channel lookups
+_client: httpx.AsyncClient | None = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    """Return the module-level TGStat client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=15,
+            follow_redirects=True,
+            headers=TGSTAT_HEADERS,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+        )
+    return _client
+
+
+# HTML parsing is CPU-bound: run it in worker processes so concurrent fetches
+# don't serialize on the GIL and the event loop stays responsive
+_parse_pool: ProcessPoolExecutor | None = None
+
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    """Return the module-level parse pool, creating it on first use."""
+    global _parse_pool
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+    return _parse_pool
+
+
+async def close_tgstat_client() -> None:
+    """Close the shared TGStat client and parse pool (app shutdown)."""
+    global _client, _parse_pool
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
+        _parse_pool = None
 
 
 def parse_number(text: str) -> int:
@@ -63,7 +167,7 @@ def parse_number(text: str) -> int:
         text = text[:-1]
     
     # Remove spaces and non-breaking spaces
-    text = re.sub(r'[\s\xa0]', '', text)
+    text = _WS_RE.sub('', text)
     
     # Replace comma with dot for decimals
     text = text.replace(',', '.')
@@ -85,7 +189,7 @@ def parse_float(text: str) -> float:
     # Replace comma with dot
     text = text.replace(',', '.')
     # Remove spaces
-    text = re.sub(r'[\s\xa0]', '', text)
+    text = _WS_RE.sub('', text)
     
     try:
         return float(text)
@@ -108,28 +212,31 @@ async def fetch_tgstat_data(username: str) -> TGStatData | None:
     if not username:
         return None
     
-    url = TGSTAT_RU_URL.format(username=username)
+    cache_key = username.lower()
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return cached
     
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-        "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
-    }
+    url = _tgstat_url(username=username)
     
+    started = time.monotonic()
     try:
-        async with httpx.AsyncClient(timeout=15, follow_redirects=True) as client:
-            resp = await client.get(url, headers=headers)
-            
-            if resp.status_code == 404:
-                logger.warning(f"Channel @{username} not found on TGStat")
-                return None
-            
-            if resp.status_code != 200:
-                logger.warning(f"TGStat returned {resp.status_code} for @{username}")
-                return None
-            
-            return parse_tgstat_html(username, resp.text)
-            
+        resp = await _get_client().get(url)
+        
+        if resp.status_code == 404:
+            logger.warning(f"Channel @{username} not found on TGStat")
+            return None
+        
+        if resp.status_code != 200:
+            logger.warning(f"TGStat returned {resp.status_code} for @{username}")
+            return None
+        
+        data = await asyncio.get_running_loop().run_in_executor(
+            _get_parse_pool(), parse_tgstat_html, username, resp.text
+        )
+        _cache_put(cache_key, data, time.monotonic() - started)
+        return data
+        
     except httpx.TimeoutException:
         logger.error(f"Timeout fetching TGStat for @{username}")
         return None
@@ -138,6 +245,28 @@ async def fetch_tgstat_data(username: str) -> TGStatData | None:
         return None
 
 
+def _array_after(opener: re.Pattern[str], html: str, pos: int) -> tuple[str, int] | None:
+    """Find `opener` (ends with '[') at or after pos; return (array body, index after ']')."""
+    m = opener.search(html, pos)
+    if not m:
+        return None
+    end = html.find("]", m.end())
+    if end < 0:
+        return None
+    return html[m.end():end], end + 1
+
+
+def _data_and_labels(html: str, pos: int) -> tuple[str, str] | None:
+    """Return bodies of the first `data: [...]` at/after pos and the `labels: [...]` after it."""
+    data = _array_after(_DATA_OPEN_RE, html, pos)
+    if not data:
+        return None
+    labels = _array_after(_LABELS_OPEN_RE, html, data[1])
+    if not labels:
+        return None
+    return data[0], labels[0]
+
+
 def parse_subscriber_history(html: str) -> list[TGStatHistoryPoint] | None:
     """
     Extract subscriber history from ApexCharts data embedded in HTML.
@@ -146,32 +275,34 @@ def parse_subscriber_history(html: str) -> list[TGStatHistoryPoint] | None:
     series: [{ name: 'participants', data: [10828617, 10823745, ...] }],
     labels: ['2025-11-23', '2025-11-24', ...]
     """
+    # Index-based scan (linear time, no regex backtracking on malformed pages).
     # Find ApexCharts config for participants
-    chart_match = re.search(
-        r"new\s+ApexCharts\([^,]+,\s*\{[^}]*series:\s*\[\s*\{[^}]*name:\s*['\"]participants['\"][^}]*data:\s*\[([^\]]+)\]\s*\}[^]]*\][^}]*labels:\s*\[([^\]]+)\]",
-        html,
-        re.DOTALL
-    )
-    
-    if not chart_match:
-        # Try alternative pattern
-        chart_match = re.search(
-            r"data:\s*\[(\d+(?:,\d+)*)\].*?labels:\s*\[(['\"][^'\"]+['\"](?:,['\"][^'\"]+['\"])*)\]",
-            html,
-            re.DOTALL
-        )
-    
-    if not chart_match:
+    arrays = None
+    participants = _PARTICIPANTS_RE.search(html)
+    if participants:
+        arrays = _data_and_labels(html, participants.end())
+    
+    if not arrays:
+        # Try alternative: first digits-only data array followed by labels
+        pos = 0
+        while (data := _array_after(_DATA_OPEN_RE, html, pos)) is not None:
+            if _DIGIT_LIST_RE.fullmatch(data[0]):
+                labels = _array_after(_LABELS_OPEN_RE, html, data[1])
+                if labels:
+                    arrays = (data[0], labels[0])
+                break
+            pos = data[1]
+    
+    if not arrays:
         return None
     
     try:
         # Parse data array
-        data_str = chart_match.group(1)
+        data_str, labels_str = arrays
         data_values = [int(x.strip()) for x in data_str.split(',') if x.strip().isdigit()]
         
         # Parse labels array
-        labels_str = chart_match.group(2)
-        labels = re.findall(r"['\"](\d{4}-\d{2}-\d{2})['\"]", labels_str)
+        labels = _LABEL_DATE_RE.findall(labels_str)
         
         if len(data_values) != len(labels):
             logger.warning(f"Mismatched data/labels: {len(data_values)} vs {len(labels)}")
@@ -198,35 +329,35 @@ def parse_subscriber_history(html: str) -> list[TGStatHistoryPoint] | None:
 
 def parse_tgstat_html(username: str, html: str) -> TGStatData:
     """Parse TGStat HTML page and extract statistics."""
-    soup = BeautifulSoup(html, "lxml")
+    tree = HTMLParser(html)
     data = TGStatData(username=username)
     
     # 0. Parse subscriber history from ApexCharts
     data.subscriber_history = parse_subscriber_history(html)
     if data.subscriber_history:
         logger.info(f"Got {len(data.subscriber_history)} days of history for @{username}")
+        # Subscriber counts as int64 array for growth deltas and bulk analytics
+        arr = np.fromiter(
+            (h.subscribers for h in data.subscriber_history),
+            dtype=np.int64,
+            count=len(data.subscriber_history),
+        )
+        data.subscriber_history_arr = arr
         # Calculate growth from history
-        if len(data.subscriber_history) >= 2:
-            first = data.subscriber_history[0].subscribers
-            last = data.subscriber_history[-1].subscribers
-            data.growth_month = last - first
-            
-            if len(data.subscriber_history) >= 7:
-                week_ago = data.subscriber_history[-7].subscribers
-                data.growth_week = last - week_ago
-            
-            if len(data.subscriber_history) >= 2:
-                yesterday = data.subscriber_history[-2].subscribers
-                data.growth_day = last - yesterday
+        if len(arr) >= 2:
+            data.growth_month = int(arr[-1] - arr[0])
+            data.growth_day = int(arr[-1] - arr[-2])
+            if len(arr) >= 7:
+                data.growth_week = int(arr[-1] - arr[-7])
     
     # 1. Parse title
-    title_elem = soup.find("h1")
+    title_elem = tree.css_first("h1")
     if title_elem:
-        data.title = title_elem.get_text(strip=True)
+        data.title = title_elem.text(strip=True)
     
     # 2. Parse subscribers
     # Pattern: <h2>10 697 090</h2> followed by "подписчиков"
-    subs_match = re.search(r'<h2[^>]*>([\d\s\xa0]+)</h2>\s*<div[^>]*>\s*подписчик', html, re.I)
+    subs_match = _SUBS_RE.search(html)
     if subs_match:
         data.subscribers = parse_number(subs_match.group(1))
     
@@ -237,16 +368,20 @@ def parse_tgstat_html(username: str, html: str) -> TGStatData:
     # 3. Parse recent post views
     # Pattern: Stats like ['1.8m', '63', '2.5k', '184.6k'] where first is views
     recent_views = []
-    
-    # Find all stat groups (views, comments, forwards, reactions)
-    for container in soup.find_all("div", class_=True):
-        texts = [t.strip() for t in container.stripped_strings]
+    match_num = _NUM_TOKEN_RE.match
+    
+    # Find all stat groups (views, comments, forwards, reactions); stop once
+    # RECENT_VIEW_CAP posts are found
+    for container in tree.css("div[class]"):
+        if len(recent_views) >= RECENT_VIEW_CAP:
+            break
+        # Non-empty stripped text nodes (same as BeautifulSoup's stripped_strings)
+        texts = [t for t in container.text(separator="\x00", strip=True).split("\x00") if t]
+        if len(texts) < 4:
+            continue
         
         # Look for view patterns - usually 4 numbers in a row (views, replies, forwards, reactions)
-        nums = []
-        for t in texts:
-            if re.match(r'^[\d.,]+[kmKM]?$', t):
-                nums.append(t)
+        nums = [t for t in texts if match_num(t)]
         
         # If we have exactly 4 numbers and first looks like views (high number)
         if len(nums) == 4:
@@ -255,7 +390,7 @@ def parse_tgstat_html(username: str, html: str) -> TGStatData:
                 recent_views.append(views)
     
     if recent_views:
-        data.recent_views = recent_views[:20]  # Keep last 20 posts
+        data.recent_views = recent_views  # Last RECENT_VIEW_CAP posts
         # Calculate average views
         data.avg_post_views = sum(recent_views) // len(recent_views)
         data.avg_reach = data.avg_post_views
@@ -268,25 +403,25 @@ def parse_tgstat_html(username: str, html: str) -> TGStatData:
     # These might be in different formats
     
     # Look for growth indicators (e.g., "+1 234" or "-567")
-    growth_match = re.search(r'([+-]?\s*[\d\s]+)\s*за\s*(сутки|день|24)', html, re.I)
+    growth_match = _GROWTH_DAY_RE.search(html)
     if growth_match:
         data.growth_day = parse_number(growth_match.group(1))
     
-    growth_week_match = re.search(r'([+-]?\s*[\d\s]+)\s*за\s*недел', html, re.I)
+    growth_week_match = _GROWTH_WEEK_RE.search(html)
     if growth_week_match:
         data.growth_week = parse_number(growth_week_match.group(1))
     
-    growth_month_match = re.search(r'([+-]?\s*[\d\s]+)\s*за\s*месяц', html, re.I)
+    growth_month_match = _GROWTH_MONTH_RE.search(html)
     if growth_month_match:
         data.growth_month = parse_number(growth_month_match.group(1))
     
     # Look for ER/ERR percentages
-    er_match = re.search(r'ERR?\s*[:=]?\s*([\d.,]+)\s*%', html, re.I)
+    er_match = _ER_RE.search(html)
     if er_match:
         data.er_percent = parse_float(er_match.group(1))
     
     # Citation index
-    ci_match = re.search(r'индекс\s*цитирования\s*[:=]?\s*([\d.,]+)', html, re.I)
+    ci_match = _CI_RE.search(html)
     if ci_match:
         data.citation_index = parse_float(ci_match.group(1))
     
@@ -299,7 +434,8 @@ async def fetch_channel_stats_from_tgstat(username: str) -> dict | None:
     """
     Fetch channel stats and return as dict for database storage.
     
-    Returns dict compatible with ChannelStats model, including subscriber_history.
+    Returns dict compatible with ChannelStats model, including subscriber_history
+    as {"dates": [...], "subs": [...]}.
     """
     data = await fetch_tgstat_data(username)
     if not data:
@@ -317,20 +453,22 @@ async def fetch_channel_stats_from_tgstat(username: str) -> dict | None:
         "source": "tgstat",
     }
     
-    # Add subscriber history if available
+    # Add subscriber history if available, as parallel arrays (no per-day dicts)
     if data.subscriber_history:
-        result["subscriber_history"] = [
-            {"date": h.date, "subscribers": h.subscribers}
-            for h in data.subscriber_history
-        ]
+        result["subscriber_history"] = {
+            "dates": [h.date for h in data.subscriber_history],
+            "subs": (
+                data.subscriber_history_arr.tolist()
+                if data.subscriber_history_arr is not None
+                else [h.subscribers for h in data.subscriber_history]
+            ),
+        }
     
     return result
 
 
 # Quick test
 if __name__ == "__main__":
-    import asyncio
-    
     async def test():
         result = await fetch_tgstat_data("durov")
         if result:
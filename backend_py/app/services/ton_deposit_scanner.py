@@ -6,234 +6,301 @@ Matches sender address to TonWallet (connected user wallets) - no memo needed.
 """
 from __future__ import annotations
 
+import asyncio
 import logging
+import time
 from decimal import Decimal
+from functools import lru_cache
 
-import httpx
-from sqlalchemy import select
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
 from app.db.models import TonTransaction, TonWallet, UserBalance
 from app.db.session import SessionLocal
+from app.services.http_clients import telegram_async_client
+from app.services.tonapi import fetch_account_events
 
 logger = logging.getLogger(__name__)
 
 NANOTON = 10**9
+_NANOTON_D = Decimal(NANOTON)
 PREFIX = "ton_dep_"
+_Q_CENT = Decimal("0.01")
+_DEPOSIT_TEXT = '<tg-emoji emoji-id="5467756490389469348">😤</tg-emoji> <b>+{amount} TON зачислено на ваш баланс.</b>'
 
 
-def _get_db() -> Session:
-    return SessionLocal()
+# One-pass removal of base64url separators and whitespace for loose address comparison
+_ADDR_TR = str.maketrans("", "", "-_ \t\r\n")
 
 
-def _addr_match(a: str, b: str) -> bool:
-    """Compare TON addresses by hash_part (robust for any format: raw, bounceable, etc.)."""
-    if not a or not b:
-        return False
+def _norm_addr(addr: str) -> str:
+    return addr.translate(_ADDR_TR).lower()
+
+
+@lru_cache(maxsize=4096)
+def _addr_hash(addr: str) -> bytes | None:
+    """Account hash part of a TON address (any format), or None if unparseable. Memoized."""
+    s = addr.strip()
+    # Friendly form is 48 base64url chars, raw form is "<wc>:<64 hex>"; skip parsing anything else
+    if len(s) != 48 and ":" not in s:
+        return None
     try:
         from pytoniq_core.boc.address import Address
-        return Address(a.strip()).hash_part == Address(b.strip()).hash_part
+        return Address(s).hash_part
     except Exception:
-        # Fallback: normalize and compare (bounceable/non-bounceable)
-        na = a.replace("-", "").replace("_", "").strip().lower()
-        nb = b.replace("-", "").replace("_", "").strip().lower()
-        if len(na) >= 10 and len(nb) >= 10:
-            return na[2:-4] == nb[2:-4]
-        return na == nb
+        return None
+
+
+def _addr_match(a: str, b: str) -> bool:
+    """Compare TON addresses by hash_part (any format: raw, bounceable, etc.). Unparseable never matches."""
+    if not a or not b:
+        return False
+    ha = _addr_hash(a)
+    return ha is not None and ha == _addr_hash(b)
 
 
-def _notify_ton_deposit(telegram_id: int, amount: Decimal) -> None:
+def address_hash_part(addr: str | None) -> str | None:
+    """Account hash part of a TON address (any format) as hex, or None if unparseable."""
+    h = _addr_hash(addr) if addr else None
+    return h.hex() if h is not None else None
+
+
+async def _notify_ton_deposit(telegram_id: int, amount: Decimal) -> None:
     """Send Telegram notification when TON is credited."""
     token = (settings.tg_bot_token or "").strip()
     if not token:
         return
-    amt_str = str(amount.quantize(Decimal("0.01")))
-    text = f'<tg-emoji emoji-id="5467756490389469348">😤</tg-emoji> <b>+{amt_str} TON зачислено на ваш баланс.</b>'
+    text = _DEPOSIT_TEXT.format(amount=amount.quantize(_Q_CENT))
     try:
-        with httpx.Client(timeout=10.0) as client:
-            resp = client.post(
-                f"https://api.telegram.org/bot{token}/sendMessage",
-                json={"chat_id": telegram_id, "text": text, "parse_mode": "HTML"},
-            )
-            resp.raise_for_status()
+        resp = await telegram_async_client().post(
+            f"/bot{token}/sendMessage",
+            json={"chat_id": telegram_id, "text": text, "parse_mode": "HTML"},
+        )
+        resp.raise_for_status()
     except Exception as e:
         logger.warning("Failed to send TON deposit notification to %s: %s", telegram_id, e)
 
 
-def _credit_ton(telegram_id: int, amount: Decimal, tx_hash: str, from_addr: str, to_addr: str) -> bool:
-    """Credit TON to user balance. Returns True on success."""
-    db = _get_db()
+def _credit_ton_batch(db: Session, credits: list[dict]) -> list[tuple[int, Decimal, str]]:
+    """
+    Record deposits and credit TON balances in one transaction.
+    credits: TonTransaction rows as dicts. Already-processed tx_hash values are skipped.
+    Returns (telegram_id, amount_ton, tx_hash) for newly credited rows; a failed batch is retried
+    row by row, and rows that still fail are skipped.
+    """
+    if not credits:
+        return []
     try:
-        bal = db.execute(
-            select(UserBalance).where(
-                UserBalance.telegram_id == telegram_id,
-                UserBalance.currency == "ton",
-            )
-        ).scalar_one_or_none()
-        if bal:
-            bal.available += amount
-            bal.total_deposited += amount
-        else:
-            bal = UserBalance(
-                telegram_id=telegram_id,
-                currency="ton",
-                available=amount,
-                total_deposited=amount,
-            )
-            db.add(bal)
-        tx = TonTransaction(
-            tx_hash=tx_hash,
-            telegram_id=telegram_id,
-            from_address=from_addr,
-            to_address=to_addr,
-            amount_nano=int(amount * NANOTON),
-            amount_ton=amount,
-            tx_type="top_up",
-            status="processed",
-        )
-        db.add(tx)
+        rows = db.execute(
+            pg_insert(TonTransaction)
+            .values(credits)
+            .on_conflict_do_nothing(index_elements=["tx_hash"])
+            .returning(TonTransaction.telegram_id, TonTransaction.amount_ton, TonTransaction.tx_hash)
+        ).all()
+        deltas: dict[int, Decimal] = {}
+        for telegram_id, amount, _ in rows:
+            deltas[telegram_id] = deltas.get(telegram_id, Decimal("0")) + amount
+        if deltas:
+            stmt = pg_insert(UserBalance).values([
+                {"telegram_id": tid, "currency": "ton", "available": amount, "total_deposited": amount}
+                for tid, amount in deltas.items()
+            ])
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=["telegram_id", "currency"],
+                set_={
+                    "available": UserBalance.available + stmt.excluded.available,
+                    "total_deposited": UserBalance.total_deposited + stmt.excluded.total_deposited,
+                    "updated_at": func.now(),
+                },
+            ))
         db.commit()
-        return True
+        return [tuple(r) for r in rows]
     except Exception as e:
-        logger.exception("Credit TON: %s", e)
         db.rollback()
-        return False
-    finally:
-        db.close()
-
-
-def _already_processed(tx_hash: str) -> bool:
-    db = _get_db()
-    try:
-        existing = db.execute(
-            select(TonTransaction).where(TonTransaction.tx_hash == tx_hash)
-        ).scalar_one_or_none()
-        return existing is not None
-    finally:
-        db.close()
+        if len(credits) == 1:
+            logger.exception("Credit TON (%s): %s", credits[0]["tx_hash"], e)
+            return []
+        # One bad row must not block the rest of the batch on every scan: retry row by row
+        logger.warning("Credit TON batch failed, retrying row by row: %s", e)
+        return [row for credit in credits for row in _credit_ton_batch(db, [credit])]
+
+
+def _get_telegram_ids_by_hash_part(db: Session, hashes: set[str]) -> dict[str, int]:
+    """Map sender hash_part -> telegram_id of the active connected wallet, in one query."""
+    if not hashes:
+        return {}
+    rows = db.execute(
+        select(TonWallet.hash_part, TonWallet.telegram_id).where(
+            TonWallet.is_active == True,
+            TonWallet.hash_part.in_(hashes),
+        )
+    ).all()
+    return {h: tid for h, tid in rows}
 
 
-def _get_telegram_id_by_wallet_address(sender_addr: str) -> int | None:
-    """Find telegram_id by connected wallet address (any format)."""
-    db = _get_db()
-    try:
-        wallets = db.execute(
-            select(TonWallet).where(
-                TonWallet.is_active == True,
-                TonWallet.address.isnot(None),
-            )
-        ).scalars().all()
-        for w in wallets:
-            if _addr_match(w.address, sender_addr):
-                return w.telegram_id
-            if w.friendly_address and _addr_match(w.friendly_address, sender_addr):
-                return w.telegram_id
-        return None
-    finally:
-        db.close()
+# Process-local hash_part -> telegram_id of active connected wallets, refreshed in one query.
+# Senders missing from it fall back to an IN query; wallet routes invalidate it on connect/disconnect.
+WALLET_CACHE_TTL_SEC = 60
+_wallet_owners: dict[str, int] = {}
+_wallet_owners_refreshed_at = 0.0
 
 
-def _parse_ton_transfer(action: dict, event: dict, our_wallet_addr: str) -> tuple[Decimal, str, str, str] | None:
+def _refresh_wallet_owners(db: Session) -> None:
+    global _wallet_owners, _wallet_owners_refreshed_at
+    rows = db.execute(
+        select(TonWallet.hash_part, TonWallet.telegram_id).where(
+            TonWallet.is_active == True,
+            TonWallet.hash_part.isnot(None),
+        )
+    ).all()
+    _wallet_owners = {h: tid for h, tid in rows}
+    _wallet_owners_refreshed_at = time.monotonic()
+
+
+def invalidate_wallet_owners() -> None:
+    """Drop the wallet cache after a connect/disconnect; the next scan reloads it from the DB."""
+    global _wallet_owners, _wallet_owners_refreshed_at
+    _wallet_owners = {}
+    _wallet_owners_refreshed_at = 0.0
+
+
+def _lookup_wallet_owners(db: Session, hashes: set[str]) -> dict[str, int]:
+    """Map sender hash_part -> telegram_id, from the wallet cache where possible."""
+    if not hashes:
+        return {}
+    if time.monotonic() - _wallet_owners_refreshed_at > WALLET_CACHE_TTL_SEC:
+        _refresh_wallet_owners(db)
+    found = {h: _wallet_owners[h] for h in hashes if h in _wallet_owners}
+    misses = hashes - found.keys()
+    if misses:
+        fetched = _get_telegram_ids_by_hash_part(db, misses)
+        _wallet_owners.update(fetched)
+        found.update(fetched)
+    return found
+
+
+def _action_addr(obj: dict, key: str) -> str:
+    v = obj.get(key)
+    if v is None:
+        return ""
+    if isinstance(v, dict):
+        return (v.get("address") or v.get("value") or "").strip()
+    return str(v).strip()
+
+
+def _parse_ton_transfer(
+    action: dict, event: dict, our_wallet_addr: str, our_hash: bytes | None = None
+) -> tuple[int, str, str, str] | None:
     """
     Parse TonAPI TonTransfer action (incoming to our wallet).
-    Returns (amount_ton, sender_addr, recipient_addr, tx_hash) or None.
+    Returns (amount_nano, sender_addr, recipient_addr, tx_hash) or None.
+    Checks the recipient first so outgoing/foreign transfers exit before anything else is parsed.
     """
-    atype = action.get("type", "")
-    if atype not in ("TonTransfer", "ton_transfer"):
+    if action.get("type") not in ("TonTransfer", "ton_transfer") or action.get("status") == "failed":
         return None
     data = action.get("TonTransfer") or action
-    amount_raw = data.get("amount")
-    if amount_raw is None:
+
+    recipient = _action_addr(data, "recipient") or _action_addr(data, "destination")
+    if not recipient:
+        return None
+    if our_hash is not None:
+        if _addr_hash(recipient) != our_hash:
+            return None  # not incoming to us
+    elif not _addr_match(recipient, our_wallet_addr):
         return None
+
     try:
-        amount_ton = Decimal(amount_raw) / Decimal(NANOTON)
+        amount_nano = int(data.get("amount"))
     except (TypeError, ValueError):
         return None
-    if amount_ton <= 0:
+    if amount_nano <= 0:
         return None
-
-    def _get_addr(obj, key: str) -> str:
-        v = obj.get(key) if isinstance(obj, dict) else None
-        if v is None:
-            return ""
-        if isinstance(v, dict):
-            return (v.get("address") or v.get("value") or "").strip()
-        return str(v).strip()
-
-    recipient = _get_addr(data, "recipient") or _get_addr(data, "destination")
-    sender = _get_addr(data, "sender") or _get_addr(data, "source") or _get_addr(data, "from")
-    if not sender or not recipient:
+    sender = _action_addr(data, "sender") or _action_addr(data, "source") or _action_addr(data, "from")
+    if not sender:
         return None
-    if not _addr_match(recipient, our_wallet_addr):
-        return None  # not incoming to us
 
     txs = event.get("base_transactions") or action.get("base_transactions") or []
     tx_hash = txs[0] if txs and isinstance(txs[0], str) else None
     if not tx_hash:
         tx_hash = event.get("event_id") or event.get("hash") or action.get("event_id")
     if not tx_hash:
-        norm = sender.replace("-", "").replace("_", "").strip().lower()[:20]
-        tx_hash = f"{PREFIX}{norm}_{amount_raw}"
-    return (amount_ton, sender, recipient, str(tx_hash))
+        norm = _norm_addr(sender)[:20]
+        tx_hash = f"{PREFIX}{norm}_{amount_nano}"
+    return (amount_nano, sender, recipient, str(tx_hash))
+
+
+def process_ton_events(events: list[dict], our_wallet_addr: str) -> list[tuple[int, Decimal]]:
+    """Credit incoming TonTransfers to our_wallet_addr from TonAPI events. Returns (telegram_id, amount) credited."""
+    our_hash = _addr_hash(our_wallet_addr)
+    transfers: list[tuple[int, str, str, str, str | None]] = []
+    for ev in events:
+        if ev.get("in_progress"):
+            continue  # not final yet; picked up by a later scan
+        for act in ev.get("actions") or []:
+            parsed = _parse_ton_transfer(act, ev, our_wallet_addr, our_hash)
+            if parsed:
+                transfers.append((*parsed, address_hash_part(parsed[1])))
+                break  # one transfer per event, avoid double-count
+
+    if not transfers:
+        return []
+
+    # One session for the whole scan: wallet lookup and the credit transaction
+    db = SessionLocal()
+    try:
+        wallet_map = _lookup_wallet_owners(db, {t[4] for t in transfers if t[4]})
+
+        credits: dict[str, dict] = {}
+        for amount_nano, sender_addr, recipient_addr, tx_hash, sender_hash in transfers:
+            telegram_id = wallet_map.get(sender_hash) if sender_hash else None
+            if not telegram_id:
+                logger.debug("Skip TON deposit: sender %s not in TonWallet", sender_addr[:24])
+                continue
+            credits.setdefault(tx_hash, {
+                "tx_hash": tx_hash,
+                "telegram_id": telegram_id,
+                "from_address": sender_addr,
+                "to_address": recipient_addr,
+                "amount_nano": amount_nano,
+                "amount_ton": Decimal(amount_nano) / _NANOTON_D,
+                "tx_type": "top_up",
+                "status": "processed",
+            })
+
+        credited = _credit_ton_batch(db, list(credits.values()))
+    finally:
+        db.close()
+
+    for telegram_id, amount_ton, tx_hash in credited:
+        logger.info("Credited %s TON to telegram_id=%s (tx %s)", amount_ton, telegram_id, tx_hash[:20])
+
+    return [(telegram_id, amount_ton) for telegram_id, amount_ton, _ in credited]
 
 
-def scan_ton_deposits() -> int:
+async def notify_ton_deposits(credited: list[tuple[int, Decimal]]) -> None:
+    """Send deposit notifications concurrently."""
+    await asyncio.gather(*(_notify_ton_deposit(tid, amount) for tid, amount in credited))
+
+
+async def scan_ton_deposits() -> int:
     """
     Fetch events for our TON deposit wallet, process incoming TonTransfer.
     Match sender to TonWallet (connected user). Returns count of new deposits credited.
     """
     wallet = (settings.ton_deposit_wallet or "").strip()
-    api_key = (settings.tonapi_key or "").strip()
     if not wallet:
         logger.debug("TON deposit wallet not configured, skip scan")
         return 0
 
-    our_wallet_addr = wallet
-    url = f"https://tonapi.io/v2/accounts/{wallet}/events"
-    headers = {}
-    if api_key:
-        headers["Authorization"] = f"Bearer {api_key}"
-
     try:
-        with httpx.Client(timeout=30.0) as client:
-            resp = client.get(url, params={"limit": 50}, headers=headers or None)
-            resp.raise_for_status()
-            data = resp.json()
+        events = await fetch_account_events(wallet)
     except Exception as e:
         logger.warning("TonAPI fetch TON deposits failed: %s", e)
         return 0
 
-    events = data.get("events") or []
-    credited = 0
-
-    for ev in events:
-        actions = ev.get("actions") or []
-        for act in actions:
-            parsed = _parse_ton_transfer(act, ev, our_wallet_addr)
-            if not parsed:
-                continue
-            amount_ton, sender_addr, recipient_addr, tx_hash = parsed
-
-            if _already_processed(tx_hash):
-                continue
-
-            telegram_id = _get_telegram_id_by_wallet_address(sender_addr)
-            if not telegram_id:
-                logger.debug("Skip TON deposit: sender %s not in TonWallet", sender_addr[:24])
-                continue
-
-            if _credit_ton(telegram_id, amount_ton, tx_hash, sender_addr, recipient_addr):
-                credited += 1
-                logger.info("Credited %s TON to telegram_id=%s (tx %s)", amount_ton, telegram_id, tx_hash[:20])
-                _notify_ton_deposit(telegram_id, amount_ton)
-            break  # one transfer per action
-        # Could process multiple actions per event, but avoid double-count
-
-    return credited
-
-
-async def scan_ton_deposits_async() -> int:
-    """Async wrapper for scheduler."""
-    import asyncio
-    return await asyncio.to_thread(scan_ton_deposits)
+    # DB layer is sync: only the credit transaction runs in a worker thread
+    credited = await asyncio.to_thread(process_ton_events, events, wallet)
+    await notify_ton_deposits(credited)
+    return len(credited)
@@ -6,155 +6,225 @@ Reuses usdt_withdraw_* wallet (same TON wallet).
 """
 from __future__ import annotations
 
+import asyncio
 import logging
 import time
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
+from functools import cache
 from urllib.parse import quote
 
-import httpx
-from sqlalchemy import select
+import orjson
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
 from app.db.models import TonWithdrawal, UserBalance
 from app.db.session import SessionLocal
+from app.services.hot_wallet import HOT_WALLET_LOCK, wait_seqno_advance
+from app.services.http_clients import telegram_async_client, tonapi_async_client, toncenter_async_client
+from app.services.ton_deposit_scanner import NANOTON, _addr_hash, _norm_addr
 
 logger = logging.getLogger(__name__)
 
 TON_WITHDRAW_FEE = Decimal("0.15")
 TON_WITHDRAW_MIN = Decimal("0.1")
-
-
-def _get_db() -> Session:
-    return SessionLocal()
-
-
-def _refund_ton_withdrawal(telegram_id: int, amount: Decimal, fee: Decimal = TON_WITHDRAW_FEE) -> None:
-    """Refund user balance when TON withdrawal fails (amount + fee)."""
+_Q_CENT = Decimal("0.01")
+# Hot wallet contract version that matched the expected address (set on first send)
+_wallet_version: str | None = None
+# Tx hash lookup after send: sleep 1.5s, 3s, 6s, 12s, 24s before each TonAPI poll
+TX_HASH_POLL_ATTEMPTS = 5
+TX_HASH_POLL_BASE_DELAY = 1.5
+# Claimed/sent rows older than this are stranded (a run takes a few minutes at most)
+STALE_WITHDRAWAL_SEC = 30 * 60
+
+
+def _refund_ton_withdrawal(
+    db: Session, telegram_id: int, amount: Decimal, fee: Decimal = TON_WITHDRAW_FEE
+) -> None:
+    """Refund user balance when TON withdrawal fails (amount + fee). Committed by the caller."""
     total = amount + fee
-    db = _get_db()
-    try:
-        bal = db.execute(
-            select(UserBalance).where(
-                UserBalance.telegram_id == telegram_id,
-                UserBalance.currency == "ton",
+    refunded = db.execute(
+        update(UserBalance)
+        .where(UserBalance.telegram_id == telegram_id, UserBalance.currency == "ton")
+        .values(
+            available=UserBalance.available + total,
+            total_withdrawn=UserBalance.total_withdrawn - total,
+        )
+    ).rowcount
+    if refunded:
+        logger.info("Refunded %s TON to telegram_id=%s (withdrawal failed)", total, telegram_id)
+
+
+def _report_stale_ton_withdrawals(db: Session) -> None:
+    """
+    Escalate rows stuck in "processing" (run died after the claim) or "sent" (tx hash never
+    found): the user's balance stays debited until someone reconciles them.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=STALE_WITHDRAWAL_SEC)
+    stale = db.execute(
+        select(TonWithdrawal.event_id, TonWithdrawal.telegram_id, TonWithdrawal.amount, TonWithdrawal.status)
+        .where(TonWithdrawal.status.in_(("processing", "sent")), TonWithdrawal.created_at < cutoff)
+    ).all()
+    for event_id, telegram_id, amount, status in stale:
+        logger.error(
+            "Stale TON withdrawal %s (%s): %s TON for telegram_id=%s needs manual reconciliation",
+            event_id, status, amount, telegram_id,
+        )
+
+
+def _index_ton_transfers(events: list[dict]) -> dict[tuple[bytes, int], list[str]]:
+    """
+    Index outgoing TonTransfers in TonAPI events by (recipient hash_part, amount_nano) -> tx hashes.
+    Events come newest first, so each list is newest first. Several sends to the same address
+    for the same amount each get their own entry.
+    """
+    idx: dict[tuple[bytes, int], list[str]] = {}
+    for ev in events:
+        txs = ev.get("base_transactions") or []
+        tx_hash = txs[0] if txs and isinstance(txs[0], str) else (ev.get("event_id") or (txs[0] if txs else None))
+        if not tx_hash:
+            continue
+        for act in ev.get("actions") or []:
+            if act.get("type") not in ("TonTransfer", "ton_transfer"):
+                continue
+            data_ = act.get("TonTransfer") or act
+            recip = data_.get("recipient") or data_.get("destination") or {}
+            recip_addr = recip.get("address") if isinstance(recip, dict) else str(recip)
+            recip_hash = _addr_hash(recip_addr) if recip_addr else None
+            if recip_hash is None:
+                continue
+            try:
+                amount_nano = int(data_.get("amount"))
+            except (TypeError, ValueError):
+                continue
+            hashes = idx.setdefault((recip_hash, amount_nano), [])
+            if tx_hash not in hashes:
+                hashes.append(tx_hash)
+    return idx
+
+
+async def _fetch_ton_tx_hashes(our_wallet: str, targets: list[tuple[str, int]]) -> list[str | None]:
+    """
+    Get tx hashes for a batch of sends (dest_address, amount_nano) from our wallet's TonAPI events.
+    One events page per poll is matched against every still-unresolved target; polls back off
+    until all are found. TON Center (latest tx) is only a fallback for a single send.
+    """
+    keys = [(_addr_hash(dest), int(amount_nano)) for dest, amount_nano in targets]
+    found: list[str | None] = [None] * len(keys)
+    limit = min(100, max(30, 3 * len(keys)))
+
+    for attempt in range(TX_HASH_POLL_ATTEMPTS):
+        await asyncio.sleep(TX_HASH_POLL_BASE_DELAY * 2**attempt)
+        try:
+            resp = await tonapi_async_client().get(
+                f"/v2/accounts/{our_wallet}/events", params={"limit": limit}, timeout=20.0
             )
-        ).scalar_one_or_none()
-        if bal:
-            bal.available += total
-            bal.total_withdrawn -= total
-            db.commit()
-            logger.info("Refunded %s TON to telegram_id=%s (withdrawal failed)", total, telegram_id)
-    except Exception as e:
-        logger.exception("Refund TON failed: %s", e)
-        db.rollback()
-    finally:
-        db.close()
+            resp.raise_for_status()
+            idx = _index_ton_transfers(orjson.loads(resp.content).get("events") or [])
+        except Exception as e:
+            logger.debug("TonAPI fetch (%s): %s", our_wallet[:20], e)
+            continue
+        # Each hash is assigned to at most one send (same-address, same-amount sends in a batch)
+        used = {h for h in found if h}
+        for i, key in enumerate(keys):
+            if found[i] is None and key[0] is not None:
+                found[i] = next((h for h in idx.get(key, ()) if h not in used), None)
+                if found[i]:
+                    used.add(found[i])
+        if all(found):
+            return found
+
+    if len(keys) == 1 and found[0] is None:
+        try:
+            resp = await toncenter_async_client().get(
+                "/api/v2/getTransactions",
+                params={"address": our_wallet, "limit": 5},
+            )
+            resp.raise_for_status()
+            for tx in (orjson.loads(resp.content).get("result") or [])[:3]:
+                tid = tx.get("transaction_id") or {}
+                h = tid.get("hash")
+                if h:
+                    found[0] = h
+                    break
+        except Exception as e:
+            logger.debug("TON Center fetch: %s", e)
+    return found
 
 
-def _fetch_ton_tx_hash(our_wallet: str, dest_address: str, amount_nano: int) -> str | None:
-    """Get tx hash from TonAPI events after send."""
-    api_key = (settings.tonapi_key or "").strip()
-    headers = {}
-    if api_key:
-        headers["Authorization"] = f"Bearer {api_key}"
-    dest_norm = dest_address.replace("-", "").replace("_", "").lower()
+# tx_hash -> (success, cached_at). On-chain verdicts are final; only definitive results are cached.
+VERIFY_CACHE_TTL_SEC = 300
+VERIFY_CACHE_MAX_SIZE = 512
+_verify_cache: dict[str, tuple[bool, float]] = {}
 
-    def _fetch_tonapi(addr: str) -> str | None:
-        url = f"https://tonapi.io/v2/accounts/{addr}/events"
-        try:
-            with httpx.Client(timeout=20.0) as client:
-                resp = client.get(url, params={"limit": 30}, headers=headers or None)
-                resp.raise_for_status()
-                data = resp.json()
-        except Exception as e:
-            logger.debug("TonAPI fetch (%s): %s", addr[:20], e)
-            return None
-        for ev in data.get("events") or []:
-            for act in ev.get("actions") or []:
-                if act.get("type") not in ("TonTransfer", "ton_transfer"):
-                    continue
-                data_ = act.get("TonTransfer") or act
-                amount_raw = data_.get("amount")
-                recip = data_.get("recipient") or data_.get("destination") or {}
-                recip_addr = recip.get("address") if isinstance(recip, dict) else str(recip)
-                recip_norm = (recip_addr or "").replace("-", "").replace("_", "").lower()
-                if dest_norm in recip_norm and str(amount_raw) == str(amount_nano):
-                    txs = ev.get("base_transactions") or []
-                    if txs and isinstance(txs[0], str):
-                        return txs[0]
-                    return ev.get("event_id") or (txs[0] if txs else None)
+
+def _verify_cache_get(tx_hash: str) -> bool | None:
+    entry = _verify_cache.get(tx_hash)
+    if entry is None:
         return None
+    success, cached_at = entry
+    if time.monotonic() - cached_at > VERIFY_CACHE_TTL_SEC:
+        _verify_cache.pop(tx_hash, None)
+        return None
+    return success
 
-    time.sleep(6)
-    result = _fetch_tonapi(our_wallet)
-    if not result:
-        time.sleep(6)
-        result = _fetch_tonapi(our_wallet)
-    if not result and our_wallet:
-        try:
-            with httpx.Client(timeout=15.0) as client:
-                resp = client.get(
-                    "https://toncenter.com/api/v2/getTransactions",
-                    params={"address": our_wallet, "limit": 5},
-                )
-                resp.raise_for_status()
-                for tx in (resp.json().get("result") or [])[:3]:
-                    tid = tx.get("transaction_id") or {}
-                    h = tid.get("hash")
-                    if h:
-                        return h
-        except Exception as e:
-            logger.debug("TON Center fetch: %s", e)
-    return result
 
+def _verify_cache_put(tx_hash: str, success: bool) -> None:
+    if len(_verify_cache) >= VERIFY_CACHE_MAX_SIZE:
+        # Dicts keep insertion order: drop the oldest entry
+        _verify_cache.pop(next(iter(_verify_cache)), None)
+    _verify_cache[tx_hash] = (success, time.monotonic())
 
-def _verify_tx_success(tx_hash: str) -> bool | None:
-    """Check via TonAPI if transaction succeeded."""
-    api_key = (settings.tonapi_key or "").strip()
-    headers = {}
-    if api_key:
-        headers["Authorization"] = f"Bearer {api_key}"
-    url = f"https://tonapi.io/v2/blockchain/transactions/{quote(tx_hash, safe='')}"
-    try:
-        with httpx.Client(timeout=15.0) as client:
-            resp = client.get(url, headers=headers or None)
+
+async def _verify_tx_success(tx_hash: str) -> bool | None:
+    """Check via TonAPI if transaction succeeded (retries while unknown)."""
+    cached = _verify_cache_get(tx_hash)
+    if cached is not None:
+        return cached
+    url = f"/v2/blockchain/transactions/{quote(tx_hash, safe='')}"
+    for attempt in range(3):
+        if attempt:
+            await asyncio.sleep(5)
+        try:
+            resp = await tonapi_async_client().get(url, timeout=15.0)
             resp.raise_for_status()
-            return bool(resp.json().get("success"))
-    except Exception as e:
-        logger.debug("TonAPI tx verify (%s): %s", tx_hash[:16], e)
-        return None
+            success = bool(orjson.loads(resp.content).get("success"))
+            _verify_cache_put(tx_hash, success)
+            return success
+        except Exception as e:
+            logger.debug("TonAPI tx verify (%s): %s", tx_hash[:16], e)
+    return None
 
 
-def _notify_ton_withdraw_failed(telegram_id: int, amount: Decimal, address: str) -> None:
+async def _notify_ton_withdraw_failed(telegram_id: int, amount: Decimal, address: str) -> None:
     """Notify user that TON withdrawal failed and was refunded."""
     token = (settings.tg_bot_token or "").strip()
     if not token:
         return
-    amt_str = str(amount.quantize(Decimal("0.01")))
+    amt_str = str(amount.quantize(_Q_CENT))
     text = (
         f'<b>⚠️ Вывод -{amt_str} TON отменён</b>\n\n'
         f"<b>Причина:</b> Транзакция не прошла в сети. Средства возвращены на баланс.\n"
         f"<b>Адрес:</b> <pre>{address[:48]}{'...' if len(address) > 48 else ''}</pre>"
     )
     try:
-        with httpx.Client(timeout=10.0) as client:
-            client.post(
-                f"https://api.telegram.org/bot{token}/sendMessage",
-                json={"chat_id": telegram_id, "text": text, "parse_mode": "HTML"},
-            )
+        await telegram_async_client().post(
+            f"/bot{token}/sendMessage",
+            json={"chat_id": telegram_id, "text": text, "parse_mode": "HTML"},
+        )
     except Exception as e:
         logger.warning("Failed to send TON withdrawal failure notification: %s", e)
 
 
-def _notify_ton_withdraw_completed(
+async def _notify_ton_withdraw_completed(
     telegram_id: int, amount: Decimal, address: str, tx_hash: str | None, our_wallet: str | None
 ) -> None:
     """Notify user that TON withdrawal completed."""
     token = (settings.tg_bot_token or "").strip()
     if not token:
         return
-    amt_str = str(amount.quantize(Decimal("0.01")))
+    amt_str = str(amount.quantize(_Q_CENT))
     if tx_hash and len(tx_hash) >= 10:
         track_url = f"https://tonscan.org/tx/{quote(tx_hash, safe='')}"
     elif our_wallet:
@@ -170,14 +240,14 @@ def _notify_ton_withdraw_completed(
     if track_url:
         payload["reply_markup"] = {"inline_keyboard": [[{"text": "👀 Отследить", "url": track_url}]]}
     try:
-        with httpx.Client(timeout=10.0) as client:
-            client.post(f"https://api.telegram.org/bot{token}/sendMessage", json=payload)
+        await telegram_async_client().post(f"/bot{token}/sendMessage", json=payload)
     except Exception as e:
         logger.warning("Failed to send TON withdrawal notification: %s", e)
 
 
+@cache
 def _load_withdraw_private_key() -> bytes | None:
-    """Reuse USDT withdraw key (same hot wallet)."""
+    """Reuse USDT withdraw key (same hot wallet). Derived once per process."""
     pk_hex = (getattr(settings, "usdt_withdraw_private_key", None) or "").strip()
     if pk_hex:
         try:
@@ -205,25 +275,25 @@ def _load_withdraw_private_key() -> bytes | None:
         return None
 
 
-async def _send_ton(dest_address: str, amount_ton: Decimal) -> bool:
-    """Send native TON to address. Returns True on success."""
+async def _open_hot_wallet():
+    """
+    Start a LiteBalancer and resolve the hot wallet contract for the withdraw key.
+    Returns (provider, wallet) or None; caller must close the provider.
+    """
+    global _wallet_version
     private_key = _load_withdraw_private_key()
     if not private_key:
-        return False
+        return None
     expected = (
         (getattr(settings, "usdt_withdraw_wallet", None) or "").strip()
         or (getattr(settings, "usdt_deposit_wallet", None) or "").strip()
     )
 
     try:
-        from pytoniq import LiteBalancer, WalletV3R2, WalletV4R2, WalletV5R1, Address
+        from pytoniq import LiteBalancer, WalletV3R2, WalletV4R2, WalletV5R1
     except ImportError:
         logger.error("pytoniq not installed")
-        return False
-
-    amount_nano = int(amount_ton * 1e9)
-    if amount_nano <= 0:
-        return False
+        return None
 
     def _raw_addr(addr) -> str:
         if hasattr(addr, "to_str"):
@@ -234,45 +304,71 @@ async def _send_ton(dest_address: str, amount_ton: Decimal) -> bool:
         return s
 
     def addr_match(got: str, exp: str) -> bool:
-        g = (got or "").replace("-", "").replace("_", "").lower()
-        e = (exp or "").replace("-", "").replace("_", "").lower()
+        g = _norm_addr(got or "")
+        e = _norm_addr(exp or "")
         return len(g) >= 10 and len(e) >= 10 and g[2:-4] == e[2:-4]
 
+    provider = None
     try:
         provider = LiteBalancer.from_mainnet_config(1)
         await provider.start_up()
-        wallet = None
-        w = None
-        for version_name, create_fn in [
+        candidates = [
             ("v5r1", lambda: WalletV5R1.from_private_key(
                 provider, private_key, wc=0, network_global_id=-239
             )),
             ("v4r2", lambda: WalletV4R2.from_private_key(provider, private_key, version="v4r2")),
             ("v3r2", lambda: WalletV3R2.from_private_key(provider, private_key, version="v3r2")),
-        ]:
+        ]
+        # Try the version that matched last time first (one wallet object instead of up to three)
+        candidates.sort(key=lambda c: c[0] != _wallet_version)
+        for version_name, create_fn in candidates:
             w = await create_fn()
             if not expected or addr_match(_raw_addr(w.address), expected):
-                wallet = w
+                _wallet_version = version_name
                 logger.debug("TON wallet matched: %s", version_name)
-                break
+                return provider, w
 
-        if not wallet:
-            logger.error("TON wallet address mismatch")
+        logger.error("TON wallet address mismatch")
+    except Exception as e:
+        logger.exception("TON wallet init failed: %s", e)
+    if provider is not None:
+        try:
             await provider.close_all()
-            return False
+        except Exception:
+            pass
+    return None
+
+
+async def _send_ton(wallet, dest_address: str, amount_ton: Decimal) -> int | None:
+    """
+    Send native TON to address from the opened hot wallet.
+    Returns the wallet seqno the transfer was signed with, None on failure.
+    """
+    amount_nano = int(amount_ton * NANOTON)
+    if amount_nano <= 0:
+        return None
+    try:
+        from pytoniq import Address
 
         dest = Address(dest_address.strip())
+        seqno = await wallet.get_seqno()
         # Send amount_nano (user receives). Wallet pays amount + small fee automatically.
         await wallet.transfer(destination=dest, amount=amount_nano)
-        await provider.close_all()
-        return True
+        return seqno
     except Exception as e:
         logger.exception("TON transfer failed: %s", e)
-        return False
+        return None
 
 
 async def process_pending_ton_withdrawals() -> int:
-    """Process pending TON withdrawals. Returns count processed."""
+    """
+    Process pending TON withdrawals. Returns count processed.
+
+    Transfers are sent one by one under HOT_WALLET_LOCK, each waiting for the wallet seqno
+    to advance, and committed as "sent". Tx hashes for the whole batch are then looked up
+    from shared TonAPI event pages and verified concurrently. Rows whose hash is not found
+    stay "sent" and are never reported as completed.
+    """
     if not _load_withdraw_private_key():
         return 0
 
@@ -281,69 +377,118 @@ async def process_pending_ton_withdrawals() -> int:
         or (getattr(settings, "usdt_deposit_wallet", None) or "").strip()
     )
 
-    db = _get_db()
+    db = SessionLocal()
     processed = 0
+    notify_tasks = []
+    hot = None  # (provider, wallet), opened on first send and shared by the batch
     try:
+        _report_stale_ton_withdrawals(db)
+
+        # Claim a batch: SKIP LOCKED lets an overlapping tick/worker take other rows,
+        # and "processing" keeps them claimed after the lock is released by commit.
         rows = db.execute(
             select(TonWithdrawal)
             .where(TonWithdrawal.status == "pending")
             .order_by(TonWithdrawal.created_at.asc())
             .limit(10)
+            .with_for_update(skip_locked=True)
         ).scalars().all()
-
         for tx in rows:
-            if not tx.memo or len(tx.memo) < 40:
-                tx.status = "failed"
-                _refund_ton_withdrawal(tx.telegram_id, tx.amount, TON_WITHDRAW_FEE)
-                db.commit()
-                continue
+            tx.status = "processing"
+        db.commit()
+
+        sent: list[TonWithdrawal] = []
+        # One send at a time on the shared hot wallet (USDT sender included): each transfer
+        # must be applied (seqno advanced) before the next one is signed.
+        async with HOT_WALLET_LOCK:
+            for tx in rows:
+                if not tx.memo or len(tx.memo) < 40:
+                    tx.status = "failed"
+                    _refund_ton_withdrawal(db, tx.telegram_id, tx.amount, TON_WITHDRAW_FEE)
+                    db.commit()
+                    continue
 
-            bal = db.execute(
-                select(UserBalance).where(
-                    UserBalance.telegram_id == tx.telegram_id,
-                    UserBalance.currency == "ton",
-                )
-            ).scalar_one_or_none()
-            if not bal or bal.available < 0:
-                tx.status = "failed"
-                _refund_ton_withdrawal(tx.telegram_id, tx.amount, TON_WITHDRAW_FEE)
-                db.commit()
-                continue
+                bal = db.execute(
+                    select(UserBalance).where(
+                        UserBalance.telegram_id == tx.telegram_id,
+                        UserBalance.currency == "ton",
+                    )
+                ).scalar_one_or_none()
+                if not bal or bal.available < 0:
+                    tx.status = "failed"
+                    _refund_ton_withdrawal(db, tx.telegram_id, tx.amount, TON_WITHDRAW_FEE)
+                    db.commit()
+                    continue
 
-            ok = await _send_ton(tx.memo, tx.amount)
-            if not ok:
-                tx.status = "failed"
-                _refund_ton_withdrawal(tx.telegram_id, tx.amount, TON_WITHDRAW_FEE)
+                if hot is None:
+                    hot = await _open_hot_wallet()
+                seqno = await _send_ton(hot[1], tx.memo, tx.amount) if hot is not None else None
+                if seqno is None:
+                    tx.status = "failed"
+                    _refund_ton_withdrawal(db, tx.telegram_id, tx.amount, TON_WITHDRAW_FEE)
+                    db.commit()
+                    continue
+                # Persist before anything else can fail: a "sent" row is never sent again
+                tx.status = "sent"
                 db.commit()
-                continue
-
-            amount_nano = int(tx.amount * 1e9)
-            tx.tx_hash = _fetch_ton_tx_hash(our_wallet, tx.memo, amount_nano) if our_wallet else None
-
-            verified = None
-            if tx.tx_hash:
-                for _ in range(3):
-                    verified = _verify_tx_success(tx.tx_hash)
-                    if verified is not None:
-                        break
-                    time.sleep(5)
+                sent.append(tx)
+                if not await wait_seqno_advance(hot[1], seqno):
+                    logger.warning(
+                        "TON withdrawal %s: wallet seqno %s not advanced, pausing sends until next run",
+                        tx.event_id, seqno,
+                    )
+                    break
+
+            if hot is not None:
+                await hot[0].close_all()
+                hot = None
+
+        # Rows not reached after a paused send go back to the queue
+        unsent = [tx for tx in rows if tx.status == "processing"]
+        if unsent:
+            for tx in unsent:
+                tx.status = "pending"
+            db.commit()
+        if not sent:
+            return processed
 
-            if verified is False:
+        if our_wallet:
+            hashes = await _fetch_ton_tx_hashes(
+                our_wallet, [(tx.memo, int(tx.amount * NANOTON)) for tx in sent]
+            )
+        else:
+            hashes = [None] * len(sent)
+        unique = list({h for h in hashes if h})
+        results = await asyncio.gather(*(_verify_tx_success(h) for h in unique))
+        verified_by_hash = dict(zip(unique, results))
+
+        for tx, tx_hash in zip(sent, hashes):
+            if not tx_hash:
+                # Transfer may or may not have landed: stays "sent" for reconciliation
+                logger.warning("TON withdrawal %s: tx hash not found, left as sent", tx.event_id)
+                continue
+            tx.tx_hash = tx_hash
+            if verified_by_hash.get(tx_hash) is False:
                 tx.status = "failed"
-                _refund_ton_withdrawal(tx.telegram_id, tx.amount, TON_WITHDRAW_FEE)
-                _notify_ton_withdraw_failed(tx.telegram_id, tx.amount, tx.memo or "")
-                db.commit()
+                _refund_ton_withdrawal(db, tx.telegram_id, tx.amount, TON_WITHDRAW_FEE)
+                notify_tasks.append(_notify_ton_withdraw_failed(tx.telegram_id, tx.amount, tx.memo or ""))
                 continue
-
             tx.status = "completed"
             processed += 1
-            _notify_ton_withdraw_completed(
+            notify_tasks.append(_notify_ton_withdraw_completed(
                 tx.telegram_id, tx.amount, tx.memo or "", tx.tx_hash, our_wallet
-            )
-            db.commit()
+            ))
+        db.commit()
     except Exception as e:
         logger.exception("Process TON withdrawals: %s", e)
         db.rollback()
     finally:
+        if hot is not None:
+            try:
+                await hot[0].close_all()
+            except Exception:
+                pass
         db.close()
+    # After commit, one round-trip for the whole batch; a failed send must not drop the others
+    await asyncio.gather(*notify_tasks, return_exceptions=True)
     return processed
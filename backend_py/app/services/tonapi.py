@@ -0,0 +1,15 @@
+"""
+Shared TonAPI access for deposit scanners.
+"""
+from __future__ import annotations
+
+import orjson
+
+from app.services.http_clients import tonapi_async_client
+
+
+async def fetch_account_events(account: str, limit: int = 50) -> list[dict]:
+    """Fetch latest events for an account. Raises on HTTP/network errors."""
+    resp = await tonapi_async_client().get(f"/v2/accounts/{account}/events", params={"limit": limit})
+    resp.raise_for_status()
+    return orjson.loads(resp.content).get("events") or []
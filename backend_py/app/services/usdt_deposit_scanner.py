@@ -6,104 +6,103 @@ Memo (comment) = telegram_id to attribute deposit to user.
 """
 from __future__ import annotations
 
+import asyncio
 import logging
 from decimal import Decimal
 
-import httpx
-from sqlalchemy import select
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
 from app.db.models import UsdtTransaction, UserBalance
 from app.db.session import SessionLocal
+from app.services.http_clients import telegram_async_client
+from app.services.tonapi import fetch_account_events
 
 logger = logging.getLogger(__name__)
 
 # USDT has 6 decimals
 USDT_DECIMALS = 6
+_USDT_D = Decimal(10**USDT_DECIMALS)
 
 # Event ID prefix for uniqueness (event_id from API can collide across accounts)
 PREFIX = "usdt_"
 
+# Column bounds: telegram_id is BIGINT, balances are NUMERIC(18, 8) (the tighter amount column)
+MAX_TELEGRAM_ID = 2**63 - 1
+MAX_DEPOSIT_USDT = Decimal(10**10)
 
-def _get_db() -> Session:
-    return SessionLocal()
+_Q_MICRO = Decimal("0.000001")
+_DEPOSIT_TEXT = '<tg-emoji emoji-id="5458525793921546124">😌</tg-emoji> <b>+{amount} USDT зачислено на ваш баланс.</b>'
 
 
 def _format_usdt_amount(amount: Decimal) -> str:
     """Format USDT amount for display (e.g. 1, 10.5, 0.25)."""
-    amount = amount.quantize(Decimal("0.000001"))
+    amount = amount.quantize(_Q_MICRO)
     if amount == amount.to_integral_value():
         return str(int(amount))
     return str(amount).rstrip("0").rstrip(".")
 
 
-def _notify_usdt_deposit(telegram_id: int, amount: Decimal) -> None:
+async def _notify_usdt_deposit(telegram_id: int, amount: Decimal) -> None:
     """Send Telegram notification when USDT is credited."""
     token = (settings.tg_bot_token or "").strip()
     if not token:
         return
-    amt_str = _format_usdt_amount(amount)
-    text = f'<tg-emoji emoji-id="5458525793921546124">😌</tg-emoji> <b>+{amt_str} USDT зачислено на ваш баланс.</b>'
+    text = _DEPOSIT_TEXT.format(amount=_format_usdt_amount(amount))
     try:
-        with httpx.Client(timeout=10.0) as client:
-            resp = client.post(
-                f"https://api.telegram.org/bot{token}/sendMessage",
-                json={"chat_id": telegram_id, "text": text, "parse_mode": "HTML"},
-            )
-            resp.raise_for_status()
+        resp = await telegram_async_client().post(
+            f"/bot{token}/sendMessage",
+            json={"chat_id": telegram_id, "text": text, "parse_mode": "HTML"},
+        )
+        resp.raise_for_status()
     except Exception as e:
         logger.warning("Failed to send USDT deposit notification to %s: %s", telegram_id, e)
 
 
-def _credit_usdt(telegram_id: int, amount: Decimal, event_id: str) -> bool:
-    """Credit USDT to user balance. Returns True on success."""
-    db = _get_db()
+def _credit_usdt_batch(db: Session, credits: list[dict]) -> list[tuple[int, Decimal, str]]:
+    """
+    Record deposits and credit USDT balances in one transaction.
+    credits: UsdtTransaction rows as dicts. Already-processed event_id values are skipped.
+    Returns (telegram_id, amount, event_id) for newly credited rows; a failed batch is retried
+    row by row, and rows that still fail are skipped.
+    """
+    if not credits:
+        return []
     try:
-        bal = db.execute(
-            select(UserBalance).where(
-                UserBalance.telegram_id == telegram_id,
-                UserBalance.currency == "usdt",
-            )
-        ).scalar_one_or_none()
-        if bal:
-            bal.available += amount
-            bal.total_deposited += amount
-        else:
-            bal = UserBalance(
-                telegram_id=telegram_id,
-                currency="usdt",
-                available=amount,
-                total_deposited=amount,
-            )
-            db.add(bal)
-        tx = UsdtTransaction(
-            event_id=event_id,
-            telegram_id=telegram_id,
-            amount=amount,
-            tx_type="deposit",
-            status="completed",
-        )
-        db.add(tx)
+        rows = db.execute(
+            pg_insert(UsdtTransaction)
+            .values(credits)
+            .on_conflict_do_nothing(index_elements=["event_id"])
+            .returning(UsdtTransaction.telegram_id, UsdtTransaction.amount, UsdtTransaction.event_id)
+        ).all()
+        deltas: dict[int, Decimal] = {}
+        for telegram_id, amount, _ in rows:
+            deltas[telegram_id] = deltas.get(telegram_id, Decimal("0")) + amount
+        if deltas:
+            stmt = pg_insert(UserBalance).values([
+                {"telegram_id": tid, "currency": "usdt", "available": amount, "total_deposited": amount}
+                for tid, amount in deltas.items()
+            ])
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=["telegram_id", "currency"],
+                set_={
+                    "available": UserBalance.available + stmt.excluded.available,
+                    "total_deposited": UserBalance.total_deposited + stmt.excluded.total_deposited,
+                    "updated_at": func.now(),
+                },
+            ))
         db.commit()
-        return True
+        return [tuple(r) for r in rows]
     except Exception as e:
-        logger.exception("Credit USDT: %s", e)
         db.rollback()
-        return False
-    finally:
-        db.close()
-
-
-def _already_processed(event_id: str) -> bool:
-    db = _get_db()
-    try:
-        existing = db.execute(
-            select(UsdtTransaction).where(UsdtTransaction.event_id == event_id)
-        ).scalar_one_or_none()
-        return existing is not None
-    finally:
-        db.close()
+        if len(credits) == 1:
+            logger.exception("Credit USDT (%s): %s", credits[0]["event_id"], e)
+            return []
+        # One bad row must not block the rest of the batch on every scan: retry row by row
+        logger.warning("Credit USDT batch failed, retrying row by row: %s", e)
+        return [row for credit in credits for row in _credit_usdt_batch(db, [credit])]
 
 
 def _parse_jetton_transfer(action: dict) -> tuple[Decimal | None, str | None] | None:
@@ -120,11 +119,12 @@ def _parse_jetton_transfer(action: dict) -> tuple[Decimal | None, str | None] |
     if raw_amount is None:
         return None
     try:
-        amount = Decimal(raw_amount) / Decimal(10**USDT_DECIMALS)
+        amount_units = int(raw_amount)
     except (TypeError, ValueError):
         return None
-    if amount <= 0:
+    if amount_units <= 0:
         return None
+    amount = Decimal(amount_units) / _USDT_D
     # comment / memo - can be in comment, payload, or decrypted
     comment = (
         jt.get("comment")
@@ -141,33 +141,9 @@ def _parse_jetton_transfer(action: dict) -> tuple[Decimal | None, str | None] |
     return (amount, memo or None)
 
 
-def scan_usdt_deposits() -> int:
-    """
-    Fetch events for our USDT deposit wallet, process incoming Jetton transfers.
-    Returns count of new deposits credited.
-    """
-    wallet = (settings.usdt_deposit_wallet or "").strip()
-    api_key = (settings.tonapi_key or "").strip()
-    if not wallet:
-        logger.debug("USDT deposit wallet not configured, skip scan")
-        return 0
-
-    url = f"https://tonapi.io/v2/accounts/{wallet}/events"
-    headers = {}
-    if api_key:
-        headers["Authorization"] = f"Bearer {api_key}"
-
-    try:
-        with httpx.Client(timeout=30.0) as client:
-            resp = client.get(url, params={"limit": 50}, headers=headers or None)
-            resp.raise_for_status()
-            data = resp.json()
-    except Exception as e:
-        logger.warning("TonAPI fetch failed: %s", e)
-        return 0
-
-    events = data.get("events") or []
-    credited = 0
+def process_usdt_events(events: list[dict]) -> list[tuple[int, Decimal]]:
+    """Credit incoming Jetton transfers from TonAPI events. Returns (telegram_id, amount) credited."""
+    credits: dict[str, dict] = {}
 
     for ev in events:
         ev_id = ev.get("event_id") or ev.get("hash") or str(ev.get("lt", ""))
@@ -175,9 +151,6 @@ def scan_usdt_deposits() -> int:
             continue
         unique_id = f"{PREFIX}{ev_id}"
 
-        if _already_processed(unique_id):
-            continue
-
         actions = ev.get("actions") or []
         for act in actions:
             parsed = _parse_jetton_transfer(act)
@@ -191,17 +164,54 @@ def scan_usdt_deposits() -> int:
                 telegram_id = int(memo)
             except ValueError:
                 continue
+            if not 0 < telegram_id <= MAX_TELEGRAM_ID or amount >= MAX_DEPOSIT_USDT:
+                logger.warning("Skip deposit: memo %s / amount %s out of range in event %s", memo[:24], amount, ev_id)
+                continue
 
-            if _credit_usdt(telegram_id, amount, unique_id):
-                credited += 1
-                logger.info("Credited %s USDT to telegram_id=%s (event %s)", amount, telegram_id, ev_id)
-                _notify_usdt_deposit(telegram_id, amount)
+            credits.setdefault(unique_id, {
+                "event_id": unique_id,
+                "telegram_id": telegram_id,
+                "amount": amount,
+                "tx_type": "deposit",
+                "status": "completed",
+            })
             break  # one transfer per event
 
-    return credited
+    if not credits:
+        return []
+    db = SessionLocal()
+    try:
+        credited = _credit_usdt_batch(db, list(credits.values()))
+    finally:
+        db.close()
+    for telegram_id, amount, event_id in credited:
+        logger.info("Credited %s USDT to telegram_id=%s (event %s)", amount, telegram_id, event_id[len(PREFIX):])
+
+    return [(telegram_id, amount) for telegram_id, amount, _ in credited]
+
+
+async def notify_usdt_deposits(credited: list[tuple[int, Decimal]]) -> None:
+    """Send deposit notifications concurrently."""
+    await asyncio.gather(*(_notify_usdt_deposit(tid, amount) for tid, amount in credited))
+
+
+async def scan_usdt_deposits() -> int:
+    """
+    Fetch events for our USDT deposit wallet, process incoming Jetton transfers.
+    Returns count of new deposits credited.
+    """
+    wallet = (settings.usdt_deposit_wallet or "").strip()
+    if not wallet:
+        logger.debug("USDT deposit wallet not configured, skip scan")
+        return 0
 
+    try:
+        events = await fetch_account_events(wallet)
+    except Exception as e:
+        logger.warning("TonAPI fetch failed: %s", e)
+        return 0
 
-async def scan_usdt_deposits_async() -> int:
-    """Async wrapper for scheduler."""
-    import asyncio
-    return await asyncio.to_thread(scan_usdt_deposits)
+    # DB layer is sync: only the credit transaction runs in a worker thread
+    credited = await asyncio.to_thread(process_usdt_events, events)
+    await notify_usdt_deposits(credited)
+    return len(credited)
@@ -5,179 +5,340 @@ Processes pending withdrawals from DB, sends USDT (Jetton) via hot wallet.
 """
 from __future__ import annotations
 
+import asyncio
 import logging
 import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
+from functools import cache
 from urllib.parse import quote
 
-import httpx
-from sqlalchemy import select
+import orjson
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
 from app.db.models import UsdtTransaction, UserBalance
 from app.db.session import SessionLocal
+from app.services.hot_wallet import HOT_WALLET_LOCK, wait_seqno_advance
+from app.services.http_clients import (
+    telegram_async_client,
+    tonapi_async_client,
+    toncenter_async_client,
+)
+from app.services.ton_deposit_scanner import _addr_hash, _norm_addr
 
 logger = logging.getLogger(__name__)
 
 USDT_DECIMALS = 6
+_USDT_D = Decimal(10**USDT_DECIMALS)
 USDT_WITHDRAW_FEE = Decimal("0.3")
 # TON for gas (nanotons). Exit 48 / bounce = need more gas. Conservative values.
 FORWARD_TON_AMOUNT = int(0.02 * 1e9)  # 0.02 TON to recipient (Jetton processing + notification)
 GAS_TON_AMOUNT = int(0.03 * 1e9)  # 0.03 TON for our message (buffer for jetton transfer)
 
+_WITHDRAW_FAILED_TEXT = (
+    "<b>⚠️ Вывод -{amount} USDT отменён</b>\n\n"
+    "<b>Причина:</b> {reason}\n"
+    "<b>Адрес:</b> <pre>{address}</pre>\n\n"
+    "Средства возвращены на ваш баланс."
+)
+_WITHDRAW_COMPLETED_TEXT = (
+    '<b><tg-emoji emoji-id="5458525793921546124">😌</tg-emoji></b> <b>Вывод: -{amount} USDT завершён</b>\n\n'
+    "<b>Адрес получения:</b>\n<pre>{address}</pre>\n"
+    "<b>ID транзакции:</b>\n<pre>{tx_hash}</pre>"
+)
+
+# After send: wait for the block, then retry TonAPI lookups with backoff (seconds)
+TX_HASH_CONFIRM_DELAY = 8.0
+TX_HASH_RETRY_DELAYS = (2.0, 4.0)
+# Our clock vs. block time: a matching event up to this much older than the send can still be it
+TX_EVENT_CLOCK_SKEW_SEC = 15
+# Undeployed hot wallet: max wait for send_init_external to land (seconds)
+DEPLOY_WAIT_TIMEOUT_SEC = 30.0
+# Sends are serialized on the hot wallet (see hot_wallet); post-send verifications run concurrently
+WITHDRAW_LOOKUP_CONCURRENCY = 5
+# Claimed/sent rows older than this are stranded (a run takes a few minutes at most)
+STALE_WITHDRAWAL_SEC = 30 * 60
+
+
+# Wallet version ("v5r1"/"v4r2"/"v3r2") that matched the configured address last time
+_wallet_version: str | None = None
+# (jetton_master, owner) -> our Jetton wallet Address; deterministic, so kept for the process
+_jetton_wallets: dict[tuple[str, str], object] = {}
+
+
+@dataclass(frozen=True, slots=True)
+class _WithdrawConfig:
+    our_wallet: str  # hot wallet address (withdraw wallet, else deposit wallet)
+    jetton_master: str
+    bot_token: str
+
+
+@cache
+def _get_config() -> _WithdrawConfig:
+    """Withdraw settings, read and stripped once per process (settings are fixed at startup)."""
+    return _WithdrawConfig(
+        our_wallet=(getattr(settings, "usdt_withdraw_wallet", None) or "").strip()
+        or (getattr(settings, "usdt_deposit_wallet", None) or "").strip(),
+        jetton_master=(settings.usdt_jetton_master or "").strip(),
+        bot_token=(settings.tg_bot_token or "").strip(),
+    )
+
 
 def _get_db() -> Session:
     return SessionLocal()
 
 
-def _refund_withdrawal(telegram_id: int, amount_usdt: Decimal, fee: Decimal) -> None:
-    """Refund user balance when withdrawal fails."""
-    db = _get_db()
-    try:
-        gross = amount_usdt + fee
-        bal = db.execute(
-            select(UserBalance).where(
-                UserBalance.telegram_id == telegram_id,
-                UserBalance.currency == "usdt",
-            )
-        ).scalar_one_or_none()
-        if bal:
-            bal.available += gross
-            bal.total_withdrawn -= gross  # revert
-            db.commit()
-            logger.info("Refunded %s USDT to telegram_id=%s (withdrawal failed)", gross, telegram_id)
-    except Exception as e:
-        logger.exception("Refund failed: %s", e)
-        db.rollback()
-    finally:
-        db.close()
+def _to_micro(amount: Decimal) -> int:
+    """USDT amount (DB Numeric) -> minimal units (6 decimals)."""
+    return int(amount * _USDT_D)
+
+
+USDT_WITHDRAW_FEE_MICRO = _to_micro(USDT_WITHDRAW_FEE)
+
+
+def _fmt_usdt(micro: int) -> str:
+    """Minimal units -> USDT string without trailing zeros ("12", "12.5")."""
+    whole, frac = divmod(micro, 1_000_000)
+    return f"{whole}.{frac:06d}".rstrip("0") if frac else str(whole)
+
+
+def _refund_withdrawal(db: Session, telegram_id: int, amount_usdt: Decimal, fee: Decimal) -> None:
+    """Refund user balance when withdrawal fails (amount + fee). Committed by the caller."""
+    gross = amount_usdt + fee
+    refunded = db.execute(
+        update(UserBalance)
+        .where(UserBalance.telegram_id == telegram_id, UserBalance.currency == "usdt")
+        .values(
+            available=UserBalance.available + gross,
+            total_withdrawn=UserBalance.total_withdrawn - gross,  # revert
+        )
+    ).rowcount
+    if refunded:
+        logger.info("Refunded %s USDT to telegram_id=%s (withdrawal failed)", gross, telegram_id)
+
+
+def _report_stale_withdrawals(db: Session) -> None:
+    """
+    Escalate rows stuck in "processing" (run died after the claim) or "sent" (tx hash never
+    found): the user's balance stays debited until someone reconciles them.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=STALE_WITHDRAWAL_SEC)
+    stale = db.execute(
+        select(UsdtTransaction.event_id, UsdtTransaction.telegram_id, UsdtTransaction.amount, UsdtTransaction.status)
+        .where(
+            UsdtTransaction.tx_type == "withdrawal",
+            UsdtTransaction.status.in_(("processing", "sent")),
+            UsdtTransaction.created_at < cutoff,
+        )
+    ).all()
+    for event_id, telegram_id, amount, status in stale:
+        logger.error(
+            "Stale USDT withdrawal %s (%s): %s USDT for telegram_id=%s needs manual reconciliation",
+            event_id, status, amount, telegram_id,
+        )
 
 
-def _fetch_tx_hash_from_tonapi(
-    our_wallet: str, dest_address: str, amount_raw: int, jetton_wallet: str | None = None
-) -> str | None:
-    """Try to get tx hash from TonAPI and TON Center after send."""
-    api_key = (settings.tonapi_key or "").strip()
-    headers = {}
-    if api_key:
-        headers["Authorization"] = f"Bearer {api_key}"
-    dest_norm = dest_address.replace("-", "").replace("_", "").lower()
+def _index_jetton_transfers(
+    events: list[dict], idx: dict[tuple[bytes, int], dict[str, tuple[str, int | None]]]
+) -> None:
+    """
+    Add JettonTransfers in TonAPI events to idx: (recipient hash_part, amount_raw) ->
+    {event_id: (tx_hash, timestamp)}. Keyed by event_id so a transfer seen on both our wallet
+    and its jetton wallet counts once; several sends to the same address for the same amount
+    each keep their own entry.
+    """
+    for ev in events:
+        txs = ev.get("base_transactions") or []
+        event_id = ev.get("event_id") or (txs[0] if txs else None)
+        tx_hash = txs[0] if txs and isinstance(txs[0], str) else event_id
+        if not event_id or not tx_hash:
+            continue
+        for act in ev.get("actions") or ():
+            if act.get("type") != "JettonTransfer":
+                continue
+            jt = act.get("JettonTransfer") or act
+            try:
+                amount_raw = int(jt.get("amount"))
+            except (TypeError, ValueError):
+                continue
+            recip = jt.get("recipient") or {}
+            recip_addr = recip.get("address") if isinstance(recip, dict) else str(recip)
+            recip_hash = _addr_hash(recip_addr) if recip_addr else None
+            if recip_hash is None:
+                continue
+            idx.setdefault((recip_hash, amount_raw), {}).setdefault(event_id, (tx_hash, ev.get("timestamp")))
+
+
+async def _fetch_usdt_tx_hashes(
+    our_wallet: str, targets: list[tuple[str, int, float, str | None]]
+) -> list[str | None]:
+    """
+    Get tx hashes for a batch of sends (dest_address, amount_raw, sent_at, jetton_wallet).
+    Our wallet and its jetton wallet are polled together and each events page is matched
+    against every still-unresolved send: a hash goes to at most one send, oldest send first,
+    and events older than the send are skipped. TON Center (latest tx) is only a fallback
+    for a single send.
+    """
+    keys = [(_addr_hash(dest), int(amount_raw)) for dest, amount_raw, _, _ in targets]
+    found: list[str | None] = [None] * len(keys)
+    accounts = list(dict.fromkeys(a for a in (our_wallet, *(t[3] for t in targets)) if a))
+    limit = min(100, max(30, 3 * len(keys)))
 
-    def _fetch_tonapi(account_addr: str) -> str | None:
-        url = f"https://tonapi.io/v2/accounts/{account_addr}/events"
+    async def _fetch_tonapi(account_addr: str) -> list[dict]:
         try:
-            with httpx.Client(timeout=20.0) as client:
-                resp = client.get(url, params={"limit": 50}, headers=headers or None)
-                resp.raise_for_status()
-                data = resp.json()
+            resp = await tonapi_async_client().get(
+                f"/v2/accounts/{account_addr}/events", params={"limit": limit}, timeout=20.0
+            )
+            resp.raise_for_status()
+            return orjson.loads(resp.content).get("events") or []
         except Exception as e:
             logger.debug("TonAPI fetch (%s): %s", account_addr[:20], e)
+            return []
+
+    used: set[str] = set()  # event_ids already assigned
+    await asyncio.sleep(TX_HASH_CONFIRM_DELAY)  # Wait for block confirmation
+    for delay in (0.0, *TX_HASH_RETRY_DELAYS):
+        if delay:
+            await asyncio.sleep(delay)  # TonAPI indexing delay
+        idx: dict[tuple[bytes, int], dict[str, tuple[str, int | None]]] = {}
+        for events in await asyncio.gather(*(_fetch_tonapi(a) for a in accounts)):
+            _index_jetton_transfers(events, idx)
+        for i, key in enumerate(keys):
+            if found[i] is not None or key[0] is None:
+                continue
+            not_before = targets[i][2] - TX_EVENT_CLOCK_SKEW_SEC
+            candidates = [
+                (ts or 0, event_id, tx_hash)
+                for event_id, (tx_hash, ts) in idx.get(key, {}).items()
+                if event_id not in used and (ts is None or ts >= not_before)
+            ]
+            if candidates:
+                _, event_id, found[i] = min(candidates)
+                used.add(event_id)
+        if all(found):
+            break
+
+    if len(keys) == 1 and found[0] is None:
+
+        async def _fetch_toncenter(account_addr: str) -> str | None:
+            try:
+                resp = await toncenter_async_client().get(
+                    "/api/v2/getTransactions", params={"address": account_addr, "limit": 5}
+                )
+                resp.raise_for_status()
+                data = orjson.loads(resp.content)
+            except Exception as e:
+                logger.debug("TON Center fetch (%s): %s", account_addr[:20], e)
+                return None
+            for tx in data.get("result") or []:
+                h = (tx.get("transaction_id") or {}).get("hash")
+                if h:
+                    return h
             return None
 
-        for ev in data.get("events") or []:
-            for act in ev.get("actions") or []:
-                if act.get("type") != "JettonTransfer":
-                    continue
-                jt = act.get("JettonTransfer") or act
-                recip = jt.get("recipient") or {}
-                recip_addr = (recip.get("address") if isinstance(recip, dict) else str(recip)) or ""
-                recip_norm = recip_addr.replace("-", "").replace("_", "").lower()
-                amt = jt.get("amount")
-                if dest_norm in recip_norm and str(amt) == str(amount_raw):
-                    txs = ev.get("base_transactions") or []
-                    if txs and isinstance(txs[0], str):
-                        return txs[0]
-                    return ev.get("event_id") or (txs[0] if txs else None)
-        return None
+        # Jetton wallet first: its latest tx is the transfer itself
+        hashes = await asyncio.gather(*(_fetch_toncenter(a) for a in reversed(accounts)))
+        found[0] = next((h for h in hashes if h), None)
+
+    for (dest, amount_raw, _, _), tx_hash in zip(targets, found):
+        if tx_hash:
+            logger.info("Withdrawal tx hash found: %s", tx_hash[:20] + "...")
+        else:
+            logger.info("Withdrawal tx hash not found for %s USDT to %s", amount_raw / 1_000_000, dest[:24])
+    return found
 
-    def _fetch_toncenter(account_addr: str) -> str | None:
-        """Fallback: get latest tx hash from TON Center (most recent = our send)."""
-        url = "https://toncenter.com/api/v2/getTransactions"
-        try:
-            with httpx.Client(timeout=15.0) as client:
-                resp = client.get(url, params={"address": account_addr, "limit": 5})
-                resp.raise_for_status()
-                data = resp.json()
-        except Exception as e:
-            logger.debug("TON Center fetch (%s): %s", account_addr[:20], e)
-            return None
 
-        for tx in data.get("result") or []:
-            tid = tx.get("transaction_id") or {}
-            h = tid.get("hash")
-            if h:
-                return h
+# tx_hash -> (success, cached_at). On-chain verdicts are final; only definitive results are cached.
+VERIFY_CACHE_TTL_SEC = 300
+VERIFY_CACHE_MAX_SIZE = 512
+_verify_cache: dict[str, tuple[bool, float]] = {}
+VERIFY_WAIT_TIMEOUT_SEC = 20.0
+
+
+def _verify_cache_get(tx_hash: str) -> bool | None:
+    entry = _verify_cache.get(tx_hash)
+    if entry is None:
+        return None
+    success, cached_at = entry
+    if time.monotonic() - cached_at > VERIFY_CACHE_TTL_SEC:
+        _verify_cache.pop(tx_hash, None)
         return None
+    return success
 
-    time.sleep(8)  # Wait for block confirmation
-    result = _fetch_tonapi(our_wallet)
-    if not result and jetton_wallet:
-        result = _fetch_tonapi(jetton_wallet)
-    if not result:
-        time.sleep(7)  # TonAPI indexing delay
-        result = _fetch_tonapi(our_wallet)
-        if not result and jetton_wallet:
-            result = _fetch_tonapi(jetton_wallet)
-    if not result and jetton_wallet:
-        result = _fetch_toncenter(jetton_wallet)
-    if not result and our_wallet:
-        result = _fetch_toncenter(our_wallet)
-
-    if result:
-        logger.info("Withdrawal tx hash found: %s", result[:20] + "...")
-    else:
-        logger.info("Withdrawal tx hash not found for %s USDT to %s", amount_raw / 1e6, dest_address[:24])
-    return result
+
+def _verify_cache_put(tx_hash: str, success: bool) -> None:
+    if len(_verify_cache) >= VERIFY_CACHE_MAX_SIZE:
+        # Dicts keep insertion order: drop the oldest entry
+        _verify_cache.pop(next(iter(_verify_cache)), None)
+    _verify_cache[tx_hash] = (success, time.monotonic())
 
 
-def _verify_tx_success(tx_hash: str) -> bool | None:
+async def _verify_tx_success(tx_hash: str) -> bool | None:
     """Check via TonAPI if transaction succeeded. Returns True/False/None (unknown)."""
-    api_key = (settings.tonapi_key or "").strip()
-    headers = {}
-    if api_key:
-        headers["Authorization"] = f"Bearer {api_key}"
-    url = f"https://tonapi.io/v2/blockchain/transactions/{quote(tx_hash, safe='')}"
+    cached = _verify_cache_get(tx_hash)
+    if cached is not None:
+        return cached
+    url = f"/v2/blockchain/transactions/{quote(tx_hash, safe='')}"
     try:
-        with httpx.Client(timeout=15.0) as client:
-            resp = client.get(url, headers=headers or None)
-            resp.raise_for_status()
-            data = resp.json()
-        return bool(data.get("success"))
+        resp = await tonapi_async_client().get(url, timeout=15.0)
+        resp.raise_for_status()
+        data = orjson.loads(resp.content)
+        success = bool(data.get("success"))
+        _verify_cache_put(tx_hash, success)
+        return success
     except Exception as e:
         logger.debug("TonAPI tx verify (%s): %s", tx_hash[:16], e)
         return None
 
 
-def _notify_withdrawal_failed(
+async def _wait_verified(tx_hash: str, timeout: float = VERIFY_WAIT_TIMEOUT_SEC) -> bool | None:
+    """
+    Wait for the on-chain verdict: re-check with exponential backoff (1s, 2s, 4s, capped at 5s)
+    and return as soon as TonAPI reports it. None if still unknown after timeout.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    delay = 1.0
+    while True:
+        verified = await _verify_tx_success(tx_hash)
+        if verified is not None:
+            return verified
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return None
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, 5.0)
+
+
+async def _notify_withdrawal_failed(
     telegram_id: int,
     net_amount: Decimal,
     address: str,
     reason: str = "Транзакция не прошла в сети. Средства возвращены на баланс.",
 ) -> None:
     """Notify user that withdrawal failed and was refunded."""
-    token = (settings.tg_bot_token or "").strip()
+    token = _get_config().bot_token
     if not token:
         return
-    gross = net_amount + USDT_WITHDRAW_FEE
-    amt_str = str(int(gross)) if gross == gross.to_integral_value() else str(gross).rstrip("0").rstrip(".")
-    text = (
-        f'<b>⚠️ Вывод -{amt_str} USDT отменён</b>\n\n'
-        f"<b>Причина:</b> {reason}\n"
-        f"<b>Адрес:</b> <pre>{address[:48]}{'...' if len(address) > 48 else ''}</pre>\n\n"
-        f"Средства возвращены на ваш баланс."
+    amt_str = _fmt_usdt(_to_micro(net_amount) + USDT_WITHDRAW_FEE_MICRO)
+    text = _WITHDRAW_FAILED_TEXT.format(
+        amount=amt_str,
+        reason=reason,
+        address=address[:48] + ("..." if len(address) > 48 else ""),
     )
     try:
-        with httpx.Client(timeout=10.0) as client:
-            client.post(
-                f"https://api.telegram.org/bot{token}/sendMessage",
-                json={"chat_id": telegram_id, "text": text, "parse_mode": "HTML"},
-            )
+        await telegram_async_client().post(
+            f"/bot{token}/sendMessage",
+            json={"chat_id": telegram_id, "text": text, "parse_mode": "HTML"},
+        )
     except Exception as e:
         logger.warning("Failed to send withdrawal failure notification to %s: %s", telegram_id, e)
 
 
-def _notify_withdrawal_completed(
+async def _notify_withdrawal_completed(
     telegram_id: int,
     net_amount: Decimal,
     address: str,
@@ -185,11 +346,10 @@ def _notify_withdrawal_completed(
     our_wallet: str | None = None,
 ) -> None:
     """Send Telegram notification when withdrawal is completed."""
-    token = (settings.tg_bot_token or "").strip()
+    token = _get_config().bot_token
     if not token:
         return
-    gross = net_amount + USDT_WITHDRAW_FEE  # amount user withdrew
-    amt_str = str(int(gross)) if gross == gross.to_integral_value() else str(gross).rstrip("0").rstrip(".")
+    amt_str = _fmt_usdt(_to_micro(net_amount) + USDT_WITHDRAW_FEE_MICRO)  # amount user withdrew
     if tx_hash and len(tx_hash) >= 10:
         track_url = f"https://tonscan.org/tx/{quote(tx_hash, safe='')}"
     elif our_wallet:
@@ -197,10 +357,10 @@ def _notify_withdrawal_completed(
     else:
         track_url = None
 
-    text = (
-        f'<b><tg-emoji emoji-id="5458525793921546124">😌</tg-emoji></b> <b>Вывод: -{amt_str} USDT завершён</b>\n\n'
-        f"<b>Адрес получения:</b>\n<pre>{address[:64]}{'...' if len(address) > 64 else ''}</pre>\n"
-        f"<b>ID транзакции:</b>\n<pre>{tx_hash or '—'}</pre>"
+    text = _WITHDRAW_COMPLETED_TEXT.format(
+        amount=amt_str,
+        address=address[:64] + ("..." if len(address) > 64 else ""),
+        tx_hash=tx_hash or "—",
     )
     payload: dict = {"chat_id": telegram_id, "text": text, "parse_mode": "HTML"}
     if track_url:
@@ -208,18 +368,18 @@ def _notify_withdrawal_completed(
             "inline_keyboard": [[{"text": "👀 Отследить", "url": track_url}]]
         }
     try:
-        with httpx.Client(timeout=10.0) as client:
-            resp = client.post(
-                f"https://api.telegram.org/bot{token}/sendMessage",
-                json=payload,
-            )
-            resp.raise_for_status()
+        resp = await telegram_async_client().post(f"/bot{token}/sendMessage", json=payload)
+        resp.raise_for_status()
     except Exception as e:
         logger.warning("Failed to send withdrawal notification to %s: %s", telegram_id, e)
 
 
+@cache
 def _load_withdraw_private_key() -> bytes | None:
-    """Загрузить приватный ключ: из USDT_WITHDRAW_PRIVATE_KEY (hex) или из мнемоники."""
+    """
+    Загрузить приватный ключ: из USDT_WITHDRAW_PRIVATE_KEY (hex) или из мнемоники.
+    Derived once per process (settings are fixed at startup); call cache_clear() after a reload.
+    """
     pk_hex = (getattr(settings, "usdt_withdraw_private_key", None) or "").strip()
     if pk_hex:
         try:
@@ -251,72 +411,57 @@ def _load_withdraw_private_key() -> bytes | None:
         return None
 
 
-async def _send_jetton_withdrawal(
-    destination_address: str,
-    amount_usdt: Decimal,
-    comment: str | None,
-) -> str | None:
+def _raw_addr(addr) -> str:
+    """Extract parseable address string (pytoniq may return 'Address<EQ...>')."""
+    if hasattr(addr, "to_str"):
+        return addr.to_str()
+    s = str(addr).strip()
+    if s.startswith("Address<") and ">" in s:
+        s = s[8 : s.rindex(">")]
+    return s
+
+
+def _addr_match(got: str, exp: str) -> bool:
+    """Compare addresses by hash_part (bounceable/non-bounceable have same hash)."""
+    try:
+        from pytoniq_core.boc.address import Address as AddrCls
+        g, e = AddrCls(got), AddrCls(exp)
+        return g.hash_part == e.hash_part and g.wc == e.wc
+    except Exception:
+        # Fallback: compare hash part (exclude 2-char tag and 4-char checksum)
+        g = _norm_addr(got)
+        e = _norm_addr(exp)
+        if len(g) >= 10 and len(e) >= 10:
+            return g[2:-4] == e[2:-4]
+        return g == e
+
+
+async def _open_hot_wallet():
     """
-    Send USDT Jetton to destination. Returns tx hash on success, None on failure.
-    Supports USDT_WITHDRAW_PRIVATE_KEY (hex) or USDT_WITHDRAW_MNEMONIC.
+    Start a LiteBalancer and resolve the hot wallet contract for the withdraw key.
+    Returns (provider, wallet) or None; caller must close the provider.
     """
-    jetton_master = (settings.usdt_jetton_master or "").strip()
-    if not jetton_master:
-        logger.warning("USDT withdraw: jetton_master not configured")
-        return None
-
+    global _wallet_version
     private_key = _load_withdraw_private_key()
     if not private_key:
         logger.warning("USDT withdraw: usdt_withdraw_private_key or usdt_withdraw_mnemonic required")
         return None
 
     try:
-        from pytoniq import LiteBalancer, WalletV3R2, WalletV4R2, WalletV5R1, begin_cell, Address
+        from pytoniq import LiteBalancer, WalletV3R2, WalletV4R2, WalletV5R1
     except ImportError as e:
         logger.error("pytoniq not installed: %s", e)
         return None
 
-    destination_address = destination_address.strip()
-    if len(destination_address) < 40:
-        logger.warning("Invalid destination address: %s", destination_address[:20])
-        return None
-
-    # Amount in minimal units (USDT = 6 decimals)
-    amount_raw = int(amount_usdt * Decimal(10**USDT_DECIMALS))
-    if amount_raw <= 0:
-        return None
-
-    expected = (getattr(settings, "usdt_withdraw_wallet", None) or "").strip() or (getattr(settings, "usdt_deposit_wallet", None) or "").strip()
-
-    def _raw_addr(addr) -> str:
-        """Extract parseable address string (pytoniq may return 'Address<EQ...>')."""
-        if hasattr(addr, "to_str"):
-            return addr.to_str()
-        s = str(addr).strip()
-        if s.startswith("Address<") and ">" in s:
-            s = s[8 : s.rindex(">")]
-        return s
-
-    def addr_match(got: str, exp: str) -> bool:
-        """Compare addresses by hash_part (bounceable/non-bounceable have same hash)."""
-        try:
-            from pytoniq_core.boc.address import Address as AddrCls
-            return AddrCls(got).hash_part == AddrCls(exp).hash_part and AddrCls(got).wc == AddrCls(exp).wc
-        except Exception:
-            # Fallback: compare hash part (exclude 2-char tag and 4-char checksum)
-            g = got.replace("-", "").replace("_", "").lower()
-            e = exp.replace("-", "").replace("_", "").lower()
-            if len(g) >= 10 and len(e) >= 10:
-                return g[2:-4] == e[2:-4]
-            return g == e
+    expected = _get_config().our_wallet
 
+    provider = None
     try:
         provider = LiteBalancer.from_mainnet_config(1)
         await provider.start_up()
 
-        wallet = None
         # Tonkeeper uses V5R1 by default; try v5r1 first, then v4r2, v3r2
-        for version_name, create_fn in [
+        candidates = [
             ("v5r1", lambda: WalletV5R1.from_private_key(
                 provider, private_key, wc=0, network_global_id=-239
             )),
@@ -326,34 +471,98 @@ async def _send_jetton_withdrawal(
             ("v3r2", lambda: WalletV3R2.from_private_key(
                 provider, private_key, version="v3r2"
             )),
-        ]:
+        ]
+        # Try the version that matched last time first (one wallet object instead of up to three)
+        candidates.sort(key=lambda c: c[0] != _wallet_version)
+        w = None
+        for version_name, create_fn in candidates:
             w = await create_fn()
-            if not expected or addr_match(_raw_addr(w.address), expected):
-                wallet = w
+            if not expected or _addr_match(_raw_addr(w.address), expected):
+                _wallet_version = version_name
                 logger.debug("USDT wallet matched: %s", version_name)
-                break
-
-        if not wallet:
-            got_addr = _raw_addr(w.address) if w else "?"
-            logger.error(
-                "USDT wallet address mismatch: got %s, expected %s",
-                got_addr[:50] if got_addr else "?",
-                expected[:50] if expected else "?",
-            )
+                return provider, w
+
+        got_addr = _raw_addr(w.address) if w else "?"
+        logger.error(
+            "USDT wallet address mismatch: got %s, expected %s",
+            got_addr[:50] if got_addr else "?",
+            expected[:50] if expected else "?",
+        )
+    except Exception as e:
+        logger.exception("USDT wallet init failed: %s", e)
+    if provider is not None:
+        try:
             await provider.close_all()
-            return None
+        except Exception:
+            pass
+    return None
 
-        owner_address = wallet.address
 
-        # Get our Jetton wallet address from Jetton Master
-        jetton_master_addr = Address(jetton_master)
+async def _resolve_jetton_wallet(provider, jetton_master: str, owner_address):
+    """Our Jetton wallet address from Jetton Master (get_wallet_address), cached per (master, owner)."""
+    key = (jetton_master, _raw_addr(owner_address))
+    addr = _jetton_wallets.get(key)
+    if addr is None:
+        from pytoniq import begin_cell, Address
+
         stack = [begin_cell().store_address(owner_address).end_cell().begin_parse()]
         result = await provider.run_get_method(
-            address=jetton_master_addr,
+            address=Address(jetton_master),
             method="get_wallet_address",
             stack=stack,
         )
-        user_jetton_wallet = result[0].load_address()
+        addr = _jetton_wallets[key] = result[0].load_address()
+    return addr
+
+
+async def _await_account_active(provider, address, timeout: float = DEPLOY_WAIT_TIMEOUT_SEC) -> bool:
+    """Poll account state every 2s until it is active (deploy confirmed). False on timeout."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        await asyncio.sleep(2)
+        try:
+            account = await provider.get_account_state(address)
+            if str(getattr(account.state, "type_", "")).endswith("active"):
+                return True
+        except Exception as e:
+            logger.debug("Account state poll: %s", e)
+    return False
+
+
+async def _send_jetton_withdrawal(
+    provider,
+    wallet,
+    destination_address: str,
+    amount_raw: int,
+    comment: str | None,
+) -> tuple[int, str | None] | None:
+    """
+    Send amount_raw (minimal units) of USDT Jetton to destination from the opened hot wallet.
+    Returns (wallet seqno the transfer was signed with, our jetton wallet address), None on failure.
+    """
+    jetton_master = _get_config().jetton_master
+    if not jetton_master:
+        logger.warning("USDT withdraw: jetton_master not configured")
+        return None
+
+    try:
+        from pytoniq import begin_cell, Address
+    except ImportError as e:
+        logger.error("pytoniq not installed: %s", e)
+        return None
+
+    destination_address = destination_address.strip()
+    if len(destination_address) < 40:
+        logger.warning("Invalid destination address: %s", destination_address[:20])
+        return None
+
+    if amount_raw <= 0:
+        return None
+
+    try:
+        owner_address = wallet.address
+        user_jetton_wallet = await _resolve_jetton_wallet(provider, jetton_master, owner_address)
         dest_address = Address(destination_address)
 
         # Build forward_payload (comment) if provided; TEP-74 requires ref even if empty
@@ -382,6 +591,7 @@ async def _send_jetton_withdrawal(
         )
 
         try:
+            seqno = await wallet.get_seqno()
             await wallet.transfer(
                 destination=user_jetton_wallet,
                 amount=GAS_TON_AMOUNT,
@@ -393,7 +603,9 @@ async def _send_jetton_withdrawal(
             if exit_code == -256 and hasattr(wallet, "send_init_external"):
                 logger.info("USDT wallet undeployed, deploying via send_init_external...")
                 await wallet.send_init_external()
-                time.sleep(15)  # wait for deploy confirmation on chain
+                if not await _await_account_active(provider, owner_address):
+                    logger.warning("USDT wallet deploy not confirmed after %ss, sending anyway", DEPLOY_WAIT_TIMEOUT_SEC)
+                seqno = await wallet.get_seqno()
                 await wallet.transfer(
                     destination=user_jetton_wallet,
                     amount=GAS_TON_AMOUNT,
@@ -402,9 +614,8 @@ async def _send_jetton_withdrawal(
             else:
                 raise
 
-        await provider.close_all()
         jetton_addr = _raw_addr(user_jetton_wallet) if user_jetton_wallet else None
-        return ("sent", jetton_addr)
+        return seqno, jetton_addr
     except Exception as e:
         logger.exception("USDT Jetton transfer failed: %s", e)
         return None
@@ -414,6 +625,13 @@ async def process_pending_withdrawals() -> int:
     """
     Process pending USDT withdrawals: send via TON, update status.
     Returns count of successfully processed withdrawals.
+
+    Rows are claimed as "processing" and each one is committed as "sent" right after its
+    transfer, so a crash or rollback never re-sends it. Transfers go out one by one under
+    HOT_WALLET_LOCK, each waiting for the wallet seqno to advance before the next. Hashes are
+    then looked up for the whole batch at once (so same-address, same-amount sends get distinct
+    hashes) and verified concurrently. Rows whose hash is not found stay "sent" and are never
+    reported as completed.
     """
     if not _load_withdraw_private_key():
         logger.debug("USDT withdraw: private key / mnemonic not configured, skip")
@@ -421,7 +639,13 @@ async def process_pending_withdrawals() -> int:
 
     db = _get_db()
     processed = 0
+    notify_tasks = []
+    hot = None  # (provider, wallet), opened on first send and shared by the batch
     try:
+        _report_stale_withdrawals(db)
+
+        # Claim a batch: SKIP LOCKED lets an overlapping tick/worker take other rows,
+        # and "processing" keeps them claimed after the lock is released by commit.
         rows = db.execute(
             select(UsdtTransaction)
             .where(
@@ -430,96 +654,144 @@ async def process_pending_withdrawals() -> int:
             )
             .order_by(UsdtTransaction.created_at.asc())
             .limit(10)
+            .with_for_update(skip_locked=True)
         ).scalars().all()
-
-        our_wallet = (getattr(settings, "usdt_withdraw_wallet", None) or "").strip() or (getattr(settings, "usdt_deposit_wallet", None) or "").strip()
-
         for tx in rows:
-            if not tx.memo or len(tx.memo) < 40:
-                logger.warning("Withdrawal %s: invalid address in memo", tx.event_id)
-                tx.status = "failed"
-                _refund_withdrawal(tx.telegram_id, tx.amount, USDT_WITHDRAW_FEE)
-                db.commit()
-                continue
+            tx.status = "processing"
+        db.commit()
+
+        our_wallet = _get_config().our_wallet
 
-            # Re-verify balance in DB before send (amount was deducted at request time)
-            gross = tx.amount + USDT_WITHDRAW_FEE
-            bal = db.execute(
+        # Re-verify balances in DB before send (amount was deducted at request time): one query per batch
+        user_ids = {tx.telegram_id for tx in rows}
+        balances = {
+            bal.telegram_id: bal
+            for bal in db.execute(
                 select(UserBalance).where(
-                    UserBalance.telegram_id == tx.telegram_id,
+                    UserBalance.telegram_id.in_(user_ids),
                     UserBalance.currency == "usdt",
                 )
-            ).scalar_one_or_none()
-            if not bal:
-                logger.warning("Withdrawal %s: no balance record for user %s, skip", tx.event_id, tx.telegram_id)
-                tx.status = "failed"
-                _refund_withdrawal(tx.telegram_id, tx.amount, USDT_WITHDRAW_FEE)
-                db.commit()
-                continue
-            if bal.available < 0:
-                logger.error("Withdrawal %s: negative balance %.2f for user %s, skip", tx.event_id, bal.available, tx.telegram_id)
-                tx.status = "failed"
-                _refund_withdrawal(tx.telegram_id, tx.amount, USDT_WITHDRAW_FEE)
-                db.commit()
-                continue
-
-            result = await _send_jetton_withdrawal(
-                destination_address=tx.memo,
-                amount_usdt=tx.amount,
-                comment=tx.destination_memo,
-            )
-            if result:
-                _, jetton_wallet_addr = result
-                amount_raw = int(tx.amount * Decimal(10**USDT_DECIMALS))
-                tx.tx_hash = (
-                    _fetch_tx_hash_from_tonapi(our_wallet, tx.memo, amount_raw, jetton_wallet_addr)
-                    if our_wallet else None
-                )
-
-                verified = None
-                if tx.tx_hash:
-                    for attempt in range(3):
-                        verified = _verify_tx_success(tx.tx_hash)
-                        if verified is not None:
-                            break
-                        time.sleep(5)
+            ).scalars()
+        } if user_ids else {}
+
+        # Transfers that went out, with their lookup targets (dest, amount_raw, sent_at, jetton_wallet)
+        sent: list[UsdtTransaction] = []
+        targets: list[tuple[str, int, float, str | None]] = []
+        # One send at a time on the shared hot wallet (TON sender included): each transfer
+        # must be applied (seqno advanced) before the next one is signed.
+        async with HOT_WALLET_LOCK:
+            for tx in rows:
+                if not tx.memo or len(tx.memo) < 40:
+                    logger.warning("Withdrawal %s: invalid address in memo", tx.event_id)
+                    tx.status = "failed"
+                    _refund_withdrawal(db, tx.telegram_id, tx.amount, USDT_WITHDRAW_FEE)
+                    db.commit()
+                    continue
 
-                if verified is False:
+                bal = balances.get(tx.telegram_id)
+                if not bal:
+                    logger.warning("Withdrawal %s: no balance record for user %s, skip", tx.event_id, tx.telegram_id)
                     tx.status = "failed"
-                    _refund_withdrawal(tx.telegram_id, tx.amount, USDT_WITHDRAW_FEE)
-                    _notify_withdrawal_failed(
-                        tx.telegram_id, tx.amount, tx.memo or "",
-                        reason="Транзакция не прошла в сети (недостаточно газа или ошибка контракта).",
-                    )
-                    logger.warning("Withdrawal %s tx failed on-chain (hash=%s), refunded", tx.event_id, tx.tx_hash[:24])
+                    _refund_withdrawal(db, tx.telegram_id, tx.amount, USDT_WITHDRAW_FEE)
                     db.commit()
                     continue
-                elif verified is True:
-                    tx.status = "completed"
-                    processed += 1
-                    logger.info("Withdrawal %s verified: %s USDT to %s (tx=%s)", tx.event_id, tx.amount, tx.memo[:20], tx.tx_hash or "sent")
-                    _notify_withdrawal_completed(
-                        tx.telegram_id, tx.amount, tx.memo or "", tx.tx_hash, our_wallet
-                    )
+                if bal.available < 0:
+                    logger.error("Withdrawal %s: negative balance %.2f for user %s, skip", tx.event_id, bal.available, tx.telegram_id)
+                    tx.status = "failed"
+                    _refund_withdrawal(db, tx.telegram_id, tx.amount, USDT_WITHDRAW_FEE)
                     db.commit()
-                else:
-                    tx.status = "completed"
-                    processed += 1
-                    logger.warning("Withdrawal %s tx unverified (TonAPI?), marked completed: %s USDT to %s", tx.event_id, tx.amount, tx.memo[:20])
-                    _notify_withdrawal_completed(
-                        tx.telegram_id, tx.amount, tx.memo or "", tx.tx_hash, our_wallet
-                    )
+                    continue
+
+                amount_raw = _to_micro(tx.amount)  # converted once; int math from here on
+                if hot is None:
+                    hot = await _open_hot_wallet()
+                sent_at = time.time()
+                result = hot is not None and await _send_jetton_withdrawal(
+                    *hot,
+                    destination_address=tx.memo,
+                    amount_raw=amount_raw,
+                    comment=tx.destination_memo,
+                )
+                if not result:
+                    tx.status = "failed"
+                    _refund_withdrawal(db, tx.telegram_id, tx.amount, USDT_WITHDRAW_FEE)
+                    logger.warning("Withdrawal %s failed to send, refunded", tx.event_id)
                     db.commit()
-            else:
-                tx.status = "failed"
-                _refund_withdrawal(tx.telegram_id, tx.amount, USDT_WITHDRAW_FEE)
-                logger.warning("Withdrawal %s failed to send, refunded", tx.event_id)
+                    continue
+                # Persist before any lookup: a "sent" row is never sent again, even after a crash
+                tx.status = "sent"
                 db.commit()
+                sent.append(tx)
+                targets.append((tx.memo, amount_raw, sent_at, result[1]))
+                if not await wait_seqno_advance(hot[1], result[0]):
+                    logger.warning(
+                        "Withdrawal %s: wallet seqno %s not advanced, pausing sends until next run",
+                        tx.event_id, result[0],
+                    )
+                    break
+
+            if hot is not None:
+                await hot[0].close_all()
+                hot = None
+
+        # Rows not reached after a paused send go back to the queue
+        unsent = [tx for tx in rows if tx.status == "processing"]
+        if unsent:
+            for tx in unsent:
+                tx.status = "pending"
+            db.commit()
+        if not sent:
+            return processed
+
+        hashes = await _fetch_usdt_tx_hashes(our_wallet, targets) if our_wallet else [None] * len(sent)
+        sem = asyncio.Semaphore(WITHDRAW_LOOKUP_CONCURRENCY)
+
+        async def _verify(tx_hash: str | None) -> bool | None:
+            if not tx_hash:
+                return None
+            async with sem:
+                return await _wait_verified(tx_hash)
+
+        verdicts = await asyncio.gather(*(_verify(h) for h in hashes))
+
+        for tx, tx_hash, verified in zip(sent, hashes, verdicts):
+            if not tx_hash:
+                # Transfer may or may not have landed: stays "sent" for reconciliation
+                logger.warning("Withdrawal %s: tx hash not found, left as sent", tx.event_id)
+                continue
+            tx.tx_hash = tx_hash
+            if verified is False:
+                tx.status = "failed"
+                _refund_withdrawal(db, tx.telegram_id, tx.amount, USDT_WITHDRAW_FEE)
+                notify_tasks.append(_notify_withdrawal_failed(
+                    tx.telegram_id, tx.amount, tx.memo or "",
+                    reason="Транзакция не прошла в сети (недостаточно газа или ошибка контракта).",
+                ))
+                logger.warning("Withdrawal %s tx failed on-chain (hash=%s), refunded", tx.event_id, tx.tx_hash[:24])
+                continue
+            tx.status = "completed"
+            processed += 1
+            if verified is True:
+                logger.info("Withdrawal %s verified: %s USDT to %s (tx=%s)", tx.event_id, tx.amount, tx.memo[:20], tx.tx_hash)
+            else:
+                logger.warning("Withdrawal %s tx unverified (TonAPI?), marked completed: %s USDT to %s", tx.event_id, tx.amount, tx.memo[:20])
+            notify_tasks.append(_notify_withdrawal_completed(
+                tx.telegram_id, tx.amount, tx.memo or "", tx.tx_hash, our_wallet
+            ))
+        db.commit()
 
     except Exception as e:
         logger.exception("Process withdrawals: %s", e)
         db.rollback()
     finally:
+        if hot is not None:
+            try:
+                await hot[0].close_all()
+            except Exception:
+                pass
         db.close()
 
+    # After commit, one round-trip for the whole batch; a failed send must not drop the others
+    await asyncio.gather(*notify_tasks, return_exceptions=True)
+
     return processed
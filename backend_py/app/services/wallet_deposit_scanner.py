@@ -0,0 +1,44 @@
+"""
+Merged deposit poller: scans USDT (Jetton) and native TON deposits in one job.
+When both deposit wallets are the same account, its event stream is fetched once
+and each event is routed to both processors (each only picks its own action type).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from decimal import Decimal
+
+from app.core.config import settings
+from app.services.ton_deposit_scanner import (
+    _addr_match,
+    notify_ton_deposits,
+    process_ton_events,
+    scan_ton_deposits,
+)
+from app.services.tonapi import fetch_account_events
+from app.services.usdt_deposit_scanner import notify_usdt_deposits, process_usdt_events, scan_usdt_deposits
+
+logger = logging.getLogger(__name__)
+
+
+async def scan_wallet_deposits() -> int:
+    """Scan USDT and TON deposits. Returns total count of new deposits credited."""
+    usdt_wallet = (settings.usdt_deposit_wallet or "").strip()
+    ton_wallet = (settings.ton_deposit_wallet or "").strip()
+
+    if not (usdt_wallet and ton_wallet and _addr_match(usdt_wallet, ton_wallet)):
+        return sum(await asyncio.gather(scan_usdt_deposits(), scan_ton_deposits()))
+
+    try:
+        events = await fetch_account_events(ton_wallet)
+    except Exception as e:
+        logger.warning("TonAPI fetch deposits failed: %s", e)
+        return 0
+
+    def _process() -> tuple[list[tuple[int, Decimal]], list[tuple[int, Decimal]]]:
+        return process_usdt_events(events), process_ton_events(events, ton_wallet)
+
+    usdt_credited, ton_credited = await asyncio.to_thread(_process)
+    await asyncio.gather(notify_usdt_deposits(usdt_credited), notify_ton_deposits(ton_credited))
+    return len(usdt_credited) + len(ton_credited)
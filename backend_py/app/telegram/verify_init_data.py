@@ -2,12 +2,14 @@ from __future__ import annotations
 
 import hashlib
 import hmac
-import json
 import time
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Any
 from urllib.parse import parse_qsl
 
+import orjson
+
 
 @dataclass(frozen=True)
 class VerifiedInitData:
@@ -17,11 +19,28 @@ class VerifiedInitData:
     start_param: str | None
 
 
-def _build_data_check_string(init_data_raw: str) -> tuple[str, str | None]:
+@lru_cache(maxsize=4)
+def _webapp_secret(bot_token: str) -> bytes:
+    """HMAC-SHA256 of the bot token keyed with "WebAppData" (constant per token)."""
+    return hmac.new(
+        key=b"WebAppData",
+        msg=bot_token.encode("utf-8"),
+        digestmod=hashlib.sha256,
+    ).digest()
+
+
+@lru_cache(maxsize=4)
+def _webapp_hmac(bot_token: str) -> hmac.HMAC:
+    """HMAC-SHA256 keyed with the secret, pads already applied. Callers must .copy() it."""
+    return hmac.new(key=_webapp_secret(bot_token), digestmod=hashlib.sha256)
+
+
+def _build_data_check_string(init_data_raw: str) -> tuple[str, str | None, dict[str, str]]:
     """
-    Return (data_check_string, hash_value).
+    Return (data_check_string, hash_value, params) from a single parse of initData.
     """
     pairs = parse_qsl(init_data_raw, keep_blank_values=True)
+    params = dict(pairs)
     hash_value = None
 
     items: list[tuple[str, str]] = []
@@ -33,7 +52,7 @@ def _build_data_check_string(init_data_raw: str) -> tuple[str, str | None]:
 
     items.sort(key=lambda kv: kv[0])
     data_check_string = "\n".join([f"{k}={v}" for k, v in items])
-    return data_check_string, hash_value
+    return data_check_string, hash_value, params
 
 
 def verify_webapp_init_data(
@@ -50,27 +69,18 @@ def verify_webapp_init_data(
     if not bot_token:
         return False, "bot token is missing"
 
-    data_check_string, hash_value = _build_data_check_string(init_data_raw)
+    data_check_string, hash_value, params = _build_data_check_string(init_data_raw)
     if not hash_value:
         return False, "hash missing"
 
-    secret_key = hmac.new(
-        key=b"WebAppData",
-        msg=bot_token.encode("utf-8"),
-        digestmod=hashlib.sha256,
-    ).digest()
-
-    computed_hash = hmac.new(
-        key=secret_key,
-        msg=data_check_string.encode("utf-8"),
-        digestmod=hashlib.sha256,
-    ).hexdigest()
+    mac = _webapp_hmac(bot_token).copy()
+    mac.update(data_check_string.encode("utf-8"))
+    computed_hash = mac.hexdigest()
 
     # timing-safe compare
     if not hmac.compare_digest(computed_hash, hash_value):
         return False, "hash mismatch"
 
-    params = dict(parse_qsl(init_data_raw, keep_blank_values=True))
     auth_date_raw = params.get("auth_date")
     auth_date: int | None = None
     if auth_date_raw is not None:
@@ -90,7 +100,7 @@ def verify_webapp_init_data(
     user: dict[str, Any] | None = None
     if user_json:
         try:
-            parsed = json.loads(user_json)
+            parsed = orjson.loads(user_json)
             if isinstance(parsed, dict):
                 user = parsed
         except Exception:
@@ -576,6 +576,37 @@ async def on_my_chat_member(event: ChatMemberUpdated, bot: Bot) -> None:
             logger.exception("Failed to process admin restoration: %s", e)
 
 
+@router.channel_post(F.new_chat_title | F.new_chat_photo | F.delete_chat_photo)
+async def on_channel_info_changed(message: Message, bot: Bot) -> None:
+    """Sync channel title/username/photo from channel service messages (weekly poll is the fallback)."""
+    chat = message.chat
+    db = _get_db()
+    try:
+        channel = db.scalars(select(Channel).where(Channel.telegram_id == chat.id)).first()
+        if not channel:
+            return
+        if message.new_chat_title and message.new_chat_title != channel.title:
+            logger.info("Channel %s title changed: '%s' -> '%s'", channel.id, channel.title, message.new_chat_title)
+            channel.title = message.new_chat_title
+        if chat.username != channel.username:
+            channel.username = chat.username
+        if message.delete_chat_photo:
+            channel.photo_url = None
+            channel.photo_file_unique_id = None
+            channel.photo_sha = None
+        db.commit()
+        if message.new_chat_photo:
+            from app.services.scheduler import update_single_channel_info
+
+            await update_single_channel_info(channel, db, update_posts_media=False)
+            db.commit()  # title/username changes picked up by getChat
+    except Exception as e:
+        logger.exception("Failed to sync channel info for chat %s: %s", chat.id, e)
+        db.rollback()
+    finally:
+        db.close()
+
+
 @router.pre_checkout_query()
 async def on_pre_checkout(pre: PreCheckoutQuery, bot: Bot) -> None:
     """Accept Stars top-up pre-checkout (payload: topup_{telegram_id}_{amount}_{ts})."""
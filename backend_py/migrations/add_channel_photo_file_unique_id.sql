@@ -0,0 +1,2 @@
+-- Channel: file_unique_id of stored photo (skip getFile + download when avatar unchanged)
+ALTER TABLE channels ADD COLUMN IF NOT EXISTS photo_file_unique_id VARCHAR(64);
@@ -0,0 +1,2 @@
+-- Channel: digest of stored photo bytes (skip rewriting identical avatars)
+ALTER TABLE channels ADD COLUMN IF NOT EXISTS photo_sha VARCHAR(32);
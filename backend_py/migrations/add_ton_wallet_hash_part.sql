@@ -0,0 +1,14 @@
+-- TON wallets: format-independent account hash for batched deposit sender lookup
+ALTER TABLE ton_wallets ADD COLUMN IF NOT EXISTS hash_part VARCHAR(64);
+CREATE INDEX IF NOT EXISTS ix_ton_wallets_hash_part ON ton_wallets (hash_part);
+
+-- Backfill (own transaction): raw "0:<hex>" addresses, else 48-char base64url friendly addresses.
+-- Malformed addresses are skipped and keep a NULL hash_part.
+BEGIN;
+UPDATE ton_wallets SET hash_part = CASE
+    WHEN address LIKE '%:%' THEN lower(split_part(address, ':', 2))
+    ELSE encode(substring(decode(translate(address, '-_', '+/'), 'base64') from 3 for 32), 'hex')
+END
+WHERE hash_part IS NULL
+  AND (address ~ '^[A-Za-z0-9_-]{48}$' OR address ~ '^-?[0-9]+:[0-9a-fA-F]{64}$');
+COMMIT;
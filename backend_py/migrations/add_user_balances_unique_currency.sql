@@ -0,0 +1,37 @@
+-- User balances: one row per (telegram_id, currency).
+-- Composite index for balance lookups and conflict target for deposit upserts.
+BEGIN;
+
+-- No new balance rows while duplicates are merged and the index is built
+LOCK TABLE user_balances IN SHARE ROW EXCLUSIVE MODE;
+
+-- Fold duplicate rows' totals into the oldest row of each (telegram_id, currency)
+WITH dup AS (
+    SELECT telegram_id, currency, min(id) AS keep_id,
+           coalesce(sum(available), 0) AS available,
+           coalesce(sum(frozen), 0) AS frozen,
+           coalesce(sum(total_deposited), 0) AS total_deposited,
+           coalesce(sum(total_withdrawn), 0) AS total_withdrawn
+    FROM user_balances
+    WHERE telegram_id IS NOT NULL AND currency IS NOT NULL
+    GROUP BY telegram_id, currency
+    HAVING count(*) > 1
+)
+UPDATE user_balances b SET
+    available = dup.available,
+    frozen = dup.frozen,
+    total_deposited = dup.total_deposited,
+    total_withdrawn = dup.total_withdrawn,
+    updated_at = now()
+FROM dup
+WHERE b.id = dup.keep_id;
+
+-- Drop the merged rows
+DELETE FROM user_balances b
+USING user_balances k
+WHERE k.telegram_id = b.telegram_id AND k.currency = b.currency AND k.id < b.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_user_balances_telegram_id_currency
+    ON user_balances (telegram_id, currency);
+
+COMMIT;
@@ -0,0 +1,34 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from app.services.stats_collector import StatsCollector
+
+
+def _row(days_ago: int, subscriber_count: int) -> SimpleNamespace:
+    # Same shape as _preload_history rows: tz-aware datetime dates
+    return SimpleNamespace(
+        date=datetime.now(timezone.utc) - timedelta(days=days_ago),
+        subscriber_count=subscriber_count,
+    )
+
+
+def _growth(history: list, subscriber_count: int) -> SimpleNamespace:
+    stats = SimpleNamespace(subscriber_count=subscriber_count)
+    asyncio.run(StatsCollector()._calculate_growth(None, stats, 1, history=history))
+    return stats
+
+
+def test_growth_from_preloaded_history_with_datetime_dates():
+    history = [_row(29, 800), _row(6, 1000), _row(1, 1040)]
+    stats = _growth(history, 1100)
+    assert stats.subscriber_growth_30d == 300  # earliest row within 30 days
+    assert stats.subscriber_growth_7d == 100  # earliest row within 7 days
+    assert stats.dynamics == "growing"
+
+
+def test_growth_without_history_rows_is_stable():
+    stats = _growth([], 500)
+    assert not hasattr(stats, "subscriber_growth_7d")
+    assert stats.dynamics == "stable"
+    assert stats.dynamics_score == 0